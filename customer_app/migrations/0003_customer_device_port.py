@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-18 07:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_app', '0002_customer_latitude_customer_longitude'),
+        ('networkdevice_app', '0006_alter_design_company'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='device_port',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='customers', to='networkdevice_app.deviceport', verbose_name='Device Port'),
+        ),
+    ]
@@ -12,6 +12,8 @@ class Customer(models.Model):
     address = models.TextField()
     latitude = models.FloatField()
     longitude = models.FloatField()
+    device_port = models.ForeignKey('networkdevice_app.DevicePort', on_delete=models.SET_NULL, null=True, blank=True,
+                                    related_name='customers', verbose_name="Device Port")
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -6,4 +6,11 @@ class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Customer
         fields = '__all__' 
-        read_only_fields = ['created_at']  
\ No newline at end of file
+        read_only_fields = ['created_at']
+
+    def validate(self, attrs):
+        port = attrs.get('device_port', getattr(self.instance, 'device_port', None))
+        office = attrs.get('office', getattr(self.instance, 'office', None))
+        if port is not None and office is not None and port.device.office.company_id != office.company_id:
+            raise serializers.ValidationError({"device_port": "Port belongs to another company's device."})
+        return attrs
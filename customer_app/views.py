@@ -7,8 +7,8 @@ from rest_framework.exceptions import ValidationError
 from django.http import Http404
 from django.core.exceptions import ObjectDoesNotExist
 from .models import Customer
+from opticalfiber_app.cache import TenantCache
 from opticalfiber_app.views import BaseAPIView
-from opticalfiber_app.models import Staff
 from .serializers import CustomerSerializer
 from office.models import Office
 import logging
@@ -21,20 +21,6 @@ class CustomerAPIView(BaseAPIView):
     API view to retrieve and create customers for the authenticated staff's office.
     """
 
-    def get_authenticated_user(self, request):
-        try:
-            auth_user = self.authentication(request)
-            user_id = auth_user.get('id')
-            if not user_id:
-                return None, "Unauthorized access"
-
-            staff_member = Staff.objects.select_related('company').get(pk=user_id)
-            return staff_member, None
-        except Staff.DoesNotExist:
-            return None, "Staff member not found in the database."
-        except Exception as e:
-            return None, f"Authentication error: {str(e)}"
-
     def post(self, request):
         user, error = self.get_authenticated_user(request)
         if error:
@@ -65,10 +51,16 @@ class CustomerListView(CustomerAPIView):
             return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
 
         try:
-            office = get_object_or_404(Office, pk=office_id)
-            customers = Customer.objects.filter(office=office)
-            serializer = CustomerSerializer(customers, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            office = Office.objects.filter(pk=office_id, company_id=user.company_id).first()
+            if not office:
+                return Response({"error": "Office not found."}, status=status.HTTP_404_NOT_FOUND)
+
+            def build():
+                customers = Customer.objects.filter(office=office)
+                return list(CustomerSerializer(customers, many=True).data)
+
+            data = TenantCache.get_or_build(user.company_id, 'customers', build, office.pk)
+            return Response(data, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"error": f"Failed to retrieve customers: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -78,21 +70,6 @@ class CustomerManagementAPIView(CustomerAPIView):
     API view to retrieve, update, or delete a specific customer by ID with staff validation.
     """
 
-    def get_authenticated_user(self, request):
-        try:
-            auth_user = self.authentication(request)
-            user_id = auth_user.get('id')
-            if not user_id:
-                return None, "Unauthorized access"
-
-            staff_member = Staff.objects.select_related('company').get(pk=user_id)
-            return staff_member, None
-        except Staff.DoesNotExist:
-            return None, "Staff member not found in the database."
-        except Exception as e:
-            return None, f"Authentication error: {str(e)}"
-
-
     def get(self, request, customer_id):
         # Authenticate user
         user, auth_error = self.get_authenticated_user(request)
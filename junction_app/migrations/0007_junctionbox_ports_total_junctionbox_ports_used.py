@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 07:29
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def sum_device_ports(apps, schema_editor):
+    JunctionBox = apps.get_model('junction_app', 'JunctionBox')
+    JunctionBoxDevice = apps.get_model('junction_app', 'JunctionBoxDevice')
+    sums = (JunctionBoxDevice.objects.values('junction_box_id')
+            .annotate(total=Sum('device__ports_total'), used=Sum('device__ports_used')))
+    boxes = [
+        JunctionBox(pk=row['junction_box_id'], ports_total=row['total'] or 0, ports_used=row['used'] or 0)
+        for row in sums
+    ]
+    JunctionBox.objects.bulk_update(boxes, ['ports_total', 'ports_used'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('junction_app', '0006_remove_junctionbox_location_junctionbox_latitude_and_more'),
+        ('networkdevice_app', '0009_networkdevice_ports_total_networkdevice_ports_used'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='junctionbox',
+            name='ports_total',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Ports Recorded'),
+        ),
+        migrations.AddField(
+            model_name='junctionbox',
+            name='ports_used',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Ports In Use'),
+        ),
+        migrations.RunPython(sum_device_ports, migrations.RunPython.noop),
+    ]
@@ -15,6 +15,9 @@ class JunctionBox(models.Model):
     description = models.TextField(null=True, blank=True, verbose_name="Description")
     staff = models.ForeignKey(Staff, on_delete=models.CASCADE,  verbose_name="Staff Member")
     junction_type = models.CharField(max_length=50, choices=[('Main', 'Main'), ('Child', 'Child')], default='Child', verbose_name="Junction Box Type")
+    # Sums of the counters of the devices installed in the box.
+    ports_total = models.PositiveIntegerField(default=0, editable=False, verbose_name="Ports Recorded")
+    ports_used = models.PositiveIntegerField(default=0, editable=False, verbose_name="Ports In Use")
 
     def __str__(self):
         return f"{self.name} - {self.junction_type}"
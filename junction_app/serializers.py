@@ -6,7 +6,7 @@ class JunctionBoxSerializer(serializers.ModelSerializer):
     class Meta:
         model = JunctionBox
         fields = "__all__"
-        read_only_fields = ['created_at']
+        read_only_fields = ['created_at', 'ports_total', 'ports_used']
 
 
 
@@ -5,27 +5,13 @@ from rest_framework import status
 from .models import JunctionBox, JunctionBoxDevice
 from .serializers import JunctionBoxSerializer, JunctionDeviceSerializer
 from opticalfiber_app.views import BaseAPIView
-from opticalfiber_app.models import Staff
+from opticalfiber_app.cache import TenantCache
 
 class JunctionAPIView(BaseAPIView):
     """
     Handles the creation and retrieval of Junctions.
     """
 
-    def get_authenticated_user(self, request):
-        try:
-            auth_user = self.authentication(request)
-            user_id = auth_user.get('id')
-            if not user_id:
-                return None, "Unauthorized access"
-
-            staff_member = Staff.objects.select_related('company').get(pk=user_id)
-            return staff_member, None
-        except Staff.DoesNotExist:
-            return None, "Staff member not found in the database."
-        except Exception as e:
-            return None, f"An error occurred while fetching staff details: {str(e)}"
-
     def post(self, request):
         try:
             auth_user, error = self.get_authenticated_user(request)
@@ -49,10 +35,12 @@ class JunctionAPIView(BaseAPIView):
         if error:
             return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            # Optional: Filter by staff's company if needed
-            junctions = JunctionBox.objects.filter(office__company=auth_user.company).all()
-            serializer = JunctionBoxSerializer(junctions, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            def build():
+                junctions = JunctionBox.objects.filter(office__company_id=auth_user.company_id)
+                return list(JunctionBoxSerializer(junctions, many=True).data)
+
+            data = TenantCache.get_or_build(auth_user.company_id, 'junctions', build)
+            return Response(data, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
@@ -63,20 +51,6 @@ class JunctionDetailAPIView(BaseAPIView):
     Handles the retrieval, update, and deletion of a specific Junction.
     """
 
-    def get_authenticated_user(self, request):
-        try:
-            auth_user = self.authentication(request)
-            user_id = auth_user.get('id')
-            if not user_id:
-                return None, "Unauthorized access"
-
-            staff_member = Staff.objects.select_related('company').get(pk=user_id)
-            return staff_member, None
-        except Staff.DoesNotExist:
-            return None, "Staff member not found in the database."
-        except Exception as e:
-            return None, f"An error occurred while fetching staff details: {str(e)}"
-        
     def get(self, request, pk):
         auth_user, error = self.get_authenticated_user(request)
         if error:
@@ -121,20 +95,6 @@ class JunctionDeviceAPIView(BaseAPIView):
     Handles the creation and retrieval of Junction Devices.
     """
 
-    def get_authenticated_user(self, request):
-        try:
-            auth_user = self.authentication(request)
-            user_id = auth_user.get('id')
-            if not user_id:
-                return None, "Unauthorized access"
-
-            staff_member = Staff.objects.select_related('company').get(pk=user_id)
-            return staff_member, None
-        except Staff.DoesNotExist:
-            return None, "Staff member not found in the database."
-        except Exception as e:
-            return None, f"An error occurred while fetching staff details: {str(e)}"
-        
     def post(self, request,pk):
         auth_user, error = self.get_authenticated_user(request)
         if error:
@@ -165,20 +125,6 @@ class JunctionDeviceDetailAPIView(BaseAPIView):
     Handles the retrieval, update, and deletion of a specific Junction Device.
     """
 
-    def get_authenticated_user(self, request):
-        try:
-            auth_user = self.authentication(request)
-            user_id = auth_user.get('id')
-            if not user_id:
-                return None, "Unauthorized access"
-
-            staff_member = Staff.objects.select_related('company').get(pk=user_id)
-            return staff_member, None
-        except Staff.DoesNotExist:
-            return None, "Staff member not found in the database."
-        except Exception as e:
-            return None, f"An error occurred while fetching staff details: {str(e)}"
-        
     def get(self, request, pk):
         auth_user, error = self.get_authenticated_user(request)
         if error:
@@ -1,3 +1,6 @@
 from django.contrib import admin
-
+from .models import CompanyChangeSequence, ChangeLogEntry
 # Register your models here.
+
+admin.site.register(CompanyChangeSequence)
+admin.site.register(ChangeLogEntry)
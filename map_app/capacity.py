@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models import Count, Sum
+from junction_app.models import JunctionBox, JunctionBoxDevice
+from networkdevice_app.models import NetworkDevice, DevicePort
+
+CAPACITY_FIELDS = ['ports_total', 'ports_used']
+
+
+def device_port_counts(device_ids):
+    """``{device_id: (ports_total, ports_used)}`` counted from the port and customer tables."""
+    totals = dict(
+        DevicePort.objects.filter(device_id__in=device_ids).values('device_id')
+        .annotate(n=Count('id')).values_list('device_id', 'n')
+    )
+    used = dict(
+        DevicePort.objects.filter(device_id__in=device_ids, customers__isnull=False).values('device_id')
+        .annotate(n=Count('id', distinct=True)).values_list('device_id', 'n')
+    )
+    return {device_id: (totals.get(device_id, 0), used.get(device_id, 0)) for device_id in device_ids}
+
+
+def junction_port_counts(junction_ids):
+    """``{junction_id: (ports_total, ports_used)}`` summed over the devices installed in each box."""
+    sums = {
+        row['junction_box_id']: (row['total'] or 0, row['used'] or 0)
+        for row in JunctionBoxDevice.objects.filter(junction_box_id__in=junction_ids).values('junction_box_id')
+        .annotate(total=Sum('device__ports_total'), used=Sum('device__ports_used'))
+    }
+    return {junction_id: sums.get(junction_id, (0, 0)) for junction_id in junction_ids}
+
+
+def _refresh(model, ids, counts_for):
+    """
+    Lock the rows, recount and write back the counters that moved. Locking
+    first serializes concurrent changes to the same row, and each count
+    runs after the lock is held, so it sees every change committed before.
+    Returns the ids whose counters changed.
+    """
+    ids = {object_id for object_id in ids if object_id is not None}
+    if not ids:
+        return []
+    with transaction.atomic():
+        current = {
+            row[0]: row[1:] for row in model.objects.select_for_update().filter(pk__in=ids)
+            .order_by('pk').values_list('pk', *CAPACITY_FIELDS)
+        }
+        counts = counts_for(list(current))
+        changed = [object_id for object_id, values in counts.items() if values != current[object_id]]
+        for object_id in changed:
+            total, used = counts[object_id]
+            model.objects.filter(pk=object_id).update(ports_total=total, ports_used=used)
+    return changed
+
+
+def refresh_junction_capacity(junction_ids):
+    """Recount junction boxes; returns the JunctionBox instances whose counters changed."""
+    changed = _refresh(JunctionBox, junction_ids, junction_port_counts)
+    return list(JunctionBox.objects.filter(pk__in=changed))
+
+
+def refresh_device_capacity(device_ids):
+    """
+    Recount devices and the junction boxes they sit in. Returns the
+    NetworkDevice and JunctionBox instances whose counters changed.
+    """
+    with transaction.atomic():
+        changed = _refresh(NetworkDevice, device_ids, device_port_counts)
+        if not changed:
+            return []
+        junction_ids = JunctionBoxDevice.objects.filter(device_id__in=changed).values_list('junction_box_id', flat=True)
+        return list(NetworkDevice.objects.filter(pk__in=changed)) + refresh_junction_capacity(set(junction_ids))
+
+
+def port_devices(port_ids):
+    return set(DevicePort.objects.filter(pk__in=[pk for pk in port_ids if pk is not None])
+               .values_list('device_id', flat=True))
@@ -0,0 +1,138 @@
+import uuid
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from customer_app.models import Customer
+from customer_app.serializers import CustomerSerializer
+from junction_app.models import JunctionBox, JunctionBoxDevice
+from junction_app.serializers import JunctionBoxSerializer, JunctionDeviceSerializer
+from networkdevice_app.models import NetworkDevice, DevicePort
+from networkdevice_app.serializers import NetworkDeviceSerializer, DevicePortSerializer
+from office.models import Office, Branch
+from opticalfiber_app.utils import company_id_for
+from office.serializers import OfficeSerializer, BranchSerializer
+from route_app.models import FiberRoute
+from route_app.serializers import FiberRouteSerializer
+from .models import CompanyChangeSequence, ChangeLogEntry
+
+MAX_CHANGES_PER_PAGE = 1000
+
+# Replaced in the shared cache after every committed change, so per-process
+# structures built from the logged models can cheaply tell they are stale.
+CHANGE_VERSION_KEY = "map_change_version_{company_id}"
+
+
+class ChangeEntity:
+    """
+    A model whose rows are tracked in the change log: how it is scoped to a
+    company and which serializer renders its current state.
+    """
+
+    def __init__(self, name, model, company_lookup, serializer_class):
+        self.name = name
+        self.model = model
+        self.company_lookup = company_lookup
+        self.serializer_class = serializer_class
+
+    def company_id_for(self, instance):
+        return company_id_for(instance, self.company_lookup)
+
+    def current_rows(self, company_id, ids):
+        queryset = self.model.objects.filter(pk__in=ids, **{self.company_lookup: company_id})
+        return {row['id']: row for row in self.serializer_class(queryset, many=True).data}
+
+
+CHANGE_ENTITIES = {
+    entity.name: entity for entity in (
+        ChangeEntity('office', Office, 'company_id', OfficeSerializer),
+        ChangeEntity('branch', Branch, 'office__company_id', BranchSerializer),
+        ChangeEntity('route', FiberRoute, 'office__company_id', FiberRouteSerializer),
+        ChangeEntity('junction', JunctionBox, 'office__company_id', JunctionBoxSerializer),
+        ChangeEntity('junction_device', JunctionBoxDevice, 'junction_box__office__company_id',
+                     JunctionDeviceSerializer),
+        ChangeEntity('device', NetworkDevice, 'office__company_id', NetworkDeviceSerializer),
+        ChangeEntity('port', DevicePort, 'device__office__company_id', DevicePortSerializer),
+        ChangeEntity('customer', Customer, 'office__company_id', CustomerSerializer),
+    )
+}
+
+CHANGE_ENTITY_BY_MODEL = {entity.model: entity for entity in CHANGE_ENTITIES.values()}
+
+
+def record_change(company_id, entity, object_id, op, bump=True):
+    """
+    Append one entry to the company's change log and return its sequence number.
+
+    Must run inside the transaction that made the change: the increment locks
+    the company's sequence row until commit, so entries become visible in
+    sequence order and a reader never skips a number that commits late.
+    With ``bump=False`` the change version is left alone, for entries that
+    no per-process structure built from the log depends on.
+    """
+    with transaction.atomic():
+        sequences = CompanyChangeSequence.objects.filter(company_id=company_id)
+        if not sequences.update(last_seq=F('last_seq') + 1):
+            CompanyChangeSequence.objects.get_or_create(company_id=company_id)
+            sequences.update(last_seq=F('last_seq') + 1)
+        seq = sequences.values_list('last_seq', flat=True).get()
+        ChangeLogEntry.objects.create(company_id=company_id, seq=seq, entity=entity, object_id=object_id, op=op)
+    if bump:
+        transaction.on_commit(lambda: bump_change_version(company_id))
+    return seq
+
+
+def change_version(company_id):
+    # A random token rather than a counter, so an evicted version never reissues an old value.
+    return cache.get_or_set(CHANGE_VERSION_KEY.format(company_id=company_id), uuid.uuid4().hex, timeout=None)
+
+
+def bump_change_version(company_id):
+    cache.set(CHANGE_VERSION_KEY.format(company_id=company_id), uuid.uuid4().hex, timeout=None)
+
+
+def latest_seq(company_id):
+    return CompanyChangeSequence.objects.filter(company_id=company_id).values_list('last_seq', flat=True).first() or 0
+
+
+def changes_since(company_id, since, limit=MAX_CHANGES_PER_PAGE):
+    """
+    Net changes after ``since``: every touched row appears once, with its
+    current serialized state or as a tombstone. Returns ``(changes, last_seq, has_more)``
+    where ``last_seq`` is the value to pass as ``since`` next time.
+    """
+    entries = list(
+        ChangeLogEntry.objects.filter(company_id=company_id, seq__gt=since)
+        .order_by('seq').values('seq', 'entity', 'object_id', 'op')[:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}
+    for entry in entries:
+        key = (entry['entity'], entry['object_id'])
+        latest.pop(key, None)
+        latest[key] = entry
+
+    upserts = {}
+    for entry in latest.values():
+        if entry['op'] == 'upsert' and entry['entity'] in CHANGE_ENTITIES:
+            upserts.setdefault(entry['entity'], []).append(entry['object_id'])
+    rows = {
+        name: CHANGE_ENTITIES[name].current_rows(company_id, ids)
+        for name, ids in upserts.items()
+    }
+
+    changes = []
+    for entry in latest.values():
+        data = rows.get(entry['entity'], {}).get(entry['object_id'])
+        changes.append({
+            'seq': entry['seq'],
+            'entity': entry['entity'],
+            'id': entry['object_id'],
+            # A row missing here was deleted after this page; its tombstone follows.
+            'op': 'upsert' if data is not None else 'delete',
+            'data': data,
+        })
+
+    last_seq = entries[-1]['seq'] if entries else since
+    return changes, last_seq, has_more
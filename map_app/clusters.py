@@ -0,0 +1,135 @@
+import math
+from django.core.cache import cache
+from .spatial import CompanyIndexCache, company_indexes
+from .tiles import MAX_TILE_ZOOM, world_xy
+
+# Side of a cluster cell in screen pixels. 256 is divisible by it, so every cell
+# at zoom z splits into exactly four cells at zoom z + 1.
+CLUSTER_CELL_PX = 64
+
+CLUSTER_LAYERS = ('customer', 'junction', 'device')
+DEFAULT_CLUSTER_LAYERS = ('customer', 'device')
+
+# Up to this zoom the clusters of the whole company are computed once and cached;
+# deeper zooms only cluster the points under the requested viewport.
+MAX_CACHED_CLUSTER_ZOOM = 14
+
+
+def cells_per_side(zoom):
+    return 2 ** zoom * (256 // CLUSTER_CELL_PX)
+
+
+def cluster_cell(lat, lng, zoom):
+    wx, wy = world_xy(lat, lng)
+    n = cells_per_side(zoom)
+    return min(int(wx * n), n - 1), min(int(wy * n), n - 1)
+
+
+def cell_bounds(zoom, cx, cy):
+    """Return ``(south, west, north, east)`` of a cluster cell."""
+    n = cells_per_side(zoom)
+
+    def lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return lat(cy + 1), cx / n * 360.0 - 180.0, lat(cy), (cx + 1) / n * 360.0 - 180.0
+
+
+def is_valid_cell(zoom, cx, cy):
+    return 0 <= zoom <= MAX_TILE_ZOOM and 0 <= cx < cells_per_side(zoom) and 0 <= cy < cells_per_side(zoom)
+
+
+def cluster_points(points, zoom):
+    """
+    Group ``(layer, feature)`` pairs by cluster cell at ``zoom``. Cells holding
+    one point come back as that point; the rest as a centroid with counts per layer.
+    """
+    groups = {}
+    for layer, feature in points:
+        cell = cluster_cell(feature['latitude'], feature['longitude'], zoom)
+        group = groups.get(cell)
+        if group is None:
+            groups[cell] = group = {'count': 0, 'lat': 0.0, 'lng': 0.0, 'layers': {}, 'first': (layer, feature)}
+        group['count'] += 1
+        group['lat'] += feature['latitude']
+        group['lng'] += feature['longitude']
+        group['layers'][layer] = group['layers'].get(layer, 0) + 1
+
+    clusters = []
+    for (cx, cy), group in groups.items():
+        cluster = {
+            'id': f"{zoom}/{cx}/{cy}",
+            'count': group['count'],
+            'latitude': group['lat'] / group['count'],
+            'longitude': group['lng'] / group['count'],
+            'layers': group['layers'],
+        }
+        if group['count'] == 1:
+            layer, feature = group['first']
+            cluster['feature'] = {'layer': layer, **feature}
+        clusters.append(cluster)
+    return clusters
+
+
+def _layer_points(index, layers, south=-90.0, west=-180.0, north=90.0, east=180.0):
+    wanted = set(layers)
+    for (layer, _), feature in index.points.query_bbox(south, west, north, east):
+        if layer in wanted:
+            yield layer, feature
+
+
+class ClusterCache:
+    """
+    Per-company, per-zoom clusters in the shared cache. Keys carry the map index
+    version, so any change to a mapped row retires every cached zoom of that company.
+    """
+
+    KEY = "map_clusters_{company_id}_{version}_{zoom}_{layers}"
+    TIMEOUT = 60 * 60 * 24
+
+    @classmethod
+    def clusters(cls, company_id, zoom, layers, bbox):
+        """Clusters at ``zoom`` whose centroid lies inside ``bbox`` (``south, west, north, east``)."""
+        south, west, north, east = bbox
+        if zoom > MAX_CACHED_CLUSTER_ZOOM:
+            # Snap the viewport out to whole cells so edge clusters keep their full membership.
+            min_cx, min_cy = cluster_cell(north, west, zoom)
+            max_cx, max_cy = cluster_cell(south, east, zoom)
+            snapped_south, snapped_west, _, _ = cell_bounds(zoom, min_cx, max_cy)
+            _, _, snapped_north, snapped_east = cell_bounds(zoom, max_cx, min_cy)
+            index = company_indexes.get(company_id)
+            clusters = cluster_points(
+                _layer_points(index, layers, snapped_south, snapped_west, snapped_north, snapped_east), zoom
+            )
+        else:
+            key = cls.KEY.format(company_id=company_id, version=CompanyIndexCache.current_version(company_id),
+                                 zoom=zoom, layers=",".join(sorted(layers)))
+            clusters = cache.get(key)
+            if clusters is None:
+                clusters = cluster_points(_layer_points(company_indexes.get(company_id), layers), zoom)
+                cache.set(key, clusters, timeout=cls.TIMEOUT)
+
+        return [
+            cluster for cluster in clusters
+            if south <= cluster['latitude'] <= north and west <= cluster['longitude'] <= east
+        ]
+
+    @staticmethod
+    def expand(company_id, zoom, cx, cy, layers):
+        """
+        Split one cluster: returns ``(expansion_zoom, children)`` where children
+        are the clusters its points form at the first deeper zoom where they no
+        longer share a cell. Points that never separate come back individually
+        with an expansion zoom of None.
+        """
+        index = company_indexes.get(company_id)
+        south, west, north, east = cell_bounds(zoom, cx, cy)
+        points = [
+            (layer, feature) for layer, feature in _layer_points(index, layers, south, west, north, east)
+            if cluster_cell(feature['latitude'], feature['longitude'], zoom) == (cx, cy)
+        ]
+        for child_zoom in range(zoom + 1, MAX_TILE_ZOOM + 1):
+            children = cluster_points(points, child_zoom)
+            if len(children) > 1:
+                return child_zoom, children
+        return None, [{'layer': layer, **feature} for layer, feature in points]
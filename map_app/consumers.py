@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from urllib.parse import parse_qs
+import jwt
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+from opticalfiber_app.authentication import principals
+from opticalfiber_app.revocation import token_revocations
+from opticalfiber_app.utils import TokenService
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait after the first change before flushing, so bursts share a batch.
+FLUSH_DELAY = 0.2
+# Changes sent per batch.
+MAX_BATCH = 500
+# Distinct pending entities a client may fall behind by before it is told to resync.
+MAX_PENDING = 5000
+
+
+def company_group(company_id):
+    return f"map_company_{company_id}"
+
+
+def publish_map_change(company_id, entity, op, object_id, data=None):
+    """
+    Broadcast one create/update/delete to every map client of the company.
+    Failures are logged and swallowed so a channel layer outage never breaks a write.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(company_group(company_id), {
+            "type": "map.change",
+            "entity": entity,
+            "op": op,
+            "id": object_id,
+            "data": data,
+        })
+    except Exception:
+        logger.exception("Failed to publish %s %s %s for company %s", entity, op, object_id, company_id)
+
+
+class MapDataConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes map diffs (routes, junctions, devices, customers) to the open map
+    clients of one company.
+
+    Connect with ``ws/map-data/?token=<login JWT>`` (or an Authorization header).
+    The server sends ``{"type": "changes", "batch": n, "changes": [...]}`` and
+    waits for ``{"type": "ack", "batch": n}`` before sending the next batch.
+    While a client is behind, changes to the same entity are coalesced into its
+    latest state; if it falls more than MAX_PENDING entities behind it receives
+    a single ``{"type": "resync"}`` and should reload the snapshot instead.
+    """
+
+    async def connect(self):
+        self.company_id = None
+        self.pending = {}
+        self.overflowed = False
+        self.batch = 0
+        self.awaiting_ack = False
+        self.flush_handle = None
+
+        decoded = self.decode_token()
+        if decoded is None or not await self.is_authorized(decoded):
+            await self.close(code=4401)
+            return
+
+        self.company_id = decoded['company']
+        self.group_name = company_group(self.company_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        if self.company_id is not None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    def decode_token(self):
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        token = (query.get("token") or [None])[0]
+        if token is None:
+            headers = dict(self.scope.get("headers", []))
+            token = headers.get(b"authorization", b"").decode() or None
+        if not token:
+            return None
+        try:
+            decoded = TokenService.decode(token)
+        except jwt.InvalidTokenError:
+            return None
+        if 'id' not in decoded or 'company' not in decoded:
+            return None
+        return decoded
+
+    @database_sync_to_async
+    def is_authorized(self, decoded):
+        # The revocation check can reach Redis, so it runs off the event loop with the principal lookup.
+        if token_revocations.is_revoked(decoded):
+            return False
+        staff = principals.get(decoded['id'])
+        return staff is not None and staff.is_active and staff.company_id == decoded['company']
+
+    async def receive_json(self, content, **kwargs):
+        message_type = content.get("type")
+        if message_type == "ack":
+            if content.get("batch") == self.batch:
+                self.awaiting_ack = False
+                await self.flush()
+        elif message_type == "ping":
+            await self.send_json({"type": "pong"})
+
+    async def map_change(self, event):
+        key = (event["entity"], event["id"])
+        previous = self.pending.pop(key, None)
+        change = {"entity": event["entity"], "op": event["op"], "id": event["id"], "data": event["data"]}
+
+        if previous is not None and previous["op"] == "create":
+            if change["op"] == "delete":
+                # Created and deleted before the client saw it.
+                return
+            change["op"] = "create"
+
+        if self.overflowed:
+            return
+        self.pending[key] = change
+        if len(self.pending) > MAX_PENDING:
+            self.pending.clear()
+            self.overflowed = True
+
+        if self.flush_handle is None and not self.awaiting_ack:
+            loop = asyncio.get_running_loop()
+            self.flush_handle = loop.call_later(FLUSH_DELAY, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        self.flush_handle = None
+        if self.awaiting_ack:
+            return
+
+        if self.overflowed:
+            self.overflowed = False
+            self.batch += 1
+            self.awaiting_ack = True
+            await self.send_json({"type": "resync", "batch": self.batch})
+            return
+
+        if not self.pending:
+            return
+
+        keys = list(self.pending)[:MAX_BATCH]
+        changes = [self.pending.pop(key) for key in keys]
+        self.batch += 1
+        self.awaiting_ack = True
+        await self.send_json({"type": "changes", "batch": self.batch, "changes": changes})
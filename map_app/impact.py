@@ -0,0 +1,67 @@
+import numpy as np
+from route_app.geometry import point_along_path
+from .topology import KIND_NAMES, OFFICE, ROUTE, JUNCTION, DEVICE, CUSTOMER
+
+# Snap distance in metres used when a cut is given as a bare coordinate.
+DEFAULT_SNAP_DISTANCE_M = 100
+MAX_SNAP_DISTANCE_M = 1000
+
+IMPACT_KINDS = (OFFICE, ROUTE, JUNCTION, DEVICE, CUSTOMER)
+
+
+def locate_cut(index, lat=None, lng=None, route_id=None, distance_m=None, max_distance=DEFAULT_SNAP_DISTANCE_M):
+    """
+    Resolve a cut to a route of the company's map index, either by snapping
+    ``(lat, lng)`` to the nearest route segment or as ``distance_m`` metres
+    along ``route_id``. Returns ``{"route", "latitude", "longitude", "along_m",
+    "snap_distance_m"}`` or None when nothing matches.
+    """
+    if route_id is not None:
+        stored = index.routes.get(route_id)
+        if stored is None:
+            return None
+        _, points, _, route = stored
+        along, point = point_along_path(np.array(points, dtype=float), distance_m or 0.0)
+        snap_distance = 0.0
+    else:
+        found = index.nearest_route(lat, lng, max_distance)
+        if found is None:
+            return None
+        route, snap_distance, along, point = found
+
+    return {
+        "route": {"id": route["id"], "name": route["name"]},
+        "latitude": round(point[0], 7),
+        "longitude": round(point[1], 7),
+        "along_m": round(along, 1),
+        "snap_distance_m": round(snap_distance, 1),
+    }
+
+
+def cut_impact(topology, route_id):
+    """
+    Everything that loses its feed when ``route_id`` is cut anywhere along
+    its length. The topology is a forest rooted at the OLT sites, so a node's
+    dominators are exactly its ancestors and the elements cut off are the
+    route's subtree, one slice of the precomputed preorder.
+
+    Returns ``(connected, olt, affected)``: whether the route was fed by an
+    OLT at all, that OLT node, and ``{kind name: [{"id", "name"}, ...]}``.
+    """
+    node = topology.node(ROUTE, route_id)
+    affected = {KIND_NAMES[kind]: [] for kind in IMPACT_KINDS}
+    if node is None:
+        return False, None, affected
+
+    _, olt = topology.trace(node)
+    downstream = topology.subtree(node)[1:]
+    kinds = np.asarray(topology.kind, dtype=np.int8)[downstream]
+    object_ids = np.asarray(topology.object_id, dtype=np.int64)[downstream]
+    labels = topology.labels
+    for kind in IMPACT_KINDS:
+        selected = kinds == kind
+        affected[KIND_NAMES[kind]] = [
+            {"id": object_id, "name": labels[member]}
+            for member, object_id in zip(downstream[selected].tolist(), object_ids[selected].tolist())
+        ]
+    return olt is not None, olt, affected
@@ -0,0 +1,74 @@
+from customer_app.models import Customer
+from junction_app.models import JunctionBox
+from networkdevice_app.models import NetworkDevice
+from office.models import Office, Branch
+
+
+class MapLayer:
+    """
+    Describes how one model is drawn on the map: where its coordinates live,
+    how it is scoped to a company and which extra columns go out with each point.
+    """
+
+    def __init__(self, name, model, lat_field, lng_field, company_lookup, fields=()):
+        self.name = name
+        self.model = model
+        self.lat_field = lat_field
+        self.lng_field = lng_field
+        self.company_lookup = company_lookup
+        self.fields = tuple(fields)
+
+    def rows(self, company_id, ids=None):
+        """Flat rows for every point of this layer that belongs to the company, optionally only ``ids``."""
+        columns = ('id', self.lat_field, self.lng_field) + self.fields
+        queryset = self.model.objects.filter(**{self.company_lookup: company_id})
+        if ids is not None:
+            queryset = queryset.filter(pk__in=ids)
+        for row in queryset.values(*columns).iterator(chunk_size=5000):
+            yield self.to_feature(row)
+
+    def to_feature(self, row):
+        feature = {
+            'id': row['id'],
+            'latitude': row[self.lat_field],
+            'longitude': row[self.lng_field],
+        }
+        for field in self.fields:
+            feature[field] = row[field]
+        return feature
+
+    def instance_feature(self, instance):
+        """The same feature dict built from a model instance instead of a values() row."""
+        columns = ('id', self.lat_field, self.lng_field) + self.fields
+        return self.to_feature({column: getattr(instance, column) for column in columns})
+
+
+MAP_LAYERS = {
+    layer.name: layer for layer in (
+        MapLayer('customer', Customer, 'latitude', 'longitude', 'office__company_id',
+                 fields=('name', 'office_id')),
+        MapLayer('junction', JunctionBox, 'latitude', 'longitude', 'office__company_id',
+                 fields=('name', 'office_id', 'junction_type', 'ports_total', 'ports_used')),
+        MapLayer('device', NetworkDevice, 'latitude', 'logitutde', 'office__company_id',
+                 fields=('model_name', 'device_type', 'office_id', 'ports_total', 'ports_used')),
+        MapLayer('office', Office, 'latitude', 'longitude', 'company_id',
+                 fields=('name',)),
+        MapLayer('branch', Branch, 'latitude', 'logitude', 'office__company_id',
+                 fields=('name', 'office_id')),
+    )
+}
+
+LAYER_BY_MODEL = {layer.model: layer for layer in MAP_LAYERS.values()}
+
+
+def company_id_for(instance):
+    """
+    Resolve the owning company of any mapped row without loading the full
+    related objects.
+    """
+    if isinstance(instance, Office):
+        return instance.company_id
+    office_id = getattr(instance, 'office_id', None)
+    if office_id is None:
+        return None
+    return Office.objects.filter(pk=office_id).values_list('company_id', flat=True).first()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from networkdevice_app.models import NetworkDevice
+from junction_app.models import JunctionBox
+from map_app.capacity import refresh_device_capacity, refresh_junction_capacity
+from map_app.signals import announce_capacity
+
+
+class Command(BaseCommand):
+    help = ("Recount the port counters of every device and junction box, e.g. after bulk imports "
+            "that bypassed model signals.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help="Only recount this company's devices and boxes.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows recounted per transaction.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        fixed = 0
+        for model, refresh in ((NetworkDevice, refresh_device_capacity), (JunctionBox, refresh_junction_capacity)):
+            rows = model.objects.order_by('pk')
+            if options['company']:
+                rows = rows.filter(office__company_id=options['company'])
+            last_id = 0
+            while True:
+                batch = list(rows.filter(pk__gt=last_id).values_list('pk', flat=True)[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1]
+                changed = refresh(batch)
+                announce_capacity(changed)
+                fixed += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f"Recounted port capacity. {fixed} rows corrected."))
@@ -1,3 +1,42 @@
 from django.db import models
+from opticalfiber_app.models import Company
 
-# Create your models here.
+
+class CompanyChangeSequence(models.Model):
+    """
+    Last change sequence number handed out for a company. The row is locked
+    while a change is recorded, so sequence numbers commit in order.
+    """
+    company = models.OneToOneField(Company, on_delete=models.CASCADE, primary_key=True, related_name="change_sequence")
+    last_seq = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.company_id} @ {self.last_seq}"
+
+
+class ChangeLogEntry(models.Model):
+    """
+    One insert, update or delete of a map entity, numbered per company.
+    """
+    OP_CHOICES = (
+        ('upsert', 'Upsert'),
+        ('delete', 'Delete'),
+    )
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name="change_log")
+    seq = models.BigIntegerField()
+    entity = models.CharField(max_length=32)
+    object_id = models.BigIntegerField()
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Change Log Entry'
+        verbose_name_plural = 'Change Log Entries'
+        ordering = ['company', 'seq']
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'seq'], name='map_changelog_company_seq'),
+        ]
+
+    def __str__(self):
+        return f"{self.company_id}#{self.seq} {self.op} {self.entity} {self.object_id}"
@@ -0,0 +1,202 @@
+import threading
+import numpy as np
+from django.conf import settings
+from networkdevice_app.models import NetworkDevice, DevicePort
+from networkdevice_app.optics import device_loss_db, port_loss_db, route_loss_db
+from route_app.models import FiberRoute
+from route_app.geometry import path_points
+from .changelog import change_version, latest_seq
+from .models import ChangeLogEntry
+from .topology import DEVICE, PORT, ROUTE, company_topologies
+
+# Beyond this many pending log entries the budget is rebuilt rather than patched.
+MAX_INCREMENTAL_CHANGES = 200
+
+DEVICE_FIELDS = ('id', 'office_id', 'device_type', 'model_name', 'ratio', 'insertion_loss', 'output_power')
+
+
+def _route_ends(path):
+    points = path_points(path)
+    return (points[0], points[-1]) if len(points) >= 2 else None
+
+
+class PowerBudget:
+    """
+    Received optical power (dBm) at every node of a CompanyTopology.
+
+    Nodes are laid out in depth-first preorder, so every subtree is one
+    contiguous slice ``[position, end)``. The initial propagation runs one
+    vectorized step per tree level; afterwards a changed loss or launch power
+    shifts exactly its subtree slice by the difference.
+
+    Losses: routes lose attenuation per km plus a fixed connection loss,
+    ordinary devices their insertion loss, and splitter/coupler output ports
+    their share of the split. OLT sites launch the OLT's ``output_power``.
+    A junction box passes its input on unchanged to the routes that leave it,
+    since the schema does not record which splitter port feeds which route.
+    """
+
+    def __init__(self, topology, seq):
+        self.topology = topology
+        self.seq = seq
+        size = len(topology.parent)
+        self.order, self.position, self.end, self.depth = topology.preorder()
+        parents = np.array(topology.parent, dtype=np.int64)[self.order]
+        self.parent_position = np.where(parents >= 0, self.position[np.maximum(parents, 0)], -1)
+        self.loss = np.zeros(size)
+        self.power = np.full(size, np.nan)
+        self.devices = {}
+        self.device_ports = {}
+        self.route_ends = {}
+
+    @classmethod
+    def build(cls, company_id):
+        # Sequence first: anything committed while loading is replayed afterwards.
+        seq = latest_seq(company_id)
+        # The per-process topology shared with tracing; the budget only reads it.
+        topology = company_topologies.get(company_id)
+        budget = cls(topology, seq)
+
+        routes = FiberRoute.objects.filter(office__company_id=company_id, is_deleted=False)
+        for row in routes.values('id', 'length_km', 'path').iterator(chunk_size=500):
+            node = topology.node(ROUTE, row['id'])
+            if node is not None:
+                budget.route_ends[row['id']] = _route_ends(row['path'])
+                budget.loss[budget.position[node]] = route_loss_db(row['length_km'])
+
+        ports = (DevicePort.objects.filter(device__office__company_id=company_id)
+                 .order_by('device_id', 'port_number', 'id').values_list('device_id', 'id'))
+        for device_id, port_id in ports:
+            budget.device_ports.setdefault(device_id, []).append(topology.node(PORT, port_id))
+
+        for row in NetworkDevice.objects.filter(office__company_id=company_id).values(*DEVICE_FIELDS):
+            budget.devices[row['id']] = row
+            for node, loss in budget._device_losses(row):
+                budget.loss[budget.position[node]] = loss
+
+        budget.propagate()
+        return budget
+
+    def _device_losses(self, row):
+        """``(node, loss)`` for a device and each of its output ports."""
+        node = self.topology.node(DEVICE, row['id'])
+        losses = [(node, device_loss_db(row['device_type'], row['insertion_loss']))]
+        for position, port in enumerate(self.device_ports.get(row['id'], ())):
+            losses.append((port, port_loss_db(row['device_type'], row['ratio'], row['insertion_loss'], position)))
+        return losses
+
+    def _launch_power(self, olt_node):
+        row = self.devices[self.topology.object_id[olt_node]]
+        if row['output_power'] is None:
+            return settings.OPTICAL_OLT_OUTPUT_POWER_DBM
+        return row['output_power']
+
+    def propagate(self):
+        """Full propagation from every OLT site, one vectorized step per tree level."""
+        self.power[:] = np.nan
+        for site, olt in self.topology.olts.items():
+            self.power[self.position[site]] = self._launch_power(olt)
+        for level in range(1, int(self.depth.max(initial=0)) + 1):
+            positions = np.flatnonzero(self.depth == level)
+            self.power[positions] = self.power[self.parent_position[positions]] - self.loss[positions]
+
+    def set_loss(self, node, loss):
+        position = self.position[node]
+        delta = loss - self.loss[position]
+        if delta:
+            self.loss[position] = loss
+            self.power[position:self.end[position]] -= delta
+
+    def set_launch(self, site, power):
+        position = self.position[site]
+        delta = power - self.power[position]
+        if delta:
+            self.power[position:self.end[position]] += delta
+
+    def received(self, node):
+        power = self.power[self.position[node]]
+        return None if np.isnan(power) else float(power)
+
+    def apply_changes(self, entries):
+        """
+        Patch the budget for route and device updates that leave the topology
+        untouched. Returns False when anything structural changed and the
+        budget has to be rebuilt.
+        """
+        route_ids = {entry['object_id'] for entry in entries if entry['entity'] == 'route'}
+        device_ids = {entry['object_id'] for entry in entries if entry['entity'] == 'device'}
+        if any(entry['op'] != 'upsert' or entry['entity'] not in ('route', 'device') for entry in entries):
+            return False
+
+        route_rows = {
+            row['id']: row for row in FiberRoute.objects.filter(pk__in=route_ids)
+            .values('id', 'name', 'length_km', 'is_deleted', 'path')
+        }
+        device_rows = {row['id']: row for row in NetworkDevice.objects.filter(pk__in=device_ids).values(*DEVICE_FIELDS)}
+        for route_id in route_ids:
+            row = route_rows.get(route_id)
+            if (row is None or row['is_deleted'] or route_id not in self.route_ends
+                    or _route_ends(row['path']) != self.route_ends[route_id]):
+                return False
+        for device_id in device_ids:
+            row, previous = device_rows.get(device_id), self.devices.get(device_id)
+            if row is None or previous is None or (row['device_type'], row['office_id']) != (
+                    previous['device_type'], previous['office_id']):
+                return False
+
+        topology = self.topology
+        for route_id in route_ids:
+            node = topology.node(ROUTE, route_id)
+            topology.labels[node] = route_rows[route_id]['name']
+            self.set_loss(node, route_loss_db(route_rows[route_id]['length_km']))
+        for device_id in device_ids:
+            row = device_rows[device_id]
+            self.devices[device_id] = row
+            node = topology.node(DEVICE, device_id)
+            topology.labels[node] = row['model_name']
+            for element, loss in self._device_losses(row):
+                self.set_loss(element, loss)
+            for site, olt in topology.olts.items():
+                if olt == node:
+                    self.set_launch(site, self._launch_power(olt))
+
+        self.seq = max([self.seq] + [entry['seq'] for entry in entries])
+        return True
+
+
+class PowerBudgetCache:
+    """
+    Per-process PowerBudget per company. When the company's change version
+    moves, pending change log entries are applied as subtree patches where
+    possible; structural changes rebuild the budget.
+    """
+
+    def __init__(self):
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    def get(self, company_id):
+        version = change_version(company_id)
+        cached = self._budgets.get(company_id)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            cached = self._budgets.get(company_id)
+            if cached and cached[0] == version:
+                return cached[1]
+            budget = cached[1] if cached else None
+            if budget is not None:
+                entries = list(
+                    ChangeLogEntry.objects.filter(company_id=company_id, seq__gt=budget.seq)
+                    .order_by('seq').values('seq', 'entity', 'object_id', 'op')[:MAX_INCREMENTAL_CHANGES + 1]
+                )
+                if len(entries) > MAX_INCREMENTAL_CHANGES or not budget.apply_changes(entries):
+                    budget = None
+            if budget is None:
+                budget = PowerBudget.build(company_id)
+            self._budgets[company_id] = (version, budget)
+            return budget
+
+
+company_power_budgets = PowerBudgetCache()
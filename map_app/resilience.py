@@ -0,0 +1,149 @@
+import logging
+from django.core.cache import cache
+from django.utils import timezone
+from .changelog import change_version
+from .topology import OFFICE, JUNCTION, CUSTOMER, company_topologies
+
+logger = logging.getLogger(__name__)
+
+RESILIENCE_KEY = "map_resilience_{company_id}"
+RESILIENCE_PENDING_KEY = "map_resilience_pending_{company_id}_{version}"
+RESILIENCE_TIMEOUT = 60 * 60 * 24
+# How long a queued analysis blocks another one for the same version.
+RESILIENCE_PENDING_TIMEOUT = 60 * 5
+
+SITE_KINDS = (OFFICE, JUNCTION)
+
+# Stand-in node joined to every OLT site, so "cut off" means cut off from all of them.
+SOURCE = -1
+
+
+def site_customers(topology):
+    """Number of customers hanging off each site, through their port and device."""
+    counts = {}
+    parent, kind = topology.parent, topology.kind
+    for node in range(len(kind)):
+        if kind[node] != CUSTOMER:
+            continue
+        site = parent[node]
+        while site != -1 and kind[site] not in SITE_KINDS:
+            site = parent[site]
+        if site != -1:
+            counts[site] = counts.get(site, 0) + 1
+    return counts
+
+
+def find_weak_points(topology):
+    """
+    Bridges and articulation points of the site graph (offices and junction
+    boxes joined by spliced routes), found with an iterative Tarjan DFS from a
+    virtual source tied to every OLT site.
+
+    A route is a bridge when cutting it separates sites from every OLT, and a
+    site is an articulation point when losing it does. Each comes with the
+    customers and sites it isolates: the DFS subtrees it separates from the
+    source, plus for a site its own customers. Sites no OLT reaches are
+    already dark and are not reported.
+
+    Returns ``(bridges, articulation_points)`` as lists of
+    ``(element, customers, sites)`` tuples, where a bridge's element is
+    ``(route, upstream site, downstream site)``.
+    """
+    customers = site_customers(topology)
+    adjacency = {site: list(edges) for site, edges in topology.links.items()}
+    adjacency[SOURCE] = []
+    for number, site in enumerate(topology.olts):
+        # Virtual edges get negative ids so they are never reported.
+        adjacency[SOURCE].append((-1 - number, site))
+        adjacency.setdefault(site, []).append((-1 - number, SOURCE))
+
+    discovered, low = {SOURCE: 0}, {SOURCE: 0}
+    subtree_customers, subtree_sites = {SOURCE: 0}, {SOURCE: 0}
+    isolated = {}
+    bridges = []
+    stack = [(SOURCE, None, iter(adjacency[SOURCE]))]
+    while stack:
+        node, via, edges = stack[-1]
+        for edge, neighbour in edges:
+            if edge == via:
+                continue
+            if neighbour in discovered:
+                low[node] = min(low[node], discovered[neighbour])
+                continue
+            discovered[neighbour] = low[neighbour] = len(discovered)
+            subtree_customers[neighbour] = customers.get(neighbour, 0)
+            subtree_sites[neighbour] = 1
+            stack.append((neighbour, edge, iter(adjacency.get(neighbour, ()))))
+            break
+        else:
+            stack.pop()
+            if not stack:
+                break
+            parent = stack[-1][0]
+            low[parent] = min(low[parent], low[node])
+            subtree_customers[parent] += subtree_customers[node]
+            subtree_sites[parent] += subtree_sites[node]
+            if parent == SOURCE:
+                continue
+            if low[node] >= discovered[parent]:
+                cut = isolated.setdefault(parent, [customers.get(parent, 0), 1])
+                cut[0] += subtree_customers[node]
+                cut[1] += subtree_sites[node]
+            if low[node] > discovered[parent] and via >= 0:
+                bridges.append(((via, parent, node), subtree_customers[node], subtree_sites[node]))
+
+    articulation_points = [(site, counts[0], counts[1]) for site, counts in isolated.items()]
+    bridges.sort(key=lambda item: (-item[1], -item[2]))
+    articulation_points.sort(key=lambda item: (-item[1], -item[2]))
+    return bridges, articulation_points
+
+
+def build_resilience_report(company_id):
+    """The company's single points of failure, most customers isolated first."""
+    # Version first: a change made while analysing leaves the report marked stale.
+    version = change_version(company_id)
+    topology = company_topologies.get(company_id)
+    bridges, articulation_points = find_weak_points(topology)
+    return {
+        "version": version,
+        "computed_at": timezone.now().isoformat(),
+        "bridges": [
+            {
+                **topology.describe(route),
+                "between": [topology.describe(upstream), topology.describe(downstream)],
+                "isolated_customers": customers,
+                "isolated_sites": sites,
+            }
+            for (route, upstream, downstream), customers, sites in bridges
+        ],
+        "articulation_points": [
+            {**topology.describe(site), "isolated_customers": customers, "isolated_sites": sites}
+            for site, customers, sites in articulation_points
+        ],
+    }
+
+
+def store_resilience_report(company_id):
+    report = build_resilience_report(company_id)
+    cache.set(RESILIENCE_KEY.format(company_id=company_id), report, timeout=RESILIENCE_TIMEOUT)
+    return report
+
+
+def cached_resilience_report(company_id):
+    return cache.get(RESILIENCE_KEY.format(company_id=company_id))
+
+
+def schedule_resilience_report(company_id, version):
+    """Queue the analysis once per change version; returns whether a task was queued."""
+    from .tasks import analyze_company_resilience
+
+    pending_key = RESILIENCE_PENDING_KEY.format(company_id=company_id, version=version)
+    if not cache.add(pending_key, True, timeout=RESILIENCE_PENDING_TIMEOUT):
+        return False
+    try:
+        analyze_company_resilience.delay(company_id)
+    except Exception:
+        cache.delete(pending_key)
+        logger.exception("Could not queue resilience analysis for company %s", company_id)
+        raise
+    return True
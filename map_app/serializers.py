@@ -38,6 +38,7 @@ class JunctionBoxSerializer(serializers.ModelSerializer):
 class FiberRouteSerializer(serializers.ModelSerializer):
     office = serializers.PrimaryKeyRelatedField(queryset=Office.objects.all())
     created_by = serializers.PrimaryKeyRelatedField(queryset=Staff.objects.all())
+    path = serializers.JSONField()
     class Meta:
         model = FiberRoute
         fields = ['id', 'office', 'created_by', 'name', 'path', 'length_km', 'created_at', 'is_deleted']
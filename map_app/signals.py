@@ -0,0 +1,186 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from customer_app.models import Customer
+from junction_app.models import JunctionBoxDevice
+from networkdevice_app.models import NetworkDevice, DevicePort
+from office.models import Office
+from opticalfiber_app.models import Company
+from route_app.models import FiberRoute
+from .capacity import port_devices, refresh_device_capacity, refresh_junction_capacity
+from route_app.geometry import path_points
+from .changelog import CHANGE_ENTITY_BY_MODEL, record_change
+from .consumers import publish_map_change
+from .layers import LAYER_BY_MODEL, company_id_for
+from .spatial import CompanyIndexCache
+from .tiles import TileCache, TILE_POINT_LAYERS
+
+MAPPED_MODELS = list(LAYER_BY_MODEL) + [FiberRoute]
+
+
+def is_tiled(model):
+    return model is FiberRoute or LAYER_BY_MODEL[model].name in TILE_POINT_LAYERS
+
+
+def entity_points(instance):
+    """Coordinates an entity occupies on the tile map (empty for untiled layers)."""
+    if isinstance(instance, FiberRoute):
+        return [] if instance.is_deleted else path_points(instance.path)
+    if not is_tiled(type(instance)):
+        return []
+    layer = LAYER_BY_MODEL[type(instance)]
+    lat, lng = getattr(instance, layer.lat_field), getattr(instance, layer.lng_field)
+    if lat is None or lng is None:
+        return []
+    return [(lat, lng)]
+
+
+def live_change(instance, created=False, deleted=False):
+    """
+    ``(entity, op, data)`` pushed to open map clients, or None for layers that
+    are not streamed. Soft-deleted routes go out as deletes.
+    """
+    if isinstance(instance, FiberRoute):
+        entity = 'route'
+        deleted = deleted or instance.is_deleted
+        data = None if deleted else {
+            'id': instance.pk,
+            'office_id': instance.office_id,
+            'name': instance.name,
+            'path': instance.path,
+            'length_km': str(instance.length_km),
+        }
+    elif is_tiled(type(instance)):
+        layer = LAYER_BY_MODEL[type(instance)]
+        entity = layer.name
+        data = None if deleted else layer.instance_feature(instance)
+    else:
+        return None
+    op = 'delete' if deleted else 'create' if created else 'update'
+    return entity, op, data
+
+
+def map_entity_changed(instance, previous_points=(), created=False, deleted=False):
+    company_id = company_id_for(instance)
+    if company_id is None:
+        return
+    points = list(previous_points) + entity_points(instance)
+    change = live_change(instance, created=created, deleted=deleted)
+    object_id = instance.pk
+
+    def refresh():
+        CompanyIndexCache.bump_version(company_id)
+        TileCache.invalidate(company_id, points)
+        if change is not None:
+            entity, op, data = change
+            publish_map_change(company_id, entity, op, object_id, data)
+
+    transaction.on_commit(refresh)
+
+
+def mapped_entity_pre_save(sender, instance, raw=False, **kwargs):
+    """Remember where the row was before this save so its old tiles are dropped too."""
+    instance._map_previous_points = []
+    if raw or instance.pk is None or not is_tiled(sender):
+        return
+    previous = sender.objects.filter(pk=instance.pk).first()
+    if previous is not None:
+        instance._map_previous_points = entity_points(previous)
+
+
+def mapped_entity_saved(sender, instance, created=False, raw=False, **kwargs):
+    if not raw:
+        map_entity_changed(instance, getattr(instance, '_map_previous_points', ()), created=created)
+
+
+def mapped_entity_deleted(sender, instance, **kwargs):
+    map_entity_changed(instance, deleted=True)
+
+
+for model in MAPPED_MODELS:
+    pre_save.connect(mapped_entity_pre_save, sender=model, dispatch_uid=f"map_pre_save_{model.__name__}")
+    post_save.connect(mapped_entity_saved, sender=model, dispatch_uid=f"map_saved_{model.__name__}")
+    post_delete.connect(mapped_entity_deleted, sender=model, dispatch_uid=f"map_deleted_{model.__name__}")
+
+
+def log_entity_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    entity = CHANGE_ENTITY_BY_MODEL[sender]
+    company_id = entity.company_id_for(instance)
+    if company_id is not None:
+        record_change(company_id, entity.name, instance.pk, 'upsert')
+
+
+def log_entity_deleted(sender, instance, origin=None, **kwargs):
+    # Rows removed along with their company take the company's log with them.
+    if isinstance(origin, Company) or getattr(origin, 'model', None) is Company:
+        return
+    entity = CHANGE_ENTITY_BY_MODEL[sender]
+    company_id = entity.company_id_for(instance)
+    if company_id is not None:
+        record_change(company_id, entity.name, instance.pk, 'delete')
+
+
+for model in CHANGE_ENTITY_BY_MODEL:
+    post_save.connect(log_entity_saved, sender=model, dispatch_uid=f"map_log_saved_{model.__name__}")
+    post_delete.connect(log_entity_deleted, sender=model, dispatch_uid=f"map_log_deleted_{model.__name__}")
+
+
+# Rows whose changes move port counters, and the column naming what they count towards.
+CAPACITY_LINKS = {DevicePort: 'device_id', Customer: 'device_port_id', JunctionBoxDevice: 'junction_box_id'}
+
+
+def announce_capacity(instances):
+    """
+    Counters are written with update(), so log and publish the rows whose
+    counts moved. The port, customer or junction device change that moved
+    them is logged and bumps the change version itself, and the topology,
+    power budget and routing graph never read the counters, so these
+    entries leave the version alone.
+    """
+    for instance in instances:
+        entity = CHANGE_ENTITY_BY_MODEL[type(instance)]
+        company_id = entity.company_id_for(instance)
+        if company_id is not None:
+            record_change(company_id, entity.name, instance.pk, 'upsert', bump=False)
+        map_entity_changed(instance)
+
+
+def refresh_capacity(sender, ids):
+    if sender is DevicePort:
+        changed = refresh_device_capacity(ids)
+    elif sender is Customer:
+        changed = refresh_device_capacity(port_devices(ids))
+    else:
+        changed = refresh_junction_capacity(ids)
+    announce_capacity(changed)
+
+
+def capacity_pre_save(sender, instance, raw=False, **kwargs):
+    instance._capacity_previous = None
+    if not raw and instance.pk is not None:
+        instance._capacity_previous = (sender.objects.filter(pk=instance.pk)
+                                       .values_list(CAPACITY_LINKS[sender], flat=True).first())
+
+
+def capacity_saved(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_capacity_previous', None)
+    current = getattr(instance, CAPACITY_LINKS[sender])
+    if created or previous != current:
+        refresh_capacity(sender, {previous, current})
+
+
+def capacity_deleted(sender, instance, origin=None, **kwargs):
+    # Whatever is being deleted wholesale takes the counted rows with it.
+    containers = (Company, Office, NetworkDevice) if sender is DevicePort else (Company, Office)
+    if isinstance(origin, containers) or getattr(origin, 'model', None) in containers:
+        return
+    refresh_capacity(sender, {getattr(instance, CAPACITY_LINKS[sender])})
+
+
+for model in CAPACITY_LINKS:
+    pre_save.connect(capacity_pre_save, sender=model, dispatch_uid=f"map_capacity_pre_save_{model.__name__}")
+    post_save.connect(capacity_saved, sender=model, dispatch_uid=f"map_capacity_saved_{model.__name__}")
+    post_delete.connect(capacity_deleted, sender=model, dispatch_uid=f"map_capacity_deleted_{model.__name__}")
@@ -0,0 +1,217 @@
+import json
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from rest_framework import serializers
+from opticalfiber_app.models import Company
+from office.models import Office
+from route_app.models import FiberRoute
+from route_app.geometry import select_path
+from junction_app.models import JunctionBox, JunctionBoxDevice
+from networkdevice_app.models import DevicePort
+from .serializers import (
+    CompanySerializer, DevicePortSerializer, FiberRouteSerializer, JunctionBoxDeviceSerializer,
+    JunctionBoxSerializer, NetworkDeviceSerializer, OfficeSerializer,
+)
+
+CHUNK_SIZE = 2000
+WRITE_BUFFER_SIZE = 64 * 1024
+
+def serializer_columns(serializer_class):
+    """
+    ``(name, values() column, field)`` for each flat field of a snapshot
+    serializer, read from the serializer itself so the snapshot keeps its
+    shape when a model gains columns. Nested serializers are skipped (the
+    snapshot merges those in) and relations render as the raw id.
+    """
+    columns = []
+    for name, field in serializer_class().fields.items():
+        if isinstance(field, serializers.BaseSerializer):
+            continue
+        if isinstance(field, serializers.RelatedField):
+            columns.append((name, f'{field.source}_id', None))
+        else:
+            columns.append((name, field.source, field))
+    return columns
+
+
+COMPANY_COLUMNS = serializer_columns(CompanySerializer)
+OFFICE_COLUMNS = serializer_columns(OfficeSerializer)
+ROUTE_COLUMNS = serializer_columns(FiberRouteSerializer)
+JUNCTION_COLUMNS = serializer_columns(JunctionBoxSerializer)
+JUNCTION_DEVICE_COLUMNS = serializer_columns(JunctionBoxDeviceSerializer)
+DEVICE_COLUMNS = serializer_columns(NetworkDeviceSerializer)
+PORT_COLUMNS = serializer_columns(DevicePortSerializer)
+
+
+def column_names(columns, prefix=''):
+    return [prefix + column for _, column, _ in columns]
+
+
+def render(columns, row, prefix=''):
+    """A ``values()`` row as the serializer would render the model instance."""
+    rendered = {}
+    for name, column, field in columns:
+        value = row[prefix + column]
+        rendered[name] = value if field is None or value is None else field.to_representation(value)
+    return rendered
+
+
+class SortedRows:
+    """
+    Wraps a row iterator that is sorted by ``key`` and hands out the run of rows
+    belonging to one parent at a time, so children are merged into their parents
+    without holding the whole table in memory.
+    """
+
+    def __init__(self, rows, key):
+        self._rows = iter(rows)
+        self._key = key
+        self._head = next(self._rows, None)
+
+    def take(self, key):
+        while self._head is not None and self._key(self._head) < key:
+            self._head = next(self._rows, None)
+        while self._head is not None and self._key(self._head) == key:
+            yield self._head
+            self._head = next(self._rows, None)
+
+
+def _dump(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+def _open(fields):
+    """Serialize a dict as a JSON object without its closing brace so nested lists can follow."""
+    return _dump(fields)[:-1]
+
+
+def company_fields(row, request):
+    logo = row.pop('logo')
+    row = render([column for column in COMPANY_COLUMNS if column[0] != 'logo'], row)
+    if logo:
+        url = default_storage.url(logo)
+        row['logo'] = request.build_absolute_uri(url) if request is not None else url
+    else:
+        row['logo'] = None
+    return row
+
+
+def route_fields(row, resolution):
+    path = row['path']
+    if resolution:
+        path = select_path(path, row['simplified_paths'], **resolution)
+    rendered = render([column for column in ROUTE_COLUMNS if column[0] != 'path'], row)
+    rendered['path'] = path
+    return rendered
+
+
+def buffered(chunks, size=WRITE_BUFFER_SIZE):
+    """Join small string chunks into writes of roughly ``size`` bytes."""
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+async def aiterate(chunks):
+    """
+    Async iteration of a sync chunk iterator, for ASGI servers: Django reads a
+    sync iterator in full before sending anything under ASGI, which would
+    build the whole snapshot in memory. Each chunk is pulled on the request's
+    thread-sensitive thread, so the iterator's transaction and cursors stay
+    on the one database connection.
+    """
+    chunks = iter(chunks)
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # Ends the snapshot transaction when the client goes away mid-stream.
+        await sync_to_async(chunks.close, thread_sensitive=True)()
+
+
+def stream_company_snapshot(company_id, request=None, resolution=None):
+    """
+    Yield the JSON of ``map_app.serializers.CompanySerializer`` for one company
+    in small chunks. Each table is read once with a flat ``values()`` query,
+    ordered so that children arrive grouped under their parents; the nesting is
+    rebuilt by merging those sorted streams. Query count is constant and memory
+    holds a single row group at a time, whatever the size of the tenant.
+
+    The snapshot is read in one transaction, held open until the last chunk
+    is sent. Under ASGI wrap the chunks in ``aiterate``.
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # One consistent snapshot across the independent queries below.
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+
+        company = Company.objects.values(*column_names(COMPANY_COLUMNS)).get(pk=company_id)
+        offices = (
+            Office.objects.filter(company_id=company_id)
+            .order_by('id').values(*column_names(OFFICE_COLUMNS)).iterator(chunk_size=CHUNK_SIZE)
+        )
+        route_columns = column_names(ROUTE_COLUMNS) + (['simplified_paths'] if resolution else [])
+        routes = SortedRows(
+            FiberRoute.objects.filter(office__company_id=company_id)
+            .order_by('office_id', 'id').values(*route_columns).iterator(chunk_size=CHUNK_SIZE),
+            key=lambda row: row['office_id'],
+        )
+        junctions = SortedRows(
+            JunctionBox.objects.filter(office__company_id=company_id)
+            .order_by('office_id', 'id').values(*column_names(JUNCTION_COLUMNS)).iterator(chunk_size=CHUNK_SIZE),
+            key=lambda row: row['office_id'],
+        )
+        junction_devices = SortedRows(
+            JunctionBoxDevice.objects.filter(junction_box__office__company_id=company_id)
+            .order_by('junction_box__office_id', 'junction_box_id', 'id')
+            .values('junction_box__office_id', *column_names(JUNCTION_DEVICE_COLUMNS),
+                    *column_names(DEVICE_COLUMNS, prefix='device__'))
+            .iterator(chunk_size=CHUNK_SIZE),
+            key=lambda row: (row['junction_box__office_id'], row['junction_box_id']),
+        )
+        ports = SortedRows(
+            DevicePort.objects.filter(device__junction_boxes__junction_box__office__company_id=company_id)
+            .order_by('device__junction_boxes__junction_box__office_id',
+                      'device__junction_boxes__junction_box_id', 'device__junction_boxes__id', 'id')
+            .values('device__junction_boxes__junction_box__office_id', 'device__junction_boxes__junction_box_id',
+                    'device__junction_boxes__id', *column_names(PORT_COLUMNS))
+            .iterator(chunk_size=CHUNK_SIZE),
+            key=lambda row: (row['device__junction_boxes__junction_box__office_id'],
+                             row['device__junction_boxes__junction_box_id'],
+                             row['device__junction_boxes__id']),
+        )
+
+        yield _open(company_fields(company, request)) + ',"offices":['
+        for office_position, office in enumerate(offices):
+            office_id = office['id']
+            yield (',' if office_position else '') + _open(render(OFFICE_COLUMNS, office)) + ',"fiber_routes":['
+
+            for position, route in enumerate(routes.take(office_id)):
+                yield (',' if position else '') + _dump(route_fields(route, resolution))
+
+            yield '],"junction_boxes":['
+            for jb_position, junction in enumerate(junctions.take(office_id)):
+                jb_key = (office_id, junction['id'])
+                yield (',' if jb_position else '') + _open(render(JUNCTION_COLUMNS, junction)) + ',"devices":['
+
+                for position, jbd in enumerate(junction_devices.take(jb_key)):
+                    device = render(DEVICE_COLUMNS, jbd, prefix='device__')
+                    device['ports'] = [render(PORT_COLUMNS, port) for port in ports.take(jb_key + (jbd['id'],))]
+                    row = render(JUNCTION_DEVICE_COLUMNS, jbd)
+                    row['device'] = device
+                    yield (',' if position else '') + _dump(row)
+                yield ']}'
+            yield ']}'
+        yield ']}'
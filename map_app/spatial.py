@@ -0,0 +1,337 @@
+import heapq
+import math
+import threading
+import uuid
+from django.core.cache import cache
+from route_app.models import FiberRoute
+import numpy as np
+from route_app.geometry import EARTH_RADIUS_M, haversine_m, path_points, path_bounds, snap_to_path
+from .changelog import latest_seq
+from .layers import MAP_LAYERS
+from .models import ChangeLogEntry
+
+# Beyond this many pending log entries a worker rebuilds the index instead of replaying them.
+MAX_CATCH_UP_CHANGES = 5000
+
+
+class GridIndex:
+    """
+    Uniform lat/lng bucket grid. Points are hashed into square cells of
+    ``cell_size`` degrees, so a viewport query only touches the cells it overlaps
+    instead of every point of the tenant.
+    """
+
+    def __init__(self, cell_size=0.01):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_size), math.floor(lng / self.cell_size)
+
+    def insert(self, key, lat, lng, payload):
+        if key in self.entries:
+            self.remove(key)
+        if lat is None or lng is None:
+            return
+        cell = self._cell(lat, lng)
+        # Buckets are replaced rather than mutated so concurrent readers iterate a stable copy.
+        bucket = dict(self.cells.get(cell, ()))
+        bucket[key] = (lat, lng, payload)
+        self.cells[cell] = bucket
+        self.entries[key] = cell
+
+    def remove(self, key):
+        cell = self.entries.pop(key, None)
+        if cell is None:
+            return
+        bucket = dict(self.cells[cell])
+        bucket.pop(key, None)
+        if bucket:
+            self.cells[cell] = bucket
+        else:
+            del self.cells[cell]
+
+    def query_bbox(self, south, west, north, east):
+        """Yield ``(key, payload)`` for every point inside the bounding box."""
+        min_row, min_col = self._cell(south, west)
+        max_row, max_col = self._cell(north, east)
+        span = (max_row - min_row + 1) * (max_col - min_col + 1)
+
+        if span > len(self.cells):
+            # Viewport covers more cells than are occupied; scan the occupied ones.
+            candidates = (
+                bucket for (row, col), bucket in list(self.cells.items())
+                if min_row <= row <= max_row and min_col <= col <= max_col
+            )
+        else:
+            candidates = (
+                self.cells[(row, col)]
+                for row in range(min_row, max_row + 1)
+                for col in range(min_col, max_col + 1)
+                if (row, col) in self.cells
+            )
+
+        for bucket in candidates:
+            for key, (lat, lng, payload) in bucket.items():
+                if south <= lat <= north and west <= lng <= east:
+                    yield key, payload
+
+    def _unsearched_distance(self, lat, lng, row0, col0, ring):
+        """
+        Lower bound in metres on the distance from ``(lat, lng)`` to any point
+        outside the square of cells within ``ring`` of its own cell.
+        """
+        size = self.cell_size
+        south, north = (row0 - ring) * size, (row0 + ring + 1) * size
+        west, east = (col0 - ring) * size, (col0 + ring + 1) * size
+        lat_gap = math.radians(min(lat - south, north - lat))
+        lng_gap = math.radians(min(lng - west, east - lng))
+        # Within the square's latitude band, a longitude gap is shortest at the band edge nearest a pole.
+        min_cos = math.cos(math.radians(min(90.0, max(abs(south), abs(north)))))
+        lng_bound = 2 * math.asin(min(1.0, min_cos * math.sin(lng_gap / 2)))
+        return EARTH_RADIUS_M * min(lat_gap, lng_bound)
+
+    def _cell_distance(self, lat, lng, cell):
+        """Lower bound in metres on the distance from ``(lat, lng)`` to any point of ``cell``."""
+        size = self.cell_size
+        south, west = cell[0] * size, cell[1] * size
+        north, east = south + size, west + size
+        lat_gap = math.radians(max(0.0, south - lat, lat - north))
+        lng_gap = math.radians(max(0.0, west - lng, lng - east))
+        min_cos = math.cos(math.radians(min(90.0, max(abs(south), abs(north)))))
+        a = math.sin(lat_gap / 2) ** 2 + math.cos(math.radians(lat)) * min_cos * math.sin(lng_gap / 2) ** 2
+        return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+    def nearest(self, lat, lng, k, max_distance=None, accept=None):
+        """
+        The ``k`` points closest to ``(lat, lng)`` as ``(distance_m, key, payload)``,
+        nearest first. Cells are searched in growing square rings around the
+        query cell and the search stops once no unsearched cell can hold a closer
+        point, so cost follows local density rather than the size of the index.
+        ``max_distance`` caps the search radius in metres and ``accept(key, payload)``
+        filters candidates. Longitudes do not wrap at the antimeridian.
+        """
+        if k < 1 or not self.cells:
+            return []
+        row0, col0 = self._cell(lat, lng)
+        best = []  # max-heap on distance: (-distance, key, payload)
+
+        def consider(bucket):
+            for key, (p_lat, p_lng, payload) in bucket.items():
+                if accept is not None and not accept(key, payload):
+                    continue
+                distance = haversine_m(lat, lng, p_lat, p_lng)
+                if max_distance is not None and distance > max_distance:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, key, payload))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, key, payload))
+
+        def done(bound):
+            if max_distance is not None and bound > max_distance:
+                return True
+            return len(best) == k and -best[0][0] <= bound
+
+        def result():
+            return [(-negative, key, payload) for negative, key, payload in sorted(best, reverse=True)]
+
+        ring = 0
+        while (2 * ring + 1) ** 2 <= len(self.cells):
+            if ring == 0:
+                ring_cells = [(row0, col0)]
+            else:
+                top, bottom = row0 - ring, row0 + ring
+                ring_cells = [(top, col) for col in range(col0 - ring, col0 + ring + 1)]
+                ring_cells += [(bottom, col) for col in range(col0 - ring, col0 + ring + 1)]
+                ring_cells += [(row, col0 - ring) for row in range(top + 1, bottom)]
+                ring_cells += [(row, col0 + ring) for row in range(top + 1, bottom)]
+            for cell in ring_cells:
+                bucket = self.cells.get(cell)
+                if bucket:
+                    consider(bucket)
+            if done(self._unsearched_distance(lat, lng, row0, col0, ring)):
+                return result()
+            ring += 1
+
+        # Probing further rings would touch more cells than are occupied: visit the
+        # remaining occupied cells nearest first instead.
+        remaining = sorted(
+            (self._cell_distance(lat, lng, cell), cell, bucket)
+            for cell, bucket in list(self.cells.items())
+            if max(abs(cell[0] - row0), abs(cell[1] - col0)) >= ring
+        )
+        for bound, _, bucket in remaining:
+            if done(bound):
+                break
+            consider(bucket)
+        return result()
+
+
+class CompanyMapIndex:
+    """
+    Everything drawn on one company's map: point features in a GridIndex and
+    fiber routes keyed by id with their bounding envelopes and decoded vertices.
+    """
+
+    def __init__(self, seq=0):
+        self.points = GridIndex()
+        self.routes = {}
+        self.seq = seq
+
+    def add_route(self, row):
+        points = path_points(row['path'])
+        bounds = path_bounds(points)
+        if bounds is None:
+            self.routes.pop(row['id'], None)
+            return
+        levels = {int(zoom): path_points(path) for zoom, path in (row['simplified_paths'] or {}).items()}
+        route = {'id': row['id'], 'name': row['name'], 'office_id': row['office_id']}
+        self.routes[row['id']] = (bounds, points, levels, route)
+
+    def apply_changes(self, company_id, entries):
+        """Bring the index up to date with change log entries by reloading just the touched rows."""
+        touched = {}
+        for entry in entries:
+            touched.setdefault(entry['entity'], set()).add(entry['object_id'])
+            self.seq = max(self.seq, entry['seq'])
+
+        for name, ids in touched.items():
+            if name in MAP_LAYERS:
+                found = set()
+                for feature in MAP_LAYERS[name].rows(company_id, ids):
+                    self.points.insert((name, feature['id']), feature['latitude'], feature['longitude'], feature)
+                    found.add(feature['id'])
+                for object_id in ids - found:
+                    self.points.remove((name, object_id))
+            elif name == 'route':
+                found = set()
+                for row in route_rows(company_id, ids):
+                    self.add_route(row)
+                    found.add(row['id'])
+                for object_id in ids - found:
+                    self.routes.pop(object_id, None)
+
+    def query_routes(self, south, west, north, east, zoom=None):
+        """
+        Yield ``(points, route)`` for every route whose envelope overlaps the box,
+        using the coarsest precomputed simplification that still suits ``zoom``.
+        """
+        for (r_south, r_west, r_north, r_east), points, levels, route in list(self.routes.values()):
+            if r_south <= north and r_north >= south and r_west <= east and r_east >= west:
+                if zoom is not None:
+                    usable = [level for level in levels if level >= zoom]
+                    if usable:
+                        points = levels[min(usable)]
+                yield points, route
+
+    def nearest_route(self, lat, lng, max_distance):
+        """
+        The route passing closest to ``(lat, lng)`` within ``max_distance``
+        metres. Only routes whose envelope, grown by that distance, holds the
+        point are measured. Returns ``(route, distance_m, along_m, point)`` or None.
+        """
+        margin_lat = math.degrees(max_distance / EARTH_RADIUS_M)
+        margin_lng = margin_lat / max(math.cos(math.radians(lat)), 1e-6)
+        best = None
+        for (south, west, north, east), points, _, route in list(self.routes.values()):
+            if not (south - margin_lat <= lat <= north + margin_lat and west - margin_lng <= lng <= east + margin_lng):
+                continue
+            distance, along, point = snap_to_path(np.array(points, dtype=float), lat, lng)
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (route, distance, along, point)
+        return best
+
+
+def route_rows(company_id, ids=None):
+    """Rows of the company's live routes with the columns CompanyMapIndex needs."""
+    routes = FiberRoute.objects.filter(office__company_id=company_id, is_deleted=False)
+    if ids is not None:
+        routes = routes.filter(pk__in=ids)
+    return routes.values('id', 'name', 'office_id', 'path', 'simplified_paths').iterator(chunk_size=500)
+
+
+def parse_bbox(value):
+    """
+    Parse ``west,south,east,north`` (GeoJSON order) into ``(south, west, north, east)``.
+    Raises ValueError on malformed input.
+    """
+    if not value:
+        raise ValueError("bbox is required as west,south,east,north.")
+    parts = [float(part) for part in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError("bbox must have exactly four numbers: west,south,east,north.")
+    west, south, east, north = parts
+    if not (-90 <= south <= north <= 90) or not (-180 <= west <= east <= 180):
+        raise ValueError("bbox is outside valid coordinate ranges or inverted.")
+    return south, west, north, east
+
+
+class CompanyIndexCache:
+    """
+    Per-process cache of one CompanyMapIndex per company. A version token kept in the
+    shared cache is replaced whenever a mapped row changes; a worker that sees a new
+    version replays the company's change log since its index was built and only
+    rebuilds from scratch when it has fallen too far behind.
+    """
+
+    VERSION_KEY = "map_index_version_{company_id}"
+
+    def __init__(self):
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def current_version(cls, company_id):
+        # A random token rather than a counter, so an evicted version never reissues an old value.
+        return cache.get_or_set(cls.VERSION_KEY.format(company_id=company_id), uuid.uuid4().hex, timeout=None)
+
+    @classmethod
+    def bump_version(cls, company_id):
+        cache.set(cls.VERSION_KEY.format(company_id=company_id), uuid.uuid4().hex, timeout=None)
+
+    def build(self, company_id):
+        # Read the sequence first: anything committed while loading is replayed later, and replay is idempotent.
+        index = CompanyMapIndex(seq=latest_seq(company_id))
+        for layer in MAP_LAYERS.values():
+            for feature in layer.rows(company_id):
+                index.points.insert((layer.name, feature['id']), feature['latitude'], feature['longitude'], feature)
+
+        for row in route_rows(company_id):
+            index.add_route(row)
+        return index
+
+    def catch_up(self, company_id, index):
+        """Apply log entries newer than the index; returns False when a rebuild is cheaper."""
+        entries = list(
+            ChangeLogEntry.objects.filter(company_id=company_id, seq__gt=index.seq)
+            .order_by('seq').values('seq', 'entity', 'object_id')[:MAX_CATCH_UP_CHANGES + 1]
+        )
+        if len(entries) > MAX_CATCH_UP_CHANGES:
+            return False
+        index.apply_changes(company_id, entries)
+        return True
+
+    def get(self, company_id):
+        version = self.current_version(company_id)
+        cached = self._indexes.get(company_id)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            cached = self._indexes.get(company_id)
+            if cached and cached[0] == version:
+                return cached[1]
+            if cached and self.catch_up(company_id, cached[1]):
+                index = cached[1]
+            else:
+                index = self.build(company_id)
+            self._indexes[company_id] = (version, index)
+            return index
+
+
+company_indexes = CompanyIndexCache()
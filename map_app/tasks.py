@@ -0,0 +1,18 @@
+from celery import shared_task
+from .resilience import store_resilience_report
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, max_retries=3)
+def analyze_company_resilience(self, company_id):
+    try:
+        report = store_resilience_report(company_id)
+        logger.info(
+            "Resilience report for company %s: %d bridges, %d articulation points.",
+            company_id, len(report["bridges"]), len(report["articulation_points"]),
+        )
+    except Exception as e:
+        logger.error(f"Error in analyze_company_resilience: {str(e)}")
+        raise self.retry(exc=e, countdown=30)
@@ -1,3 +1,1154 @@
-from django.test import TestCase
+import io
+import json
+import random
+from collections import deque
+from types import SimpleNamespace
+from unittest import mock
+import msgpack
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from customer_app.models import Customer
+from junction_app.models import JunctionBox, JunctionBoxDevice
+from networkdevice_app.models import DevicePort, NetworkDevice
+from networkdevice_app.optics import port_loss_db, route_loss_db
+from office.models import Office
+from opticalfiber_app.models import Company, Staff
+from opticalfiber_app.revocation import token_revocations
+from opticalfiber_app.utils import TokenService
+from route_app.geometry import haversine_m
+from route_app.models import FiberRoute
+from . import changelog, clusters, consumers, power, resilience, tiles, views
+from .changelog import change_version, changes_since, latest_seq
+from .clusters import cell_bounds, cluster_cell, cluster_points, is_valid_cell
+from .consumers import MapDataConsumer, company_group
+from .impact import cut_impact
+from .models import ChangeLogEntry
+from .power import PowerBudget, PowerBudgetCache
+from .resilience import build_resilience_report, find_weak_points, store_resilience_report
+from .serializers import CompanySerializer
+from .snapshot import stream_company_snapshot
+from .spatial import CompanyIndexCache, GridIndex, parse_bbox
+from .topology import CUSTOMER, DEVICE, JUNCTION, OFFICE, PORT, ROUTE, CompanyTopology, TopologyCache
+from .tiles import TILE_EXTENT, TileCache, _clip_line, _delta_encode, tile_bounds, tiles_covering, world_xy
 
-# Create your tests here.
+# Keep tests off the real Redis, and hash staff passwords cheaply.
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def make_company(name='Acme'):
+    return Company.objects.create(
+        name=name, registration_number=f'REG-{name}', email='ops@example.com', phone='1', address='x',
+    )
+
+
+def make_office(company, latitude=0, longitude=0):
+    return Office.objects.create(company=company, name='HQ', latitude=latitude, longitude=longitude, address='x')
+
+
+def make_staff(company):
+    return Staff.objects.get_or_create(company=company, email=f'ops{company.pk}@example.com',
+                                       defaults={'name': 'Ops', 'password': 'secret', 'role': 'admin'})[0]
+
+
+def make_client(company):
+    staff = make_staff(company)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=TokenService.encode(staff))
+    return client
+
+
+def make_network(company):
+    """
+    An OLT at the office, one feeder route out to a junction box holding a
+    1:8 splitter, and a customer on the splitter's first port.
+    """
+    office = make_office(company, 12.97, 77.59)
+    staff = make_staff(company)
+    network = SimpleNamespace(office=office, staff=staff)
+    network.junction = JunctionBox.objects.create(office=office, name='J1', latitude=12.98, longitude=77.59,
+                                                  post_code='1', staff=staff)
+    network.route = FiberRoute.objects.create(office=office, name='Feeder', length_km=0,
+                                              path=[[12.97, 77.59], [12.975, 77.5902], [12.98, 77.59]])
+    network.olt = NetworkDevice.objects.create(staff=staff, office=office, device_type='OLT', model_name='OLT-1',
+                                               output_power=5.0, latitude=12.97, logitutde=77.59)
+    network.splitter = NetworkDevice.objects.create(staff=staff, office=office, device_type='Splitter',
+                                                    model_name='SPL-8', ratio='1:8', latitude=12.98, logitutde=77.59)
+    JunctionBoxDevice.objects.create(junction_box=network.junction, device=network.splitter)
+    network.port = DevicePort.objects.create(device=network.splitter, port_number=1, port_type='SFP')
+    network.customer = Customer.objects.create(staff=staff, office=office, name='Cust', email='c@example.com',
+                                               phone='100', address='x', latitude=12.981, longitude=77.59,
+                                               device_port=network.port)
+    return network
+
+
+class GridIndexBboxTests(SimpleTestCase):
+
+    def test_matches_brute_force(self):
+        rnd = random.Random(1)
+        index, points = GridIndex(cell_size=0.01), {}
+        for key in range(500):
+            lat, lng = 12.9 + rnd.random() * 0.3, 77.5 + rnd.random() * 0.3
+            index.insert(key, lat, lng, key)
+            points[key] = (lat, lng)
+        # Small boxes walk their cells, boxes wider than the occupied grid scan the occupied cells.
+        for span in (0.005, 0.05, 5):
+            for _ in range(30):
+                south, west = 12.9 + rnd.uniform(-0.1, 0.3), 77.5 + rnd.uniform(-0.1, 0.3)
+                north, east = south + span, west + span
+                expected = {key for key, (lat, lng) in points.items() if south <= lat <= north and west <= lng <= east}
+                self.assertEqual({key for key, _ in index.query_bbox(south, west, north, east)}, expected)
+
+    def test_insert_moves_and_remove_drops(self):
+        index = GridIndex()
+        index.insert('a', 0.005, 0.005, 'first')
+        index.insert('a', 1.005, 1.005, 'moved')
+        index.insert('b', None, 0.0, 'unplaced')
+        self.assertEqual(list(index.query_bbox(0, 0, 0.01, 0.01)), [])
+        self.assertEqual(list(index.query_bbox(1, 1, 1.01, 1.01)), [('a', 'moved')])
+        self.assertEqual(len(index), 1)
+        index.remove('a')
+        index.remove('missing')
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.cells, {})
+
+
+class ParseBboxTests(SimpleTestCase):
+
+    def test_geojson_order(self):
+        self.assertEqual(parse_bbox('77.5,12.9,77.7,13.1'), (12.9, 77.5, 13.1, 77.7))
+
+    def test_rejects_malformed(self):
+        for value in (None, '', '1,2,3', '1,2,3,x', '77.7,12.9,77.5,13.1', '0,-91,1,0'):
+            with self.assertRaises(ValueError):
+                parse_bbox(value)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class CompanyIndexTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # Company ids are reused between tests; start from an empty per-process cache.
+        patcher = mock.patch.object(views, 'company_indexes', CompanyIndexCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.company = make_company()
+
+    def keys(self, index):
+        return sorted(key for key, _ in index.points.query_bbox(-90, -180, 90, 180))
+
+    def test_replays_committed_changes(self):
+        office = make_office(self.company)
+        indexes = CompanyIndexCache()
+        index = indexes.get(self.company.pk)
+        self.assertEqual(self.keys(index), [('office', office.pk)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            office.latitude = 10
+            office.save()
+            second = make_office(self.company, 20, 20)
+        # Caught up from the change log rather than rebuilt.
+        self.assertIs(indexes.get(self.company.pk), index)
+        self.assertEqual(self.keys(index), [('office', office.pk), ('office', second.pk)])
+        self.assertEqual(list(index.points.query_bbox(9, -1, 11, 1)), [(('office', office.pk), {
+            'id': office.pk, 'latitude': 10, 'longitude': 0, 'name': 'HQ'})])
+
+        second_id = second.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(self.keys(indexes.get(self.company.pk)), [('office', office.pk)])
+        self.assertNotIn(('office', second_id), index.points.entries)
+
+    def test_features_endpoint_is_scoped_to_the_company(self):
+        inside = make_office(self.company, 12.95, 77.55)
+        make_office(self.company, 14, 79)
+        make_office(make_company('Other'), 12.95, 77.55)
+        client = make_client(self.company)
+
+        response = client.get('/api/map/features/', {'bbox': '77.5,12.9,77.6,13.0', 'layers': 'office'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual([feature['id'] for feature in response.data['features']['office']], [inside.pk])
+
+        self.assertEqual(client.get('/api/map/features/', {'bbox': '1,2,3'}).status_code, 400)
+        self.assertEqual(client.get('/api/map/features/', {'bbox': '0,0,1,1', 'layers': 'foo'}).status_code, 400)
+        self.assertEqual(APIClient().get('/api/map/features/', {'bbox': '0,0,1,1'}).status_code, 401)
+
+
+class TileGeometryTests(SimpleTestCase):
+
+    def test_tile_bounds_cover_the_world_at_zoom_zero(self):
+        south, west, north, east = tile_bounds(0, 0, 0)
+        self.assertAlmostEqual(south, -85.0511287798)
+        self.assertAlmostEqual(north, 85.0511287798)
+        self.assertEqual((west, east), (-180.0, 180.0))
+
+    def test_point_falls_in_its_tile(self):
+        lat, lng = 12.9716, 77.5946
+        for z in (0, 5, 12, 18):
+            wx, wy = world_xy(lat, lng)
+            x, y = int(wx * 2 ** z), int(wy * 2 ** z)
+            south, west, north, east = tile_bounds(z, x, y)
+            self.assertTrue(south <= lat <= north and west <= lng <= east)
+
+    def test_clip_line_drops_segments_outside(self):
+        line = [(-500, 10), (-300, 10), (10, 10), (20, 20), (5000, 20), (6000, 20)]
+        self.assertEqual(_clip_line(line, -64, 4160), [[(-300, 10), (10, 10), (20, 20), (5000, 20)]])
+
+    def test_delta_encode_skips_repeated_vertices(self):
+        self.assertEqual(_delta_encode([(10, 10), (10, 10), (12, 15), (11, 15)]), [10, 10, 2, 5, -1, 0])
+
+    def test_tiles_covering_includes_every_zoom(self):
+        covered = tiles_covering([(12.9716, 77.5946)])
+        self.assertEqual({z for z, _, _ in covered}, set(tiles.CACHED_ZOOMS))
+        self.assertIn((0, 0, 0), covered)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class TileCacheTests(TestCase):
+    # Tile at zoom 14 holding (12.9716, 77.5946).
+    TILE = (14, 11723, 7596)
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(tiles, 'company_indexes', CompanyIndexCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.office = make_office(self.company)
+        self.staff = make_staff(self.company)
+
+    def add_junction(self, name='JB1', latitude=12.9716, longitude=77.5946):
+        return JunctionBox.objects.create(office=self.office, name=name, latitude=latitude, longitude=longitude,
+                                          post_code='1', staff=self.staff)
+
+    def render(self):
+        return msgpack.unpackb(TileCache.get_or_render(self.company.pk, *self.TILE), raw=False)
+
+    def test_encodes_points_and_routes(self):
+        junction = self.add_junction()
+        self.add_junction('Far away', 40.0, -3.0)
+        route = FiberRoute.objects.create(office=self.office, name='R1', length_km=0,
+                                          path=[[12.9700, 77.5930], [12.9716, 77.5946], [12.9730, 77.5960]])
+        tile = self.render()
+        self.assertEqual(tile['extent'], TILE_EXTENT)
+        [feature] = tile['layers']['junction']['features']
+        x, y, object_id, name, _ = feature
+        self.assertEqual((object_id, name), (junction.pk, 'JB1'))
+        self.assertTrue(0 <= x < TILE_EXTENT and 0 <= y < TILE_EXTENT)
+        [(parts, route_id, route_name)] = tile['layers']['route']['features']
+        self.assertEqual((route_id, route_name), (route.pk, 'R1'))
+        self.assertEqual(len(parts), 1)
+
+    def test_served_from_cache_until_a_change_commits(self):
+        junction = self.add_junction()
+        with mock.patch.object(tiles, 'encode_tile', wraps=tiles.encode_tile) as encode:
+            self.render()
+            self.render()
+            self.assertEqual(encode.call_count, 1)
+            with self.captureOnCommitCallbacks(execute=True):
+                junction.name = 'Renamed'
+                junction.save()
+            self.assertEqual(self.render()['layers']['junction']['features'][0][3], 'Renamed')
+            self.assertEqual(encode.call_count, 2)
+
+    def test_render_overlapping_a_change_is_not_served(self):
+        self.add_junction()
+
+        def encode_during_change(company_id, z, x, y):
+            tile = encode(company_id, z, x, y)
+            # A change to this tile commits while it is being rendered.
+            TileCache.invalidate(company_id, [(12.9716, 77.5946)])
+            return tile
+
+        encode = tiles.encode_tile
+        with mock.patch.object(tiles, 'encode_tile', side_effect=encode_during_change) as render:
+            self.render()
+            self.render()
+        self.assertEqual(render.call_count, 2)
+
+    def test_tile_endpoint(self):
+        self.add_junction()
+        client = make_client(self.company)
+        response = client.get('/api/map/tiles/{}/{}/{}/'.format(*self.TILE))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], tiles.TILE_CONTENT_TYPE)
+        self.assertEqual(len(msgpack.unpackb(response.content)['layers']['junction']['features']), 1)
+        self.assertEqual(client.get('/api/map/tiles/1/5/0/').status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class SnapshotTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.company = make_company()
+        self.staff = make_staff(self.company)
+
+    def add_office(self, routes=2, junctions=2):
+        office = make_office(self.company, 12.97, 77.59)
+        for number in range(routes):
+            path = [[12.97, 77.59 + 0.0001 * step + 0.00001 * (step % 2)] for step in range(50 + number)]
+            FiberRoute.objects.create(office=office, created_by=self.staff, name=f'R{number}', length_km=0, path=path)
+        for number in range(junctions):
+            junction = JunctionBox.objects.create(office=office, name=f'JB{number}', latitude=12.97, longitude=77.59,
+                                                  post_code='1', staff=self.staff)
+            device = NetworkDevice.objects.create(staff=self.staff, office=office, device_type='Splitter',
+                                                  model_name='S8', ratio='1:8', latitude=12.97, logitutde=77.59)
+            JunctionBoxDevice.objects.create(junction_box=junction, device=device)
+            for port_number in range(2):
+                DevicePort.objects.create(device=device, port_number=port_number, port_type='SFP')
+        return office
+
+    def expected(self):
+        return json.loads(JSONRenderer().render(CompanySerializer(Company.objects.get(pk=self.company.pk)).data))
+
+    def snapshot(self, **kwargs):
+        return json.loads(''.join(stream_company_snapshot(self.company.pk, **kwargs)))
+
+    def test_matches_the_nested_serializer(self):
+        self.add_office()
+        self.add_office(routes=0, junctions=1)
+        self.add_office(routes=1, junctions=0)
+        self.assertEqual(self.snapshot(), self.expected())
+
+    def test_query_count_does_not_grow_with_the_company(self):
+        self.add_office(routes=1, junctions=1)
+        with CaptureQueriesContext(connection) as small:
+            self.snapshot()
+        for _ in range(3):
+            self.add_office(routes=3, junctions=3)
+        with CaptureQueriesContext(connection) as large:
+            self.snapshot()
+        self.assertEqual(len(large), len(small))
+
+    def test_resolution_picks_simplified_paths(self):
+        self.add_office(routes=1, junctions=0)
+        route = FiberRoute.objects.get()
+        [office] = self.snapshot(resolution={'zoom': 4})['offices']
+        self.assertEqual(office['fiber_routes'][0]['path'], route.path_for(zoom=4))
+        self.assertLess(len(route.path_for(zoom=4)), len(route.path))
+
+    def test_endpoint_streams_the_snapshot(self):
+        self.add_office()
+        client = make_client(self.company)
+        response = client.get('/api/map/snapshot/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), self.expected())
+        self.assertEqual(client.get('/api/map/snapshot/', {'zoom': 'x'}).status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=MEMORY_CHANNEL_LAYERS, PASSWORD_HASHERS=FAST_HASHERS)
+class MapDataConsumerTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for name, value in (('FLUSH_DELAY', 0.05), ('MAX_PENDING', 3)):
+            patcher = mock.patch.object(consumers, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.staff = make_staff(self.company)
+        self.token = TokenService.encode(self.staff)
+
+    async def connect(self, token=None):
+        communicator = WebsocketCommunicator(MapDataConsumer.as_asgi(), f"/ws/map-data/?token={token or self.token}")
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+    async def change(self, entity, op, object_id, data=None):
+        await get_channel_layer().group_send(company_group(self.company.pk), {
+            "type": "map.change", "entity": entity, "op": op, "id": object_id, "data": data,
+        })
+
+    async def test_rejects_bad_and_revoked_tokens(self):
+        _, connected, code = await self.connect('nope')
+        self.assertEqual((connected, code), (False, 4401))
+
+        communicator, connected, _ = await self.connect()
+        self.assertTrue(connected)
+        await communicator.disconnect()
+
+        token_revocations.revoke_staff(self.staff.pk)
+        _, connected, code = await self.connect()
+        self.assertEqual((connected, code), (False, 4401))
+
+    async def test_batches_wait_for_ack_and_coalesce(self):
+        communicator, _, _ = await self.connect()
+        await self.change('junction', 'create', 1, {'name': 'a'})
+        await self.change('junction', 'update', 1, {'name': 'b'})
+        await self.change('route', 'create', 2, {'name': 'r'})
+        await self.change('route', 'delete', 2)
+        first = await communicator.receive_json_from(timeout=1)
+        self.assertEqual(first, {'type': 'changes', 'batch': 1, 'changes': [
+            {'entity': 'junction', 'op': 'create', 'id': 1, 'data': {'name': 'b'}},
+        ]})
+
+        await self.change('customer', 'update', 3, {'name': 'x'})
+        await self.change('customer', 'update', 3, {'name': 'y'})
+        self.assertTrue(await communicator.receive_nothing(timeout=0.05))
+        await communicator.send_json_to({'type': 'ack', 'batch': 1})
+        second = await communicator.receive_json_from(timeout=1)
+        self.assertEqual(second['changes'], [{'entity': 'customer', 'op': 'update', 'id': 3, 'data': {'name': 'y'}}])
+
+        await communicator.send_json_to({'type': 'ping'})
+        self.assertEqual(await communicator.receive_json_from(timeout=1), {'type': 'pong'})
+        await communicator.disconnect()
+
+    async def test_falling_too_far_behind_asks_for_a_resync(self):
+        communicator, _, _ = await self.connect()
+        await self.change('customer', 'update', 0)
+        await communicator.receive_json_from(timeout=1)
+        for object_id in range(1, 6):
+            await self.change('customer', 'update', object_id)
+        self.assertTrue(await communicator.receive_nothing(timeout=0.05))
+        await communicator.send_json_to({'type': 'ack', 'batch': 1})
+        self.assertEqual(await communicator.receive_json_from(timeout=1), {'type': 'resync', 'batch': 2})
+        await communicator.disconnect()
+
+    def test_committed_changes_are_published(self):
+        office = make_office(self.company)
+        with mock.patch('map_app.signals.publish_map_change') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                junction = JunctionBox.objects.create(office=office, name='JB', latitude=1, longitude=2,
+                                                      post_code='1', staff=self.staff)
+                publish.assert_not_called()
+        publish.assert_called_once()
+        company_id, entity, op, object_id, data = publish.call_args.args
+        self.assertEqual((company_id, entity, op, object_id), (self.company.pk, 'junction', 'create', junction.pk))
+        self.assertEqual(data['name'], 'JB')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class ChangeLogTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.company = make_company()
+
+    def add_office(self, company=None):
+        return make_office(company or self.company)
+
+    def test_sequence_is_gapless_per_company(self):
+        other = make_company('Other')
+        for _ in range(3):
+            self.add_office()
+        self.add_office(other)
+        seqs = list(ChangeLogEntry.objects.filter(company=self.company).order_by('id').values_list('seq', flat=True))
+        self.assertEqual(seqs, [1, 2, 3])
+        self.assertEqual(latest_seq(self.company.pk), 3)
+        self.assertEqual(latest_seq(other.pk), 1)
+
+    def test_changes_collapse_to_latest_state(self):
+        office = self.add_office()
+        route = FiberRoute.objects.create(office=office, name='R', length_km=0, path=[[0, 0], [0, 0.01]])
+        office.name = 'Head office'
+        office.save()
+        route.delete()
+
+        changes, last_seq, has_more = changes_since(self.company.pk, 0)
+        self.assertFalse(has_more)
+        self.assertEqual(last_seq, latest_seq(self.company.pk))
+        self.assertEqual([(change['entity'], change['op']) for change in changes], [('office', 'upsert'), ('route', 'delete')])
+        self.assertEqual(changes[0]['data']['name'], 'Head office')
+        self.assertIsNone(changes[1]['data'])
+        self.assertEqual([change['seq'] for change in changes], sorted(change['seq'] for change in changes))
+        self.assertEqual(changes_since(self.company.pk, last_seq), ([], last_seq, False))
+
+    def test_pages_resume_from_last_seq(self):
+        ids = [self.add_office().pk for _ in range(5)]
+        Office.objects.filter(pk=ids[0]).delete()
+
+        first, since, has_more = changes_since(self.company.pk, 0, limit=3)
+        self.assertTrue(has_more)
+        self.assertEqual(since, 3)
+        # The first office is gone by the time this page is read, so it already shows as deleted.
+        self.assertEqual([(change['id'], change['op']) for change in first],
+                         [(ids[0], 'delete'), (ids[1], 'upsert'), (ids[2], 'upsert')])
+
+        rest, since, has_more = changes_since(self.company.pk, since, limit=3)
+        self.assertFalse(has_more)
+        self.assertEqual(since, 6)
+        self.assertEqual([(change['id'], change['op']) for change in rest],
+                         [(ids[3], 'upsert'), (ids[4], 'upsert'), (ids[0], 'delete')])
+
+    def test_version_moves_once_the_change_commits(self):
+        version = change_version(self.company.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_office()
+            self.assertEqual(change_version(self.company.pk), version)
+        self.assertNotEqual(change_version(self.company.pk), version)
+
+    def test_changes_endpoint(self):
+        office = self.add_office()
+        client = make_client(self.company)
+        response = client.get('/api/map/changes/', {'since': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn({'entity': 'office', 'op': 'upsert', 'id': office.pk}, [
+            {key: change[key] for key in ('entity', 'op', 'id')} for change in response.data['changes']])
+        self.assertTrue(client.get('/api/map/changes/', {'since': 10 ** 6}).data['resync'])
+        self.assertEqual(client.get('/api/map/changes/', {'since': 'x'}).status_code, 400)
+
+
+class GridIndexNearestTests(SimpleTestCase):
+
+    def build(self, rnd, count, cell_size, south, west, span):
+        index, points = GridIndex(cell_size=cell_size), {}
+        for key in range(count):
+            lat, lng = south + rnd.random() * span, west + rnd.random() * span
+            index.insert(key, lat, lng, None)
+            points[key] = (lat, lng)
+        return index, points
+
+    def brute_force(self, points, lat, lng, k, max_distance=None, accept=None):
+        distances = sorted(
+            haversine_m(lat, lng, p_lat, p_lng) for key, (p_lat, p_lng) in points.items()
+            if accept is None or accept(key, None)
+        )
+        if max_distance is not None:
+            distances = [distance for distance in distances if distance <= max_distance]
+        return distances[:k]
+
+    def assert_matches(self, index, points, lat, lng, k, **kwargs):
+        found = [distance for distance, _, _ in index.nearest(lat, lng, k, **kwargs)]
+        expected = self.brute_force(points, lat, lng, k, **kwargs)
+        self.assertEqual(len(found), len(expected))
+        for got, want in zip(found, expected):
+            self.assertAlmostEqual(got, want, places=6)
+
+    def test_matches_brute_force(self):
+        rnd = random.Random(7)
+        for cell_size, south, span in ((0.01, 12.9, 0.2), (0.5, -10, 20), (0.01, 84, 5)):
+            index, points = self.build(rnd, 400, cell_size, south, 77.0, span)
+            for _ in range(40):
+                lat, lng = south + rnd.uniform(-0.2, 1.2) * span, 77.0 + rnd.uniform(-0.2, 1.2) * span
+                for k in (1, 5, 50):
+                    self.assert_matches(index, points, lat, lng, k)
+
+    def test_far_query_point(self):
+        index, points = self.build(random.Random(3), 50, 0.01, 12.9, 77.5, 0.1)
+        self.assert_matches(index, points, -40.0, -70.0, 3)
+
+    def test_max_distance_and_accept(self):
+        rnd = random.Random(11)
+        index, points = self.build(rnd, 300, 0.01, 12.9, 77.5, 0.2)
+        even = lambda key, payload: key % 2 == 0
+        for _ in range(30):
+            lat, lng = 12.9 + rnd.random() * 0.2, 77.5 + rnd.random() * 0.2
+            self.assert_matches(index, points, lat, lng, 10, max_distance=1500)
+            self.assert_matches(index, points, lat, lng, 10, accept=even)
+
+    def test_empty_index_and_removed_points(self):
+        index = GridIndex()
+        self.assertEqual(index.nearest(0, 0, 3), [])
+        index.insert('a', 0.0, 0.0, None)
+        index.insert('b', 0.0, 0.001, None)
+        index.remove('a')
+        self.assertEqual([key for _, key, _ in index.nearest(0, 0, 3)], ['b'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class MapNearestViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(views, 'company_indexes', CompanyIndexCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.office = make_office(self.company)
+        self.staff = make_staff(self.company)
+        self.api = make_client(self.company)
+
+    def add_junction(self, name, latitude, longitude):
+        return JunctionBox.objects.create(office=self.office, name=name, latitude=latitude, longitude=longitude,
+                                          post_code='1', staff=self.staff)
+
+    def test_nearest_first_within_radius(self):
+        near = self.add_junction('near', 12.9701, 77.59)
+        far = self.add_junction('far', 12.98, 77.59)
+        self.add_junction('out of range', 13.5, 77.59)
+        response = self.api.get('/api/map/nearest/', {'lat': 12.97, 'lng': 77.59, 'k': 5, 'radius': 5000})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(result['layer'], result['id']) for result in response.data['results']],
+                         [('junction', near.pk), ('junction', far.pk)])
+        self.assertEqual(response.data['results'][0]['distance_m'], round(haversine_m(12.97, 77.59, 12.9701, 77.59), 1))
+
+    def test_layer_filter_and_validation(self):
+        self.add_junction('near', 12.9701, 77.59)
+        response = self.api.get('/api/map/nearest/', {'lat': 12.97, 'lng': 77.59, 'layers': 'customer'})
+        self.assertEqual(response.data['count'], 0)
+        for params in ({'lng': 77.59}, {'lat': 91, 'lng': 0}, {'lat': 0, 'lng': 0, 'k': 0},
+                       {'lat': 0, 'lng': 0, 'radius': -1}, {'lat': 0, 'lng': 0, 'layers': 'foo'}):
+            self.assertEqual(self.api.get('/api/map/nearest/', params).status_code, 400)
+
+
+class ClusterGeometryTests(SimpleTestCase):
+
+    def test_cells_split_into_four(self):
+        rnd = random.Random(9)
+        for _ in range(200):
+            lat, lng = rnd.uniform(-80, 80), rnd.uniform(-180, 180)
+            zoom = rnd.randint(0, 20)
+            cx, cy = cluster_cell(lat, lng, zoom)
+            child_x, child_y = cluster_cell(lat, lng, zoom + 1)
+            self.assertEqual((child_x // 2, child_y // 2), (cx, cy))
+            south, west, north, east = cell_bounds(zoom, cx, cy)
+            self.assertTrue(south <= lat <= north and west <= lng <= east)
+
+    def test_valid_cells(self):
+        self.assertTrue(is_valid_cell(0, 3, 3))
+        self.assertFalse(is_valid_cell(0, 4, 0))
+        self.assertFalse(is_valid_cell(-1, 0, 0))
+        self.assertFalse(is_valid_cell(23, 0, 0))
+
+    def test_groups_points_by_cell(self):
+        points = [
+            ('customer', {'id': 1, 'latitude': 12.9700, 'longitude': 77.5900}),
+            ('device', {'id': 2, 'latitude': 12.9702, 'longitude': 77.5902}),
+            ('customer', {'id': 3, 'latitude': -33.86, 'longitude': 151.2}),
+        ]
+        clusters = {cluster['count']: cluster for cluster in cluster_points(points, 10)}
+        self.assertEqual(sorted(clusters), [1, 2])
+        self.assertEqual(clusters[2]['layers'], {'customer': 1, 'device': 1})
+        self.assertAlmostEqual(clusters[2]['latitude'], 12.9701)
+        self.assertNotIn('feature', clusters[2])
+        self.assertEqual(clusters[1]['feature'], {'layer': 'customer', **points[2][1]})
+        self.assertEqual(clusters[1]['id'], '10/%d/%d' % cluster_cell(-33.86, 151.2, 10))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class MapClusterViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(clusters, 'company_indexes', CompanyIndexCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.office = make_office(self.company)
+        self.staff = make_staff(self.company)
+        self.api = make_client(self.company)
+
+    def add_junction(self, name, latitude, longitude):
+        with self.captureOnCommitCallbacks(execute=True):
+            return JunctionBox.objects.create(office=self.office, name=name, latitude=latitude, longitude=longitude,
+                                              post_code='1', staff=self.staff)
+
+    def get_clusters(self, zoom, bbox='77,12,78,13'):
+        response = self.api.get('/api/map/clusters/', {'bbox': bbox, 'zoom': zoom, 'layers': 'junction'})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_clusters_inside_viewport(self):
+        self.add_junction('a', 12.9700, 77.5900)
+        self.add_junction('b', 12.9705, 77.5905)
+        self.add_junction('far', 12.5, 77.2)
+        self.add_junction('outside', 30.0, 77.5)
+        data = self.get_clusters(8)
+        self.assertEqual((data['count'], data['points']), (2, 3))
+        self.assertEqual(sorted(cluster['count'] for cluster in data['clusters']), [1, 2])
+
+        # Past the cached zooms the viewport alone is clustered.
+        data = self.get_clusters(20, bbox='77.58,12.96,77.60,12.98')
+        self.assertEqual((data['count'], data['points']), (2, 2))
+
+    def test_cached_zoom_follows_changes(self):
+        self.add_junction('a', 12.97, 77.59)
+        self.assertEqual(self.get_clusters(6)['points'], 1)
+        self.add_junction('b', 12.98, 77.60)
+        self.assertEqual(self.get_clusters(6)['points'], 2)
+
+    def test_expand_splits_a_cluster(self):
+        self.add_junction('a', 12.9700, 77.5900)
+        self.add_junction('b', 12.9705, 77.5905)
+        cluster, = self.get_clusters(8)['clusters']
+        response = self.api.get(f"/api/map/clusters/{cluster['id']}/", {'layers': 'junction'})
+        self.assertEqual(response.status_code, 200)
+        zoom = response.data['expansion_zoom']
+        self.assertGreater(zoom, 8)
+        self.assertEqual(response.data['count'], 2)
+        self.assertTrue(all(child['id'].startswith(f"{zoom}/") for child in response.data['children']))
+
+    def test_validation(self):
+        for params in ({'bbox': '77,12,78,13'}, {'bbox': '77,12,78,13', 'zoom': 23}, {'zoom': 5},
+                       {'bbox': '77,12,78,13', 'zoom': 5, 'layers': 'route'}):
+            self.assertEqual(self.api.get('/api/map/clusters/', params).status_code, 400)
+        self.assertEqual(self.api.get('/api/map/clusters/0/9/0/').status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TopologyTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.company = make_company()
+        self.network = make_network(self.company)
+
+    def test_customer_traces_up_to_the_olt(self):
+        network = self.network
+        topology = CompanyTopology.build(self.company.pk)
+        hops, olt = topology.trace(topology.node(CUSTOMER, network.customer.pk))
+        self.assertEqual([(topology.kind[hop], topology.object_id[hop]) for hop in hops], [
+            (CUSTOMER, network.customer.pk), (PORT, network.port.pk), (DEVICE, network.splitter.pk),
+            (JUNCTION, network.junction.pk), (ROUTE, network.route.pk), (OFFICE, network.office.pk),
+        ])
+        self.assertEqual(olt, topology.node(DEVICE, network.olt.pk))
+
+    def test_route_end_away_from_any_site_breaks_the_chain(self):
+        FiberRoute.objects.filter(pk=self.network.route.pk).delete()
+        FiberRoute.objects.create(office=self.network.office, name='Stray', length_km=0,
+                                  path=[[12.97, 77.59], [12.975, 77.60]])
+        topology = CompanyTopology.build(self.company.pk)
+        hops, olt = topology.trace(topology.node(CUSTOMER, self.network.customer.pk))
+        self.assertIsNone(olt)
+        self.assertEqual(topology.kind[hops[-1]], JUNCTION)
+
+    def test_subtree_from_preorder(self):
+        topology = CompanyTopology.build(self.company.pk)
+        junction = topology.node(JUNCTION, self.network.junction.pk)
+        self.assertEqual(sorted(topology.subtree(junction).tolist()), sorted([
+            junction, topology.node(DEVICE, self.network.splitter.pk),
+            topology.node(PORT, self.network.port.pk), topology.node(CUSTOMER, self.network.customer.pk),
+        ]))
+
+    def test_cache_rebuilds_on_change(self):
+        topologies = TopologyCache()
+        topology = topologies.get(self.company.pk)
+        self.assertIs(topologies.get(self.company.pk), topology)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.network.customer.device_port = None
+            self.network.customer.save()
+        rebuilt = topologies.get(self.company.pk)
+        self.assertIsNot(rebuilt, topology)
+        self.assertIsNone(rebuilt.trace(rebuilt.node(CUSTOMER, self.network.customer.pk))[1])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class MapTraceViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(views, 'company_topologies', TopologyCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.network = make_network(self.company)
+        self.api = make_client(self.company)
+
+    def test_trace_customer(self):
+        response = self.api.get(f'/api/map/trace/customer/{self.network.customer.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['complete'])
+        self.assertEqual(response.data['olt'], {'type': 'device', 'id': self.network.olt.pk, 'name': 'OLT-1'})
+        self.assertEqual([hop['type'] for hop in response.data['path']],
+                         ['customer', 'port', 'device', 'junction', 'route', 'office', 'device'])
+
+    def test_unknown_elements(self):
+        self.assertEqual(self.api.get('/api/map/trace/customer/999999/').status_code, 404)
+        self.assertEqual(self.api.get(f'/api/map/trace/cable/{self.network.route.pk}/').status_code, 400)
+        # Another company's customers are not part of this topology.
+        other = make_company('Other')
+        stranger = Customer.objects.create(staff=make_staff(other), office=make_office(other), name='Stranger',
+                                           email='s@example.com', phone='200', address='x', latitude=0, longitude=0)
+        self.assertEqual(self.api.get(f'/api/map/trace/customer/{stranger.pk}/').status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PowerBudgetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(power, 'company_topologies', TopologyCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.network = make_network(self.company)
+        self.budgets = PowerBudgetCache()
+
+    def customer_power(self, budget):
+        return budget.received(budget.topology.node(CUSTOMER, self.network.customer.pk))
+
+    def assertMatchesRebuild(self, budget):
+        rebuilt = PowerBudget.build(self.company.pk)
+        for node in range(len(budget.topology.parent)):
+            expected, received = rebuilt.received(node), budget.received(node)
+            if expected is None:
+                self.assertIsNone(received)
+            else:
+                self.assertAlmostEqual(received, expected, places=9)
+
+    def test_losses_along_the_chain(self):
+        route = FiberRoute.objects.get(pk=self.network.route.pk)
+        expected = 5.0 - route_loss_db(route.length_km) - port_loss_db('Splitter', '1:8', None, 0)
+        self.assertAlmostEqual(self.customer_power(self.budgets.get(self.company.pk)), expected)
+
+    def test_route_and_device_updates_are_patched(self):
+        budget = self.budgets.get(self.company.pk)
+        before = self.customer_power(budget)
+        with self.captureOnCommitCallbacks(execute=True):
+            route = FiberRoute.objects.get(pk=self.network.route.pk)
+            # Same ends, longer detour.
+            route.path = [[12.97, 77.59], [12.975, 77.60], [12.98, 77.59]]
+            route.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.network.olt.output_power = 7.0
+            self.network.olt.save()
+        patched = self.budgets.get(self.company.pk)
+        self.assertIs(patched, budget)
+        self.assertNotAlmostEqual(self.customer_power(patched), before)
+        self.assertMatchesRebuild(patched)
+
+    def test_structural_change_rebuilds(self):
+        budget = self.budgets.get(self.company.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.network.customer.device_port = None
+            self.network.customer.save()
+        rebuilt = self.budgets.get(self.company.pk)
+        self.assertIsNot(rebuilt, budget)
+        self.assertIsNone(self.customer_power(rebuilt))
+        self.assertMatchesRebuild(rebuilt)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class MapPowerViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for target, attribute, value in ((views, 'company_power_budgets', PowerBudgetCache()),
+                                         (power, 'company_topologies', TopologyCache())):
+            patcher = mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.network = make_network(self.company)
+        self.api = make_client(self.company)
+
+    def test_customer_margins(self):
+        response = self.api.get('/api/map/power/')
+        self.assertEqual(response.status_code, 200)
+        customer, = response.data['nodes']
+        self.assertEqual(customer['id'], self.network.customer.pk)
+        self.assertEqual(customer['margin_db'], round(customer['received_dbm'] - response.data['sensitivity_dbm'], 2))
+        self.assertEqual(self.api.get('/api/map/power/', {'max_margin': customer['margin_db'] - 1}).data['count'], 0)
+        self.assertEqual(self.api.get('/api/map/power/', {'types': 'port,device'}).data['count'], 3)
+        self.assertEqual(self.api.get('/api/map/power/', {'types': 'cable'}).status_code, 400)
+        self.assertEqual(self.api.get('/api/map/power/', {'max_margin': 'x'}).status_code, 400)
+
+    def test_detail_walks_down_from_the_olt_site(self):
+        response = self.api.get(f'/api/map/power/customer/{self.network.customer.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([hop['type'] for hop in response.data['path']],
+                         ['office', 'route', 'junction', 'device', 'port', 'customer'])
+        received = [hop['received_dbm'] for hop in response.data['path']]
+        self.assertEqual(received, sorted(received, reverse=True))
+        self.assertEqual(self.api.get('/api/map/power/customer/999999/').status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CutImpactTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.company = make_company()
+        self.network = make_network(self.company)
+
+    def test_downstream_of_the_route_is_cut_off(self):
+        network = self.network
+        topology = CompanyTopology.build(self.company.pk)
+        connected, olt, affected = cut_impact(topology, network.route.pk)
+        self.assertTrue(connected)
+        self.assertEqual(olt, topology.node(DEVICE, network.olt.pk))
+        self.assertEqual({kind: [item['id'] for item in items] for kind, items in affected.items()}, {
+            'office': [], 'route': [], 'junction': [network.junction.pk],
+            'device': [network.splitter.pk], 'customer': [network.customer.pk],
+        })
+
+    def test_matches_tracing_every_node(self):
+        topology = CompanyTopology.build(self.company.pk)
+        route = topology.node(ROUTE, self.network.route.pk)
+        _, _, affected = cut_impact(topology, self.network.route.pk)
+        cut_off = {(kind, item['id']) for kind, items in affected.items() for item in items}
+        for node in range(len(topology.parent)):
+            if topology.kind[node] == PORT:
+                continue
+            hops, _ = topology.trace(node)
+            expected = route in hops[1:]
+            self.assertEqual((topology.describe(node)['type'], topology.object_id[node]) in cut_off, expected)
+
+    def test_unknown_route(self):
+        connected, olt, affected = cut_impact(CompanyTopology.build(self.company.pk), 999999)
+        self.assertEqual((connected, olt), (False, None))
+        self.assertFalse(any(affected.values()))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class MapImpactViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for attribute, value in (('company_indexes', CompanyIndexCache()), ('company_topologies', TopologyCache())):
+            patcher = mock.patch.object(views, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.network = make_network(self.company)
+        self.api = make_client(self.company)
+
+    def test_cut_snapped_from_a_point(self):
+        response = self.api.get('/api/map/impact/', {'lat': 12.9751, 'lng': 77.5903})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['cut']['route']['id'], self.network.route.pk)
+        self.assertLess(response.data['cut']['snap_distance_m'], 20)
+        self.assertTrue(response.data['connected'])
+        self.assertEqual(response.data['counts'], {'office': 0, 'route': 0, 'junction': 1, 'device': 1, 'customer': 1})
+
+    def test_cut_along_a_route(self):
+        response = self.api.get('/api/map/impact/', {'route': self.network.route.pk, 'distance': 300})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['cut']['along_m'], 300.0)
+        self.assertEqual(response.data['affected']['customer'], [{'id': self.network.customer.pk, 'name': 'Cust'}])
+
+    def test_nothing_to_cut_and_validation(self):
+        self.assertEqual(self.api.get('/api/map/impact/', {'lat': 13.5, 'lng': 77.59}).status_code, 404)
+        self.assertEqual(self.api.get('/api/map/impact/', {'route': 999999}).status_code, 404)
+        for params in ({'lat': 12.97}, {'lat': 'x', 'lng': 0}, {'lat': 0, 'lng': 0, 'radius': 5000},
+                       {'route': self.network.route.pk, 'distance': -1}):
+            self.assertEqual(self.api.get('/api/map/impact/', params).status_code, 400)
+
+
+class WeakPointTests(SimpleTestCase):
+    """find_weak_points against removing each route and site in turn and re-checking reachability."""
+
+    def random_topology(self, rnd):
+        topology = CompanyTopology()
+        sites = [topology.add_node(rnd.choice((OFFICE, JUNCTION)), number, '') for number in range(rnd.randint(2, 12))]
+        customers = {}
+        for site in sites:
+            customers[site] = rnd.randint(0, 3)
+            device = topology.add_node(DEVICE, site, '')
+            topology.parent[device] = site
+            for _ in range(customers[site]):
+                customer = topology.add_node(CUSTOMER, len(topology.parent), '')
+                topology.parent[customer] = device
+        for olt_site in rnd.sample(sites, rnd.randint(1, 2)):
+            topology.olts[olt_site] = topology.add_node(DEVICE, -olt_site, 'OLT')
+        edges = []
+        for number in range(rnd.randint(0, 2 * len(sites))):
+            a, b = rnd.choice(sites), rnd.choice(sites)
+            route = topology.add_node(ROUTE, number, '')
+            topology.links.setdefault(a, []).append((route, b))
+            topology.links.setdefault(b, []).append((route, a))
+            edges.append((route, a, b))
+        return topology, sites, edges, customers
+
+    def reachable(self, topology, removed_route=None, removed_site=None):
+        seen = {site for site in topology.olts if site != removed_site}
+        queue = deque(seen)
+        while queue:
+            site = queue.popleft()
+            for route, neighbour in topology.links.get(site, ()):
+                if route != removed_route and neighbour != removed_site and neighbour not in seen:
+                    seen.add(neighbour)
+                    queue.append(neighbour)
+        return seen
+
+    def test_matches_brute_force(self):
+        rnd = random.Random(5)
+        for _ in range(300):
+            topology, sites, edges, customers = self.random_topology(rnd)
+            lit = self.reachable(topology)
+
+            expected_bridges = {}
+            for route, a, b in edges:
+                lost = lit - self.reachable(topology, removed_route=route)
+                if lost:
+                    expected_bridges[route] = ({a, b}, sum(customers[site] for site in lost), len(lost))
+            expected_points = {}
+            for site in lit:
+                lost = lit - {site} - self.reachable(topology, removed_site=site)
+                if lost:
+                    expected_points[site] = (customers[site] + sum(customers[s] for s in lost), 1 + len(lost))
+
+            bridges, points = find_weak_points(topology)
+            self.assertEqual(
+                {route: ({upstream, downstream}, cut_customers, cut_sites)
+                 for (route, upstream, downstream), cut_customers, cut_sites in bridges},
+                expected_bridges,
+            )
+            self.assertEqual({site: (cut_customers, cut_sites) for site, cut_customers, cut_sites in points},
+                             expected_points)
+
+    def test_chain(self):
+        topology = CompanyTopology()
+        a, b, c = (topology.add_node(OFFICE, number, '') for number in range(3))
+        topology.olts[a] = topology.add_node(DEVICE, 0, 'OLT')
+        first, second = topology.add_node(ROUTE, 1, ''), topology.add_node(ROUTE, 2, '')
+        topology.links = {a: [(first, b)], b: [(first, a), (second, c)], c: [(second, b)]}
+
+        bridges, points = find_weak_points(topology)
+        self.assertEqual(bridges, [((first, a, b), 0, 2), ((second, b, c), 0, 1)])
+        # Losing the OLT site darkens everything downstream of it as well.
+        self.assertEqual(points, [(a, 0, 3), (b, 0, 2)])
+
+        # A second route between the same sites is redundancy, not a bridge.
+        spare = topology.add_node(ROUTE, 3, '')
+        topology.links[b].append((spare, c))
+        topology.links[c].append((spare, b))
+        bridges, points = find_weak_points(topology)
+        self.assertEqual(bridges, [((first, a, b), 0, 2)])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ResilienceReportTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(resilience, 'company_topologies', TopologyCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.network = make_network(self.company)
+
+    def test_feeder_is_the_weak_point(self):
+        report = build_resilience_report(self.company.pk)
+        self.assertEqual(report['version'], change_version(self.company.pk))
+        bridge, = report['bridges']
+        self.assertEqual((bridge['type'], bridge['id']), ('route', self.network.route.pk))
+        self.assertEqual([site['id'] for site in bridge['between']], [self.network.office.pk, self.network.junction.pk])
+        self.assertEqual((bridge['isolated_customers'], bridge['isolated_sites']), (1, 1))
+        point, = report['articulation_points']
+        self.assertEqual((point['type'], point['id']), ('office', self.network.office.pk))
+        self.assertEqual((point['isolated_customers'], point['isolated_sites']), (1, 2))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class MapResilienceViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(resilience, 'company_topologies', TopologyCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.network = make_network(self.company)
+        self.api = make_client(self.company)
+
+    def test_report_is_queued_once_per_version_and_served_from_cache(self):
+        with mock.patch('map_app.tasks.analyze_company_resilience.delay') as delay:
+            self.assertEqual(self.api.get('/api/map/resilience/').status_code, 202)
+            self.assertEqual(self.api.get('/api/map/resilience/').status_code, 202)
+            delay.assert_called_once_with(self.company.pk)
+
+            store_resilience_report(self.company.pk)
+            response = self.api.get('/api/map/resilience/')
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.data['stale'])
+            self.assertEqual(response.data['counts'], {'bridges': 1, 'articulation_points': 1})
+            self.assertEqual(delay.call_count, 1)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.network.junction.name = 'J1b'
+                self.network.junction.save()
+            response = self.api.get('/api/map/resilience/', {'limit': 1})
+            self.assertTrue(response.data['stale'])
+            self.assertEqual(delay.call_count, 2)
+
+    def test_limit_validation(self):
+        for limit in ('0', 'x', '100000'):
+            self.assertEqual(self.api.get('/api/map/resilience/', {'limit': limit}).status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PortCapacityTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.company = make_company()
+        self.network = make_network(self.company)
+
+    def counters(self):
+        splitter = NetworkDevice.objects.get(pk=self.network.splitter.pk)
+        junction = JunctionBox.objects.get(pk=self.network.junction.pk)
+        return (splitter.ports_total, splitter.ports_used), (junction.ports_total, junction.ports_used)
+
+    def test_counters_follow_ports_and_customers(self):
+        network = self.network
+        self.assertEqual(self.counters(), ((1, 1), (1, 1)))
+        second = DevicePort.objects.create(device=network.splitter, port_number=2, port_type='SFP')
+        self.assertEqual(self.counters(), ((2, 1), (2, 1)))
+        network.customer.device_port = second
+        network.customer.save()
+        self.assertEqual(self.counters(), ((2, 1), (2, 1)))
+        network.customer.delete()
+        self.assertEqual(self.counters(), ((2, 0), (2, 0)))
+        network.port.delete()
+        self.assertEqual(self.counters(), ((1, 0), (1, 0)))
+        JunctionBoxDevice.objects.filter(junction_box=network.junction).delete()
+        self.assertEqual(self.counters(), ((1, 0), (0, 0)))
+
+    def test_customer_assignment_bumps_the_version_once(self):
+        port = DevicePort.objects.create(device=self.network.splitter, port_number=2, port_type='SFP')
+        with mock.patch.object(changelog, 'bump_change_version', wraps=changelog.bump_change_version) as bump, \
+                self.captureOnCommitCallbacks(execute=True):
+            before = latest_seq(self.company.pk)
+            Customer.objects.create(staff=self.network.staff, office=self.network.office, name='New',
+                                    email='n@example.com', phone='101', address='x', latitude=12.98,
+                                    longitude=77.59, device_port=port)
+        bump.assert_called_once_with(self.company.pk)
+        # The customer plus the recounted splitter and junction box are still logged.
+        self.assertEqual({(change['entity'], change['op']) for change in changes_since(self.company.pk, before)[0]},
+                         {('customer', 'upsert'), ('device', 'upsert'), ('junction', 'upsert')})
+
+    def test_recount_repairs_bulk_writes(self):
+        NetworkDevice.objects.filter(pk=self.network.splitter.pk).update(ports_total=9, ports_used=9)
+        JunctionBox.objects.filter(pk=self.network.junction.pk).update(ports_used=0)
+        out = io.StringIO()
+        call_command('recount_port_capacity', company=self.company.pk, stdout=out)
+        self.assertIn("2 rows corrected", out.getvalue())
+        self.assertEqual(self.counters(), ((1, 1), (1, 1)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class MapCapacityViewTests(TestCase):
+    url = '/api/map/capacity/'
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(views, 'company_indexes', CompanyIndexCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.network = make_network(self.company)
+        self.api = make_client(self.company)
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in (2, 3):
+                DevicePort.objects.create(device=self.network.splitter, port_number=number, port_type='SFP')
+
+    def test_free_ports_within_radius(self):
+        params = {'lat': 12.98, 'lng': 77.59, 'radius': 500}
+        response = self.api.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(result['id'], result['ports_free']) for result in response.data['results']],
+                         [(self.network.splitter.pk, 2)])
+        self.assertEqual(self.api.get(self.url, {**params, 'min_free': 3}).data['count'], 0)
+        self.assertEqual(self.api.get(self.url, {**params, 'device_type': 'OLT'}).data['count'], 0)
+        junction, = self.api.get(self.url, {**params, 'layers': 'junction'}).data['results']
+        self.assertEqual((junction['id'], junction['ports_free']), (self.network.junction.pk, 2))
+        self.assertEqual(self.api.get(self.url, {**params, 'radius': 10, 'lat': 12.97}).data['count'], 0)
+
+    def test_validation(self):
+        for params in ({'lat': 0, 'lng': 0}, {'lat': 0, 'lng': 0, 'radius': 0},
+                       {'lat': 0, 'lng': 0, 'radius': 10, 'min_free': -1},
+                       {'lat': 0, 'lng': 0, 'radius': 10, 'layers': 'customer'}):
+            self.assertEqual(self.api.get(self.url, params).status_code, 400)
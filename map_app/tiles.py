@@ -0,0 +1,219 @@
+import math
+import uuid
+import msgpack
+from django.core.cache import cache
+from .spatial import company_indexes
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+MAX_TILE_ZOOM = 22
+
+# Zoom levels whose tiles are cached; deeper tiles are cheap enough to cut on demand.
+CACHED_ZOOMS = range(0, 19)
+
+# Above this many affected keys a change bumps the company's tile generation
+# instead of restamping tiles one by one.
+MAX_INVALIDATION_KEYS = 5000
+
+TILE_POINT_LAYERS = {
+    'customer': ('name',),
+    'junction': ('name', 'junction_type'),
+    'device': ('model_name', 'device_type'),
+}
+
+TILE_CONTENT_TYPE = 'application/x-msgpack'
+
+
+def world_xy(lat, lng):
+    """Project a coordinate to Web Mercator, normalised to the unit square."""
+    lat = max(min(lat, 85.0511287798), -85.0511287798)
+    sin_lat = math.sin(math.radians(lat))
+    x = (lng + 180.0) / 360.0
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+def tile_bounds(z, x, y, buffer=0):
+    """Return ``(south, west, north, east)`` of a slippy-map tile, optionally padded by ``buffer`` tile pixels."""
+    n = 2 ** z
+    pad = buffer / TILE_EXTENT
+
+    def lng(tx):
+        return tx / n * 360.0 - 180.0
+
+    def lat(ty):
+        ty = min(max(ty, 0), n)
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return lat(y + 1 + pad), max(lng(x - pad), -180.0), lat(y - pad), min(lng(x + 1 + pad), 180.0)
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _delta_encode(coords):
+    """Flatten ``[(x, y), ...]`` into ``[x0, y0, dx1, dy1, ...]`` dropping repeated vertices."""
+    flat = []
+    prev_x = prev_y = None
+    for px, py in coords:
+        if px == prev_x and py == prev_y:
+            continue
+        if prev_x is None:
+            flat.extend((px, py))
+        else:
+            flat.extend((px - prev_x, py - prev_y))
+        prev_x, prev_y = px, py
+    return flat
+
+
+def _clip_line(coords, low, high):
+    """
+    Split a projected polyline into the runs of segments that touch the buffered
+    tile square. Segments entirely outside are dropped.
+    """
+    parts, current = [], []
+    for (x0, y0), (x1, y1) in zip(coords, coords[1:]):
+        outside = (max(x0, x1) < low or min(x0, x1) > high or
+                   max(y0, y1) < low or min(y0, y1) > high)
+        if outside:
+            if len(current) > 1:
+                parts.append(current)
+            current = []
+            continue
+        if not current:
+            current = [(x0, y0)]
+        current.append((x1, y1))
+    if len(current) > 1:
+        parts.append(current)
+    return parts
+
+
+def encode_tile(company_id, z, x, y):
+    """
+    Cut one tile from the company's map index and encode it as msgpack.
+
+    Geometry is quantised to integer tile coordinates (``TILE_EXTENT`` per side)
+    and line parts are delta-encoded, which keeps tiles small enough to ship
+    thousands of features in a few kilobytes.
+    """
+    index = company_indexes.get(company_id)
+    south, west, north, east = tile_bounds(z, x, y, buffer=TILE_BUFFER)
+    scale = 2 ** z
+
+    def project(lat, lng):
+        wx, wy = world_xy(lat, lng)
+        return round((wx * scale - x) * TILE_EXTENT), round((wy * scale - y) * TILE_EXTENT)
+
+    layers = {name: {'keys': ['id', *fields], 'features': []} for name, fields in TILE_POINT_LAYERS.items()}
+    for (layer, _), feature in index.points.query_bbox(south, west, north, east):
+        fields = TILE_POINT_LAYERS.get(layer)
+        if fields is None:
+            continue
+        px, py = project(feature['latitude'], feature['longitude'])
+        layers[layer]['features'].append([px, py, feature['id'], *(feature[field] for field in fields)])
+
+    routes = {'keys': ['id', 'name'], 'features': []}
+    for points, route in index.query_routes(south, west, north, east, zoom=z):
+        coords = [project(lat, lng) for lat, lng in points]
+        parts = _clip_line(coords, -TILE_BUFFER, TILE_EXTENT + TILE_BUFFER)
+        if parts:
+            routes['features'].append([[_delta_encode(part) for part in parts], route['id'], route['name']])
+    layers['route'] = routes
+
+    return msgpack.packb({
+        'v': 1,
+        'z': z, 'x': x, 'y': y,
+        'extent': TILE_EXTENT,
+        'layers': layers,
+    }, use_bin_type=True)
+
+
+def tiles_covering(points):
+    """
+    Every cached tile a point or polyline touches, including neighbours that
+    carry it in their buffer. Long segments are sampled so no tile is skipped.
+    """
+    pad = TILE_BUFFER / TILE_EXTENT
+    world = [world_xy(lat, lng) for lat, lng in points]
+    tiles = set()
+    for z in CACHED_ZOOMS:
+        n = 2 ** z
+        samples = []
+        for i, (wx, wy) in enumerate(world):
+            fx, fy = wx * n, wy * n
+            if i:
+                px, py = samples[-1]
+                steps = int(max(abs(fx - px), abs(fy - py)) * 2)
+                samples.extend((px + (fx - px) * s / (steps + 1), py + (fy - py) * s / (steps + 1))
+                               for s in range(1, steps + 1))
+            samples.append((fx, fy))
+        for fx, fy in samples:
+            for tx in {math.floor(fx - pad), math.floor(fx + pad)}:
+                for ty in {math.floor(fy - pad), math.floor(fy + pad)}:
+                    if 0 <= tx < n and 0 <= ty < n:
+                        tiles.add((z, tx, ty))
+        if len(tiles) > MAX_INVALIDATION_KEYS:
+            return None
+    return tiles
+
+
+class TileCache:
+    """
+    Encoded tiles in the shared Redis cache, keyed per company and tile.
+
+    Every tile has a stamp key, and the tile's cache key carries the stamp
+    read before rendering. Invalidating a tile replaces its stamp rather than
+    deleting the tile, so a render that started before a change commits is
+    stored under the retired stamp and never served.
+    """
+
+    KEY = "map_tile_{company_id}_{generation}_{z}_{x}_{y}_{stamp}"
+    STAMP_KEY = "map_tile_stamp_{company_id}_{z}_{x}_{y}"
+    GENERATION_KEY = "map_tile_generation_{company_id}"
+    TIMEOUT = 60 * 60 * 24
+    # Outlives every tile stored under it, so an expired stamp never strands a live tile.
+    STAMP_TIMEOUT = 2 * TIMEOUT
+
+    @classmethod
+    def generation(cls, company_id):
+        # A random token rather than a counter, so an evicted generation never reissues an old value.
+        return cache.get_or_set(cls.GENERATION_KEY.format(company_id=company_id), uuid.uuid4().hex, timeout=None)
+
+    @classmethod
+    def stamp(cls, company_id, z, x, y):
+        key = cls.STAMP_KEY.format(company_id=company_id, z=z, x=x, y=y)
+        stamp = cache.get(key)
+        if stamp is None:
+            cache.add(key, uuid.uuid4().hex, timeout=cls.STAMP_TIMEOUT)
+            stamp = cache.get(key)
+        return stamp
+
+    @classmethod
+    def get_or_render(cls, company_id, z, x, y):
+        if z not in CACHED_ZOOMS:
+            return encode_tile(company_id, z, x, y)
+
+        # Both are read before rendering; see the class docstring.
+        key = cls.KEY.format(company_id=company_id, generation=cls.generation(company_id), z=z, x=x, y=y,
+                             stamp=cls.stamp(company_id, z, x, y))
+        tile = cache.get(key)
+        if tile is None:
+            tile = encode_tile(company_id, z, x, y)
+            cache.set(key, tile, timeout=cls.TIMEOUT)
+        return tile
+
+    @classmethod
+    def invalidate(cls, company_id, points):
+        """Retire the cached tiles covering ``points``; fall back to a generation bump for huge geometries."""
+        if not points:
+            return
+        tiles = tiles_covering(points)
+        if tiles is None:
+            cache.set(cls.GENERATION_KEY.format(company_id=company_id), uuid.uuid4().hex, timeout=None)
+            return
+
+        cache.set_many({
+            cls.STAMP_KEY.format(company_id=company_id, z=z, x=x, y=y): uuid.uuid4().hex
+            for z, x, y in tiles
+        }, timeout=cls.STAMP_TIMEOUT)
@@ -0,0 +1,224 @@
+import threading
+from array import array
+from collections import deque
+import numpy as np
+from customer_app.models import Customer
+from junction_app.models import JunctionBox, JunctionBoxDevice
+from networkdevice_app.models import NetworkDevice, DevicePort
+from office.models import Office
+from route_app.models import FiberRoute
+from route_app.geometry import path_points
+from .changelog import change_version
+from .spatial import GridIndex
+
+# A route end closer than this to an office or junction box is spliced into it.
+SNAP_DISTANCE_M = 50
+
+ROOT_DEVICE_TYPE = 'OLT'
+
+# Node kinds, stored per node in a byte array.
+OFFICE, ROUTE, JUNCTION, DEVICE, PORT, CUSTOMER = range(6)
+KIND_NAMES = ('office', 'route', 'junction', 'device', 'port', 'customer')
+KIND_BY_NAME = {name: kind for kind, name in enumerate(KIND_NAMES)}
+
+
+class CompanyTopology:
+    """
+    The company's physical network as a forest rooted at its OLTs:
+    customer -> port -> device -> junction box -> route -> junction box / office.
+
+    Nodes are numbered densely and the tree lives in flat arrays (``parent``,
+    ``kind``, ``object_id``), so tracing a customer upstream is a walk over a
+    few integers with no database access.
+
+    Customers attach through ``Customer.device_port``, devices through their
+    JunctionBoxDevice row (or their office when not installed in a box), and
+    routes through whichever office or junction box lies within SNAP_DISTANCE_M
+    of each end. Routes are oriented away from the sites that host an OLT.
+    """
+
+    def __init__(self):
+        self.parent = array('i')
+        self.kind = array('b')
+        self.object_id = array('q')
+        self.labels = []
+        self.nodes = {}
+        # Root site node -> OLT device node hosted there.
+        self.olts = {}
+        # Site node -> [(route node, neighbouring site node)], every spliced route both ways.
+        self.links = {}
+        self._preorder = None
+
+    def add_node(self, kind, object_id, label):
+        node = len(self.parent)
+        self.parent.append(-1)
+        self.kind.append(kind)
+        self.object_id.append(object_id)
+        self.labels.append(label)
+        self.nodes[(kind, object_id)] = node
+        return node
+
+    def node(self, kind, object_id):
+        return self.nodes.get((kind, object_id))
+
+    def describe(self, node):
+        return {'type': KIND_NAMES[self.kind[node]], 'id': self.object_id[node], 'name': self.labels[node]}
+
+    def trace(self, node):
+        """
+        Walk from ``node`` to the root of its tree. Returns ``(hops, olt)``
+        where ``olt`` is the OLT node serving that root, or None when the
+        chain is broken before reaching one.
+        """
+        hops = []
+        while node != -1:
+            hops.append(node)
+            node = self.parent[node]
+        return hops, self.olts.get(hops[-1])
+
+    def preorder(self):
+        """
+        ``(order, position, end, depth)`` of a depth-first preorder over the
+        forest: ``order`` lists the nodes, ``position[node]`` is the node's
+        index in it and ``[position, end)`` is its subtree, with ``end`` and
+        ``depth`` indexed by position. Computed once per topology.
+        """
+        if self._preorder is not None:
+            return self._preorder
+
+        size = len(self.parent)
+        children = [[] for _ in range(size)]
+        roots = []
+        for node, parent in enumerate(self.parent):
+            (children[parent] if parent != -1 else roots).append(node)
+
+        position = np.empty(size, dtype=np.int64)
+        end = np.empty(size, dtype=np.int64)
+        depth = np.zeros(size, dtype=np.int64)
+        order = []
+        stack = [(root, False) for root in reversed(roots)]
+        while stack:
+            node, finished = stack.pop()
+            if finished:
+                end[position[node]] = len(order)
+                continue
+            position[node] = len(order)
+            order.append(node)
+            stack.append((node, True))
+            for child in reversed(children[node]):
+                depth[child] = depth[node] + 1
+                stack.append((child, False))
+
+        order = np.array(order, dtype=np.int64)
+        self._preorder = (order, position, end, depth[order])
+        return self._preorder
+
+    def subtree(self, node):
+        """Every node below ``node`` (itself included) as an array, from the preorder intervals."""
+        order, position, end, _ = self.preorder()
+        start = position[node]
+        return order[start:end[start]]
+
+    @classmethod
+    def build(cls, company_id):
+        topology = cls()
+        add = topology.add_node
+
+        sites = GridIndex()
+        for row in Office.objects.filter(company_id=company_id).values('id', 'name', 'latitude', 'longitude'):
+            node = add(OFFICE, row['id'], row['name'])
+            sites.insert(node, row['latitude'], row['longitude'], None)
+        for row in (JunctionBox.objects.filter(office__company_id=company_id)
+                    .values('id', 'name', 'latitude', 'longitude')):
+            node = add(JUNCTION, row['id'], row['name'])
+            sites.insert(node, row['latitude'], row['longitude'], None)
+
+        # Route ends spliced into sites give an undirected site graph.
+        links = topology.links
+        routes = FiberRoute.objects.filter(office__company_id=company_id, is_deleted=False)
+        for row in routes.values('id', 'name', 'path').iterator(chunk_size=500):
+            points = path_points(row['path'])
+            if len(points) < 2:
+                continue
+            ends = []
+            for lat, lng in (points[0], points[-1]):
+                found = sites.nearest(lat, lng, 1, max_distance=SNAP_DISTANCE_M)
+                ends.append(found[0][1] if found else None)
+            route = add(ROUTE, row['id'], row['name'])
+            if ends[0] is not None and ends[1] is not None and ends[0] != ends[1]:
+                links.setdefault(ends[0], []).append((route, ends[1]))
+                links.setdefault(ends[1], []).append((route, ends[0]))
+
+        devices = NetworkDevice.objects.filter(office__company_id=company_id)
+        device_office = {}
+        roots = []
+        for row in devices.values('id', 'office_id', 'device_type', 'model_name'):
+            node = add(DEVICE, row['id'], row['model_name'])
+            device_office[node] = row['office_id']
+            if row['device_type'] == ROOT_DEVICE_TYPE:
+                roots.append(node)
+
+        parent = topology.parent
+        placements = (JunctionBoxDevice.objects.filter(junction_box__office__company_id=company_id)
+                      .order_by('id').values_list('device_id', 'junction_box_id'))
+        for device_id, junction_id in placements:
+            node = topology.node(DEVICE, device_id)
+            if node is not None and parent[node] == -1:
+                parent[node] = topology.node(JUNCTION, junction_id)
+        for node, office_id in device_office.items():
+            if parent[node] == -1:
+                parent[node] = topology.node(OFFICE, office_id)
+
+        for row in DevicePort.objects.filter(device__office__company_id=company_id).values('id', 'device_id', 'port_number'):
+            node = add(PORT, row['id'], f"Port {row['port_number']}")
+            parent[node] = topology.node(DEVICE, row['device_id'])
+        for row in Customer.objects.filter(office__company_id=company_id).values('id', 'name', 'device_port_id'):
+            node = add(CUSTOMER, row['id'], row['name'])
+            if row['device_port_id'] is not None:
+                parent[node] = topology.node(PORT, row['device_port_id'])
+
+        # Orient the site graph away from OLT sites with a multi-source BFS.
+        queue = deque()
+        for olt in roots:
+            site = parent[olt]
+            if site != -1 and site not in topology.olts:
+                topology.olts[site] = olt
+                queue.append(site)
+        seen = set(queue)
+        while queue:
+            site = queue.popleft()
+            for route, neighbour in links.get(site, ()):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    parent[route] = site
+                    parent[neighbour] = route
+                    queue.append(neighbour)
+        return topology
+
+
+class TopologyCache:
+    """
+    Per-process CompanyTopology per company, rebuilt when the company's change
+    log version moves.
+    """
+
+    def __init__(self):
+        self._topologies = {}
+        self._lock = threading.Lock()
+
+    def get(self, company_id):
+        version = change_version(company_id)
+        cached = self._topologies.get(company_id)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            cached = self._topologies.get(company_id)
+            if cached and cached[0] == version:
+                return cached[1]
+            topology = CompanyTopology.build(company_id)
+            self._topologies[company_id] = (version, topology)
+            return topology
+
+
+company_topologies = TopologyCache()
@@ -1,10 +1,18 @@
 from django.urls import path
+from .views import *
 
 urlpatterns = [
-    
+    path('features/', MapFeaturesView.as_view(), name='map-features'),
+    path('clusters/', MapClusterView.as_view(), name='map-clusters'),
+    path('clusters/<int:z>/<int:x>/<int:y>/', MapClusterExpandView.as_view(), name='map-cluster-expand'),
+    path('capacity/', MapCapacityView.as_view(), name='map-capacity'),
+    path('changes/', MapChangesView.as_view(), name='map-changes'),
+    path('nearest/', MapNearestView.as_view(), name='map-nearest'),
+    path('snapshot/', MapSnapshotView.as_view(), name='map-snapshot'),
+    path('impact/', MapImpactView.as_view(), name='map-impact'),
+    path('power/', MapPowerView.as_view(), name='map-power'),
+    path('power/<str:entity>/<int:pk>/', MapPowerDetailView.as_view(), name='map-power-detail'),
+    path('resilience/', MapResilienceView.as_view(), name='map-resilience'),
+    path('trace/<str:entity>/<int:pk>/', MapTraceView.as_view(), name='map-trace'),
+    path('tiles/<int:z>/<int:x>/<int:y>/', MapTileView.as_view(), name='map-tile'),
 ]
- 
-
-
-
- 
\ No newline at end of file
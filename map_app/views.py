@@ -1 +1,641 @@
-from django.shortcuts import render
\ No newline at end of file
+import logging
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from opticalfiber_app.models import Company
+from route_app.geometry import parse_path_resolution
+from rest_framework import status
+from rest_framework.response import Response
+from opticalfiber_app.views import BaseAPIView
+from .changelog import MAX_CHANGES_PER_PAGE, change_version, changes_since, latest_seq
+from .clusters import CLUSTER_LAYERS, DEFAULT_CLUSTER_LAYERS, ClusterCache, is_valid_cell
+from .impact import DEFAULT_SNAP_DISTANCE_M, MAX_SNAP_DISTANCE_M, cut_impact, locate_cut
+from .layers import MAP_LAYERS
+from .resilience import cached_resilience_report, schedule_resilience_report
+from .snapshot import aiterate, buffered, stream_company_snapshot
+from .spatial import company_indexes, parse_bbox
+from .power import company_power_budgets
+from .topology import KIND_BY_NAME, company_topologies
+from .tiles import MAX_TILE_ZOOM, TileCache, TILE_CONTENT_TYPE, is_valid_tile
+
+logger = logging.getLogger(__name__)
+
+NEAREST_LAYERS = ('junction', 'device', 'customer')
+DEFAULT_NEAREST = 10
+MAX_NEAREST = 100
+DEFAULT_WEAK_POINTS = 50
+CAPACITY_LAYERS = ('device', 'junction')
+DEFAULT_CAPACITY_RESULTS = 100
+MAX_CAPACITY_RESULTS = 1000
+MAX_CAPACITY_RADIUS_M = 50000
+MAX_WEAK_POINTS = 1000
+
+
+class MapAPIView(BaseAPIView):
+    """
+    Shared helpers for the map endpoints, which are all scoped to the
+    authenticated staff member's company.
+    """
+
+    def _get_authenticated_company(self, request):
+        """Authenticate user and return company ID or error response"""
+        user = self.authentication(request)
+        if isinstance(user, Response):
+            return None, user
+
+        company_id = user.get("company")
+        if not company_id:
+            logger.warning("Company ID missing in authentication data for user: %s", user.get("id"))
+            return None, self.error_response("Company information missing", status_code=status.HTTP_400_BAD_REQUEST)
+
+        return company_id, None
+
+    def _get_layers(self, request, default=None):
+        requested = request.query_params.get("layers")
+        if not requested:
+            return list(default or MAP_LAYERS), None
+
+        layers = [name.strip() for name in requested.split(",") if name.strip()]
+        unknown = [name for name in layers if name not in MAP_LAYERS]
+        if unknown:
+            return None, self.error_response(
+                "Unknown map layer requested.",
+                details={"unknown": unknown, "available": list(MAP_LAYERS)},
+            )
+        return layers, None
+
+
+class MapFeaturesView(MapAPIView):
+    """
+    Returns every mapped point (customers, junction boxes, devices, offices and
+    branches) inside ``?bbox=west,south,east,north``, answered from the company's
+    in-memory spatial index. ``?layers=customer,junction`` narrows the result.
+    """
+
+    def get(self, request):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        try:
+            south, west, north, east = parse_bbox(request.query_params.get("bbox"))
+        except ValueError as e:
+            return self.error_response("Invalid bbox.", details=str(e))
+
+        layers, error_response = self._get_layers(request)
+        if error_response:
+            return error_response
+
+        try:
+            index = company_indexes.get(company_id)
+            features = {name: [] for name in layers}
+            for (layer, _), feature in index.points.query_bbox(south, west, north, east):
+                if layer in features:
+                    features[layer].append(feature)
+
+            return Response({
+                "bbox": [west, south, east, north],
+                "count": sum(len(items) for items in features.values()),
+                "features": features,
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unexpected error in MapFeaturesView")
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MapNearestView(MapAPIView):
+    """
+    The ``k`` junction boxes, devices and customers nearest to ``?lat=&lng=``,
+    closest first with their distance in metres. ``?radius=`` caps the search
+    in metres and ``?layers=junction,device`` restricts the types returned.
+    """
+
+    def get(self, request):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        try:
+            lat = float(request.query_params["lat"])
+            lng = float(request.query_params["lng"])
+            k = int(request.query_params.get("k", DEFAULT_NEAREST))
+            radius = request.query_params.get("radius")
+            radius = float(radius) if radius else None
+            if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                raise ValueError("lat/lng are outside valid coordinate ranges.")
+            if not 1 <= k <= MAX_NEAREST:
+                raise ValueError(f"k must be between 1 and {MAX_NEAREST}.")
+            if radius is not None and radius <= 0:
+                raise ValueError("radius must be positive.")
+        except KeyError as e:
+            return self.error_response("Missing parameter.", details=f"{e.args[0]} is required.")
+        except ValueError as e:
+            return self.error_response("Invalid nearest-neighbour query.", details=str(e))
+
+        layers, error_response = self._get_layers(request, default=NEAREST_LAYERS)
+        if error_response:
+            return error_response
+
+        try:
+            index = company_indexes.get(company_id)
+            wanted = set(layers)
+            found = index.points.nearest(lat, lng, k, max_distance=radius, accept=lambda key, _: key[0] in wanted)
+            results = [
+                {"layer": layer, "distance_m": round(distance, 1), **feature}
+                for distance, (layer, _), feature in found
+            ]
+            return Response({"origin": [lat, lng], "count": len(results), "results": results},
+                            status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unexpected error in MapNearestView")
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MapCapacityView(MapAPIView):
+    """
+    Devices (or ``?layers=junction`` boxes) with at least ``?min_free=`` free
+    ports within ``?radius=`` metres of ``?lat=&lng=``, closest first. Answered
+    from the spatial index, whose points carry the maintained port counters.
+    ``?device_type=Splitter`` narrows devices and ``?limit=`` caps the result.
+    """
+
+    def get(self, request):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        params = request.query_params
+        try:
+            lat = float(params["lat"])
+            lng = float(params["lng"])
+            radius = float(params["radius"])
+            min_free = int(params.get("min_free", 1))
+            limit = int(params.get("limit", DEFAULT_CAPACITY_RESULTS))
+            if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                raise ValueError("lat/lng are outside valid coordinate ranges.")
+            if not 0 < radius <= MAX_CAPACITY_RADIUS_M:
+                raise ValueError(f"radius must be between 0 and {MAX_CAPACITY_RADIUS_M} metres.")
+            if min_free < 0:
+                raise ValueError("min_free must not be negative.")
+            if not 1 <= limit <= MAX_CAPACITY_RESULTS:
+                raise ValueError(f"limit must be between 1 and {MAX_CAPACITY_RESULTS}.")
+        except KeyError as e:
+            return self.error_response("Missing parameter.", details=f"{e.args[0]} is required.")
+        except ValueError as e:
+            return self.error_response("Invalid capacity query.", details=str(e))
+
+        layers, error_response = self._get_layers(request, default=("device",))
+        if error_response:
+            return error_response
+        unsupported = [name for name in layers if name not in CAPACITY_LAYERS]
+        if unsupported:
+            return self.error_response("Layer has no port capacity.",
+                                       details={"unsupported": unsupported, "available": list(CAPACITY_LAYERS)})
+        device_type = params.get("device_type")
+
+        def accept(key, feature):
+            if key[0] not in layers or feature["ports_total"] - feature["ports_used"] < min_free:
+                return False
+            return device_type is None or key[0] != "device" or feature["device_type"] == device_type
+
+        try:
+            index = company_indexes.get(company_id)
+            found = index.points.nearest(lat, lng, limit, max_distance=radius, accept=accept)
+            results = [
+                {
+                    "layer": layer,
+                    "distance_m": round(distance, 1),
+                    "ports_free": feature["ports_total"] - feature["ports_used"],
+                    **feature,
+                }
+                for distance, (layer, _), feature in found
+            ]
+            return Response({"origin": [lat, lng], "count": len(results), "results": results},
+                            status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unexpected error in MapCapacityView")
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MapClusterView(MapAPIView):
+    """
+    Customers and devices inside ``?bbox=west,south,east,north`` grouped into
+    grid clusters for ``?zoom=``: one centroid with counts per occupied cell
+    instead of one marker per row. ``?layers=`` picks among customer, junction
+    and device.
+    """
+
+    def _get_cluster_layers(self, request):
+        layers, error_response = self._get_layers(request, default=DEFAULT_CLUSTER_LAYERS)
+        if error_response:
+            return None, error_response
+        unsupported = [name for name in layers if name not in CLUSTER_LAYERS]
+        if unsupported:
+            return None, self.error_response("Layer cannot be clustered.",
+                                             details={"unsupported": unsupported, "available": list(CLUSTER_LAYERS)})
+        return layers, None
+
+    def get(self, request):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        try:
+            south, west, north, east = parse_bbox(request.query_params.get("bbox"))
+            zoom = int(request.query_params.get("zoom", ""))
+            if not 0 <= zoom <= MAX_TILE_ZOOM:
+                raise ValueError(f"zoom must be between 0 and {MAX_TILE_ZOOM}.")
+        except ValueError as e:
+            return self.error_response("Invalid cluster query.", details=str(e))
+
+        layers, error_response = self._get_cluster_layers(request)
+        if error_response:
+            return error_response
+
+        try:
+            clusters = ClusterCache.clusters(company_id, zoom, layers, (south, west, north, east))
+            return Response({
+                "zoom": zoom,
+                "bbox": [west, south, east, north],
+                "count": len(clusters),
+                "points": sum(cluster["count"] for cluster in clusters),
+                "clusters": clusters,
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unexpected error in MapClusterView")
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MapClusterExpandView(MapClusterView):
+    """
+    Expands the cluster ``{zoom}/{x}/{y}`` into the clusters (or single points)
+    it breaks into, together with the zoom at which that happens.
+    """
+
+    def get(self, request, z, x, y):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        if not is_valid_cell(z, x, y):
+            return self.error_response("Invalid cluster id.", status_code=status.HTTP_404_NOT_FOUND)
+
+        layers, error_response = self._get_cluster_layers(request)
+        if error_response:
+            return error_response
+
+        try:
+            expansion_zoom, children = ClusterCache.expand(company_id, z, x, y, layers)
+            return Response({
+                "cluster": f"{z}/{x}/{y}",
+                "expansion_zoom": expansion_zoom,
+                "count": len(children),
+                "children": children,
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unexpected error expanding cluster %s/%s/%s", z, x, y)
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MapTraceView(MapAPIView):
+    """
+    Traces a customer (or any port, device, junction box or route) upstream
+    through the company's network to the OLT that feeds it. ``complete`` is
+    false when the chain breaks before an OLT, e.g. a customer with no port.
+    """
+
+    def get(self, request, entity, pk):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        kind = KIND_BY_NAME.get(entity)
+        if kind is None:
+            return self.error_response("Unknown network element type.",
+                                       details={"available": list(KIND_BY_NAME)})
+
+        try:
+            topology = company_topologies.get(company_id)
+            node = topology.node(kind, pk)
+            if node is None:
+                return self.error_response(f"{entity.capitalize()} not found.", status_code=status.HTTP_404_NOT_FOUND)
+
+            hops, olt = topology.trace(node)
+            path = [topology.describe(hop) for hop in hops]
+            if olt is not None:
+                path.append(topology.describe(olt))
+            return Response({
+                "start": path[0],
+                "complete": olt is not None,
+                "olt": topology.describe(olt) if olt is not None else None,
+                "path": path,
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unexpected error tracing %s %s", entity, pk)
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MapImpactView(MapAPIView):
+    """
+    Who goes down when a fiber is cut. The cut is given as ``?lat=&lng=``,
+    snapped to the nearest route within ``?radius=`` metres, or as
+    ``?route=<id>&distance=<metres along it>``. Returns the offices, routes,
+    junction boxes, devices and customers downstream of that route.
+    """
+
+    def _parse_cut(self, request):
+        params = request.query_params
+        if params.get("route"):
+            distance = float(params.get("distance", 0))
+            if distance < 0:
+                raise ValueError("distance must not be negative.")
+            return {"route_id": int(params["route"]), "distance_m": distance}
+
+        lat, lng = float(params["lat"]), float(params["lng"])
+        radius = float(params.get("radius", DEFAULT_SNAP_DISTANCE_M))
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError("lat/lng are outside valid coordinate ranges.")
+        if not 0 < radius <= MAX_SNAP_DISTANCE_M:
+            raise ValueError(f"radius must be between 0 and {MAX_SNAP_DISTANCE_M} metres.")
+        return {"lat": lat, "lng": lng, "max_distance": radius}
+
+    def get(self, request):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        try:
+            cut = self._parse_cut(request)
+        except KeyError as e:
+            return self.error_response("Missing parameter.", details=f"{e.args[0]} is required (or route).")
+        except ValueError as e:
+            return self.error_response("Invalid cut location.", details=str(e))
+
+        try:
+            located = locate_cut(company_indexes.get(company_id), **cut)
+            if located is None:
+                return self.error_response("No fiber route found at that location.",
+                                           status_code=status.HTTP_404_NOT_FOUND)
+
+            topology = company_topologies.get(company_id)
+            connected, olt, affected = cut_impact(topology, located["route"]["id"])
+            return Response({
+                "cut": located,
+                "connected": connected,
+                "olt": topology.describe(olt) if olt is not None else None,
+                "counts": {kind: len(items) for kind, items in affected.items()},
+                "affected": affected,
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unexpected error in MapImpactView")
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MapPowerView(MapAPIView):
+    """
+    Received optical power and margin over receiver sensitivity for every
+    customer (or ``?types=port,device,...``) of the company, computed from the
+    OLT launch power down through routes, devices and splitter ports.
+    ``?max_margin=3`` keeps only nodes at or below that margin; nodes with no
+    path to an OLT report null power.
+    """
+
+    def _node_power(self, topology, budget, node):
+        received = budget.received(node)
+        return {
+            **topology.describe(node),
+            "received_dbm": round(received, 2) if received is not None else None,
+            "margin_db": round(received - settings.OPTICAL_RX_SENSITIVITY_DBM, 2) if received is not None else None,
+        }
+
+    def get(self, request):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        types = [name.strip() for name in request.query_params.get("types", "customer").split(",") if name.strip()]
+        unknown = [name for name in types if name not in KIND_BY_NAME]
+        if unknown:
+            return self.error_response("Unknown network element type.",
+                                       details={"unknown": unknown, "available": list(KIND_BY_NAME)})
+        try:
+            max_margin = request.query_params.get("max_margin")
+            max_margin = float(max_margin) if max_margin is not None else None
+        except ValueError:
+            return self.error_response("Invalid max_margin.", details="max_margin must be a number in dB.")
+
+        try:
+            budget = company_power_budgets.get(company_id)
+            topology = budget.topology
+            kinds = {KIND_BY_NAME[name] for name in types}
+            nodes = []
+            for node, kind in enumerate(topology.kind):
+                if kind not in kinds:
+                    continue
+                entry = self._node_power(topology, budget, node)
+                if max_margin is not None and (entry["margin_db"] is None or entry["margin_db"] > max_margin):
+                    continue
+                nodes.append(entry)
+
+            return Response({
+                "sensitivity_dbm": settings.OPTICAL_RX_SENSITIVITY_DBM,
+                "count": len(nodes),
+                "nodes": nodes,
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unexpected error in MapPowerView")
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MapPowerDetailView(MapPowerView):
+    """
+    Power budget of one network element: its received power and margin, and
+    the power at every hop back to the OLT.
+    """
+
+    def get(self, request, entity, pk):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        kind = KIND_BY_NAME.get(entity)
+        if kind is None:
+            return self.error_response("Unknown network element type.",
+                                       details={"available": list(KIND_BY_NAME)})
+
+        try:
+            budget = company_power_budgets.get(company_id)
+            topology = budget.topology
+            node = topology.node(kind, pk)
+            if node is None:
+                return self.error_response(f"{entity.capitalize()} not found.", status_code=status.HTTP_404_NOT_FOUND)
+
+            hops, olt = topology.trace(node)
+            return Response({
+                **self._node_power(topology, budget, node),
+                "sensitivity_dbm": settings.OPTICAL_RX_SENSITIVITY_DBM,
+                "olt": topology.describe(olt) if olt is not None else None,
+                "path": [self._node_power(topology, budget, hop) for hop in reversed(hops)],
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unexpected error computing power for %s %s", entity, pk)
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MapResilienceView(MapAPIView):
+    """
+    Single points of failure in the company's network: routes (bridges) and
+    sites (articulation points) whose loss cuts customers off from every OLT,
+    ranked by customers isolated. The report is computed by a Celery task and
+    served from the cache; when the network changed since, the previous
+    report comes back marked ``stale`` while a new one is queued, and 202 is
+    returned until the first report exists. ``?limit=`` caps each list.
+    """
+
+    def get(self, request):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        try:
+            limit = int(request.query_params.get("limit", DEFAULT_WEAK_POINTS))
+            if not 1 <= limit <= MAX_WEAK_POINTS:
+                raise ValueError(f"limit must be between 1 and {MAX_WEAK_POINTS}.")
+        except ValueError as e:
+            return self.error_response("Invalid limit.", details=str(e))
+
+        try:
+            version = change_version(company_id)
+            report = cached_resilience_report(company_id)
+            stale = report is None or report["version"] != version
+            if stale:
+                schedule_resilience_report(company_id, version)
+            if report is None:
+                return Response({"status": "pending"}, status=status.HTTP_202_ACCEPTED)
+
+            return Response({
+                "stale": stale,
+                "computed_at": report["computed_at"],
+                "counts": {
+                    "bridges": len(report["bridges"]),
+                    "articulation_points": len(report["articulation_points"]),
+                },
+                "bridges": report["bridges"][:limit],
+                "articulation_points": report["articulation_points"][:limit],
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unexpected error in MapResilienceView")
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MapTileView(MapAPIView):
+    """
+    Serves one slippy-map tile ``/tiles/{z}/{x}/{y}/`` with the company's fiber
+    routes, junction boxes, devices and customers, msgpack-encoded and cached in Redis.
+    """
+
+    def get(self, request, z, x, y):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        if not is_valid_tile(z, x, y):
+            return self.error_response("Invalid tile coordinates.", status_code=status.HTTP_404_NOT_FOUND)
+
+        try:
+            tile = TileCache.get_or_render(company_id, z, x, y)
+            return HttpResponse(tile, content_type=TILE_CONTENT_TYPE)
+        except Exception as e:
+            logger.exception("Unexpected error rendering tile %s/%s/%s", z, x, y)
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MapSnapshotView(MapAPIView):
+    """
+    Streams the whole company map (offices, fiber routes, junction boxes, their
+    devices and ports) as one JSON document in the ``CompanySerializer`` shape.
+    Optional ``?zoom=`` or ``?tolerance=`` simplify the route paths.
+    """
+
+    def get(self, request):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        try:
+            resolution = parse_path_resolution(request.query_params)
+        except ValueError as e:
+            return self.error_response("Invalid path resolution", details=str(e))
+
+        if not Company.objects.filter(pk=company_id).exists():
+            return self.error_response("Company not found", status_code=status.HTTP_404_NOT_FOUND)
+
+        chunks = buffered(stream_company_snapshot(company_id, request=request, resolution=resolution))
+        if isinstance(request._request, ASGIRequest):
+            # Otherwise Django would collect the whole document before sending it.
+            chunks = aiterate(chunks)
+        return StreamingHttpResponse(chunks, content_type="application/json")
+
+
+class MapChangesView(MapAPIView):
+    """
+    Delta sync for reconnecting clients: ``?since=N`` returns every office,
+    branch, route, junction box, device, port and customer inserted, updated or
+    deleted after change sequence N, each once in its current state. Page with
+    ``since=last_seq`` while ``has_more`` is true; ``resync`` asks the client to
+    reload the snapshot because its sequence is unknown to the server.
+    """
+
+    def get(self, request):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        try:
+            since = int(request.query_params.get("since", 0))
+            limit = min(int(request.query_params.get("limit", MAX_CHANGES_PER_PAGE)), MAX_CHANGES_PER_PAGE)
+            if since < 0 or limit < 1:
+                raise ValueError("since must be >= 0 and limit >= 1.")
+        except ValueError as e:
+            return self.error_response("Invalid change sequence.", details=str(e))
+
+        try:
+            current = latest_seq(company_id)
+            if since > current:
+                return Response({"since": since, "last_seq": current, "has_more": False,
+                                 "resync": True, "changes": []}, status=status.HTTP_200_OK)
+
+            changes, last_seq, has_more = changes_since(company_id, since, limit)
+            return Response({
+                "since": since,
+                "last_seq": last_seq,
+                "has_more": has_more,
+                "resync": False,
+                "changes": changes,
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unexpected error in MapChangesView")
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
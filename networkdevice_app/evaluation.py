@@ -0,0 +1,103 @@
+import json
+from django.conf import settings
+from .calculator import evaluate_chain
+from .models import Design
+
+MAX_EVALUATION_DESIGNS = 200
+# Saved designs are read this many at a time, one query for the designs and one for their couplers.
+EVALUATION_BATCH_SIZE = 50
+
+RANKINGS = {
+    # Best weakest-tap margin first.
+    "margin": lambda row: (row["min_margin_db"] is None, -(row["min_margin_db"] or 0)),
+    # Most taps above the receiver level, then margin.
+    "taps": lambda row: (-row["taps_passing"], row["min_margin_db"] is None, -(row["min_margin_db"] or 0)),
+    # Designs that serve every tap, least fiber first.
+    "fiber": lambda row: (row["taps_passing"] < row["taps"] or not row["taps"], row["fiber_km"], -(row["min_margin_db"] or 0)),
+}
+
+SUMMARY_FIELDS = ("id", "inline", "name", "taps", "taps_passing", "min_margin_db", "fiber_km")
+
+
+def evaluate_design(input_power, couplers, min_receive, attenuation=None):
+    """
+    Power budget of one coupler cascade. ``couplers`` are ``(ratio, tap_km,
+    throughput_km)`` in cascade order. Returns the tap outputs, the weakest
+    tap and its margin over ``min_receive``, and the fiber the design uses.
+    """
+    ratios = [coupler[0] for coupler in couplers]
+    tap_km = [coupler[1] for coupler in couplers]
+    throughput_km = [coupler[2] for coupler in couplers]
+    result = {
+        "input_power": input_power,
+        "taps": len(couplers),
+        "taps_passing": 0,
+        "min_margin_db": None,
+        "weakest_tap": None,
+        "end_output_dbm": input_power,
+        "fiber_km": round(sum(tap_km) + sum(throughput_km), 3),
+        "tap_output_dbm": [],
+    }
+    if not couplers:
+        return result
+
+    tap_output, through_output = evaluate_chain(input_power, ratios, tap_km, throughput_km, attenuation)
+    margins = tap_output - min_receive
+    weakest = int(margins.argmin())
+    result.update({
+        "taps_passing": int((margins >= 0).sum()),
+        "min_margin_db": round(float(margins[weakest]), 2),
+        "weakest_tap": weakest,
+        "end_output_dbm": float(through_output[-1]),
+        "tap_output_dbm": tap_output.tolist(),
+    })
+    return result
+
+
+def saved_designs(company, ids):
+    """Yield the company's designs with ``ids`` in batches, couplers prefetched in cascade order."""
+    for start in range(0, len(ids), EVALUATION_BATCH_SIZE):
+        batch = ids[start:start + EVALUATION_BATCH_SIZE]
+        designs = Design.objects.filter(company=company, pk__in=batch).prefetch_related("couplers")
+        yield [
+            (design.pk, None, design.name, design.input_power,
+             [(c.coupler_ratio, c.tap_km, c.throughput_km) for c in design.couplers.all()])
+            for design in designs
+        ]
+
+
+def inline_designs(designs):
+    """Validated ``DesignSerializer`` payloads as one batch of candidates."""
+    yield [
+        (None, number, data["name"], data["input_power"],
+         [(c["coupler_ratio"], c["tap_km"], c["throughput_km"]) for c in data.get("couplers", [])])
+        for number, data in enumerate(designs)
+    ]
+
+
+def stream_evaluation(candidates, min_receive=None, rank_by="margin"):
+    """
+    Yield NDJSON lines: one ``{"type": "design"}`` row per candidate as soon
+    as its batch is evaluated, then a ``{"type": "ranking"}`` row with the
+    comparison table. ``candidates`` is an iterable of batches of
+    ``(id, inline, name, input_power, couplers)`` tuples.
+    """
+    if min_receive is None:
+        min_receive = settings.OPTICAL_RX_SENSITIVITY_DBM
+    summaries = []
+    for batch in candidates:
+        lines = []
+        for design_id, inline, name, input_power, couplers in batch:
+            row = {"type": "design", "id": design_id, "inline": inline, "name": name}
+            row.update(evaluate_design(input_power, couplers, min_receive))
+            summaries.append({field: row[field] for field in SUMMARY_FIELDS})
+            lines.append(json.dumps(row, separators=(",", ":")) + "\n")
+        if lines:
+            yield "".join(lines)
+
+    summaries.sort(key=RANKINGS[rank_by])
+    for rank, summary in enumerate(summaries, start=1):
+        summary["rank"] = rank
+    yield json.dumps({
+        "type": "ranking", "rank_by": rank_by, "min_receive_dbm": min_receive, "designs": summaries,
+    }, separators=(",", ":")) + "\n"
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from networkdevice_app.models import Design
+from networkdevice_app.calculator import recalculate_designs
+
+
+class Command(BaseCommand):
+    help = "Recompute the tap and through outputs stored on every design's couplers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help="Only recalculate this company's designs.")
+        parser.add_argument('--batch-size', type=int, default=200, help="Designs recalculated per query.")
+
+    def handle(self, *args, **options):
+        designs = Design.objects.order_by('id')
+        if options['company']:
+            designs = designs.filter(company_id=options['company'])
+        batch_size = options['batch_size']
+
+        design_count = coupler_count = 0
+        last_id = 0
+        while True:
+            batch = list(designs.filter(pk__gt=last_id).values_list('id', flat=True)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1]
+            coupler_count += recalculate_designs(Design.objects.filter(pk__in=batch))
+            design_count += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Recalculated {coupler_count} couplers across {design_count} designs."
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('networkdevice_app', '0006_alter_design_company'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='networkdevice',
+            name='output_power',
+            field=models.FloatField(blank=True, null=True, verbose_name='Optical Output Power (dBm)'),
+        ),
+    ]
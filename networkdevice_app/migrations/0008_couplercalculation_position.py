@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+def number_existing_couplers(apps, schema_editor):
+    CouplerCalculation = apps.get_model('networkdevice_app', 'CouplerCalculation')
+    batch = []
+    position, design_id = 0, None
+    for coupler in CouplerCalculation.objects.only('id', 'design_id').order_by('design_id', 'id').iterator(chunk_size=500):
+        position = position + 1 if coupler.design_id == design_id else 0
+        design_id = coupler.design_id
+        coupler.position = position
+        batch.append(coupler)
+        if len(batch) >= 500:
+            CouplerCalculation.objects.bulk_update(batch, ['position'])
+            batch = []
+    if batch:
+        CouplerCalculation.objects.bulk_update(batch, ['position'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('networkdevice_app', '0007_networkdevice_output_power'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='couplercalculation',
+            options={'ordering': ['position', 'id']},
+        ),
+        migrations.AddField(
+            model_name='couplercalculation',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(number_existing_couplers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-18 07:29
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_device_ports(apps, schema_editor):
+    NetworkDevice = apps.get_model('networkdevice_app', 'NetworkDevice')
+    DevicePort = apps.get_model('networkdevice_app', 'DevicePort')
+    totals = dict(DevicePort.objects.values('device_id').annotate(n=Count('id')).values_list('device_id', 'n'))
+    used = dict(
+        DevicePort.objects.filter(customers__isnull=False).values('device_id')
+        .annotate(n=Count('id', distinct=True)).values_list('device_id', 'n')
+    )
+    devices = [
+        NetworkDevice(pk=device_id, ports_total=total, ports_used=used.get(device_id, 0))
+        for device_id, total in totals.items()
+    ]
+    NetworkDevice.objects.bulk_update(devices, ['ports_total', 'ports_used'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer_app', '0003_customer_device_port'),
+        ('networkdevice_app', '0008_couplercalculation_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='networkdevice',
+            name='ports_total',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Ports Recorded'),
+        ),
+        migrations.AddField(
+            model_name='networkdevice',
+            name='ports_used',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Ports In Use'),
+        ),
+        migrations.RunPython(count_device_ports, migrations.RunPython.noop),
+    ]
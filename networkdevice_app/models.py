@@ -35,6 +35,10 @@ class NetworkDevice(models.Model):
     return_loss = models.FloatField(null=True, blank=True, verbose_name="Return Loss (dB)")
     port_count = models.IntegerField(null=True, blank=True, verbose_name="Number of Ports")
     supported_protocols = models.CharField(max_length=255, null=True, blank=True, verbose_name="Supported Protocols")
+    output_power = models.FloatField(null=True, blank=True, verbose_name="Optical Output Power (dBm)")
+    # Maintained from DevicePort rows and the customers assigned to them.
+    ports_total = models.PositiveIntegerField(default=0, editable=False, verbose_name="Ports Recorded")
+    ports_used = models.PositiveIntegerField(default=0, editable=False, verbose_name="Ports In Use")
     latitude = models.FloatField()
     logitutde =  models.FloatField()
 
@@ -74,6 +78,11 @@ class CouplerCalculation(models.Model):
     tap_output_dbm = models.FloatField()
     throughput_km = models.FloatField()
     through_output_dbm = models.FloatField()
+    # Place in the design's cascade; the first coupler is fed by the design's input power.
+    position = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['position', 'id']
 
     def __str__(self):
         return f"{self.design.name} - {self.coupler_ratio}"
@@ -0,0 +1,58 @@
+import math
+import re
+from django.conf import settings
+
+SPLITTER_TYPES = ('Splitter',)
+COUPLER_TYPES = ('Coupler',)
+
+
+def split_fractions(device_type, ratio):
+    """
+    Share of the input power leaving each output port, in port order, parsed
+    from a ratio string. Splitters read ``1:8`` / ``1x8`` / ``2:32`` as equal
+    shares; couplers read ``30:70`` / ``10/90`` as the given proportions.
+    Returns None when the ratio is missing or unreadable.
+    """
+    if not ratio:
+        return None
+    try:
+        parts = [float(part) for part in re.split(r'\s*[:/xX*]\s*', ratio.strip())]
+    except ValueError:
+        return None
+    if len(parts) < 2 or any(part <= 0 for part in parts):
+        return None
+    if device_type in SPLITTER_TYPES:
+        outputs = int(parts[-1])
+        return [1.0 / outputs] * outputs if outputs >= 1 else None
+    total = sum(parts)
+    return [part / total for part in parts]
+
+
+def share_loss_db(fraction):
+    """Ideal loss in dB of keeping ``fraction`` of the power."""
+    return -10 * math.log10(fraction)
+
+
+def device_loss_db(device_type, insertion_loss):
+    """Loss a device adds on its way through; splitters and couplers lose per port instead."""
+    if device_type in SPLITTER_TYPES or device_type in COUPLER_TYPES:
+        return 0.0
+    return insertion_loss or 0.0
+
+
+def port_loss_db(device_type, ratio, insertion_loss, position):
+    """
+    Loss from a device's input to its ``position``-th output port. A splitter's
+    datasheet insertion loss is already per port, so it wins over the ideal split.
+    """
+    if device_type in SPLITTER_TYPES and insertion_loss is not None:
+        return insertion_loss
+    fractions = split_fractions(device_type, ratio)
+    if not fractions:
+        return 0.0
+    fraction = fractions[min(position, len(fractions) - 1)]
+    return share_loss_db(fraction) + settings.OPTICAL_SPLITTER_EXCESS_LOSS_DB
+
+
+def route_loss_db(length_km):
+    return float(length_km or 0) * settings.OPTICAL_FIBER_ATTENUATION_DB_PER_KM + settings.OPTICAL_CONNECTION_LOSS_DB
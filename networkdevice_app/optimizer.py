@@ -0,0 +1,107 @@
+from django.conf import settings
+from .calculator import ratio_losses
+
+# Tap share (percent) of the standard unbalanced couplers, 1/99 up to 50/50.
+STANDARD_TAP_RATIOS = (1, 2, 3, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50)
+
+MAX_CASCADE_TAPS = 500
+
+# Bisection steps on the margin; 40 halvings of a ~100 dB range is far below 0.01 dB.
+MARGIN_SEARCH_STEPS = 40
+
+
+COUPLER_LOSSES = {tap: ratio_losses(f"{tap}/{100 - tap}") for tap in STANDARD_TAP_RATIOS}
+
+
+def plan_cascade(input_power, taps, target, attenuation, feeder_km=0.0):
+    """
+    Assign a coupler to each tap so every tap receives at least ``target`` dBm,
+    or return None when no assignment of standard ratios can.
+
+    Each tap takes the smallest standard ratio that still reaches the target.
+    That leaves the most power on the through port, and every later tap only
+    gets easier with more power, so if this greedy pass fails no assignment
+    succeeds. Rows have the shape of CouplerCalculation: ``throughput_km`` is
+    the trunk from this coupler to the next and ``through_output_dbm`` the
+    power arriving there.
+    """
+    power = input_power - feeder_km * attenuation
+    cascade = []
+    for tap in taps:
+        tap_km, throughput_km = tap['tap_km'], tap.get('throughput_km', 0.0)
+        for tap_percent in STANDARD_TAP_RATIOS:
+            tap_loss, through_loss = COUPLER_LOSSES[tap_percent]
+            tap_output = power - tap_loss - tap_km * attenuation
+            if tap_output >= target:
+                break
+        else:
+            return None
+
+        power = power - through_loss - throughput_km * attenuation
+        cascade.append({
+            'coupler_ratio': f"{tap_percent}/{100 - tap_percent}",
+            'tap_km': tap_km,
+            'tap_output_dbm': tap_output,
+            'throughput_km': throughput_km,
+            'through_output_dbm': power,
+        })
+    return cascade
+
+
+def best_margin_cascade(input_power, taps, min_receive, attenuation, feeder_km=0.0):
+    """
+    The cascade whose weakest tap has the largest margin over ``min_receive``.
+    Feasibility is monotone in the required level, so the optimum is found by
+    bisecting on the margin with ``plan_cascade`` as the oracle. Returns
+    ``(margin_db, cascade)``; the margin is negative when even the best
+    assignment leaves some tap below ``min_receive``.
+    """
+    def plan(margin):
+        return plan_cascade(input_power, taps, min_receive + margin, attenuation, feeder_km)
+
+    low, high = -100.0, input_power - min_receive + 1.0
+    best = plan(low)
+    if best is None:
+        return None, None
+    for _ in range(MARGIN_SEARCH_STEPS):
+        middle = (low + high) / 2
+        cascade = plan(middle)
+        if cascade is None:
+            high = middle
+        else:
+            low, best = middle, cascade
+    margin = min(stage['tap_output_dbm'] for stage in best) - min_receive
+    return margin, best
+
+
+def optimize_cascade(input_power, taps, min_receive, objective='margin', attenuation=None, feeder_km=0.0):
+    """
+    Search coupler ratios for a cascade of taps along one trunk.
+
+    ``objective='margin'`` serves every tap and maximizes the weakest margin.
+    ``objective='taps'`` serves as many taps as possible (in trunk order) at
+    or above ``min_receive``, then maximizes the margin among those.
+    Returns ``(served, margin_db, cascade)``.
+    """
+    if attenuation is None:
+        attenuation = settings.OPTICAL_FIBER_ATTENUATION_DB_PER_KM
+
+    served = len(taps)
+    if objective == 'taps':
+        low, high = 0, len(taps)
+        # The largest prefix that can be served; a served prefix stays servable when shortened.
+        while low < high:
+            middle = (low + high + 1) // 2
+            if plan_cascade(input_power, taps[:middle], min_receive, attenuation, feeder_km):
+                low = middle
+            else:
+                high = middle - 1
+        served = low
+        if served == 0:
+            return 0, None, []
+
+    margin, cascade = best_margin_cascade(input_power, taps[:served], min_receive, attenuation, feeder_km)
+    for stage in cascade or ():
+        stage['tap_output_dbm'] = round(stage['tap_output_dbm'], 2)
+        stage['through_output_dbm'] = round(stage['through_output_dbm'], 2)
+    return served, round(margin, 2) if margin is not None else None, cascade or []
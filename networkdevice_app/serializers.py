@@ -1,6 +1,10 @@
 from .models import *
 from rest_framework import serializers
 from .models import Design, CouplerCalculation
+from .calculator import OUTPUT_FIELDS, calculate_couplers, ratio_losses
+from opticalfiber_app.cache import TenantCache
+from .optimizer import MAX_CASCADE_TAPS
+from .evaluation import MAX_EVALUATION_DESIGNS, RANKINGS
 
 
 class NetworkDeviceSerializer(serializers.ModelSerializer):
@@ -11,13 +15,14 @@ class NetworkDeviceSerializer(serializers.ModelSerializer):
     class Meta:
         model = NetworkDevice
         fields = "__all__"
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at', 'ports_total', 'ports_used']
+        optional_fields = ['output_power']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Mark all non-readonly fields as required
         for field_name, field in self.fields.items():
-            if field_name not in self.Meta.read_only_fields:
+            if field_name not in self.Meta.read_only_fields and field_name not in self.Meta.optional_fields:
                 field.required = True
                 field.allow_null = False
                 if isinstance(field, serializers.CharField):
@@ -74,6 +79,7 @@ class DevicePortViewSerializers(serializers.ModelSerializer):
 
 
 from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 from .models import Design, CouplerCalculation
 
@@ -91,6 +97,34 @@ class CouplerCalculationSerializer(serializers.ModelSerializer):
             "throughput_km",
             "through_output_dbm",
         ]
+        # Outputs are derived from the design's input power and the cascade.
+        read_only_fields = ["tap_output_dbm", "through_output_dbm"]
+
+    def validate_coupler_ratio(self, value):
+        if ratio_losses(value) is None:
+            raise serializers.ValidationError("Enter a two-way coupler ratio such as '10/90' or '30:70'.")
+        return value
+
+
+class DesignListSerializer(serializers.ListSerializer):
+    """Imports many designs with one insert for the designs and one for all their couplers."""
+
+    @transaction.atomic
+    def create(self, validated_data):
+        company = self.context["company"]
+        designs = Design.objects.bulk_create([
+            Design(company=company, **{k: v for k, v in data.items() if k != "couplers"})
+            for data in validated_data
+        ])
+        couplers = []
+        for design, data in zip(designs, validated_data):
+            couplers.extend(self.child.build_couplers(design, data.get("couplers", [])))
+        CouplerCalculation.objects.bulk_create(couplers)
+        # bulk_create sends no signals.
+        TenantCache.invalidate([company.pk])
+        # One query for the response's couplers instead of one per design.
+        prefetch_related_objects(designs, "couplers")
+        return designs
 
 
 class DesignSerializer(serializers.ModelSerializer):
@@ -99,17 +133,24 @@ class DesignSerializer(serializers.ModelSerializer):
     class Meta:
         model = Design
         fields = ["id", "name", "input_power", "couplers"]
+        list_serializer_class = DesignListSerializer
+
+    @staticmethod
+    def build_couplers(design, couplers_data):
+        """Unsaved couplers of ``design`` in cascade order, with their outputs calculated."""
+        couplers = [
+            CouplerCalculation(design=design, **{k: v for k, v in data.items() if k != "id"})
+            for data in couplers_data
+        ]
+        return calculate_couplers(design.input_power, couplers)
 
+    @transaction.atomic
     def create(self, validated_data):
         couplers_data = validated_data.pop("couplers", [])
         company = self.context["company"]
 
         design = Design.objects.create(company=company, **validated_data)
-
-        for coupler_data in couplers_data:
-            CouplerCalculation.objects.create(
-                design=design, **coupler_data
-            )
+        CouplerCalculation.objects.bulk_create(self.build_couplers(design, couplers_data))
 
         return design
 
@@ -128,29 +169,69 @@ class DesignSerializer(serializers.ModelSerializer):
             for coupler in instance.couplers.all()
         }
 
-        sent_ids = []
-
+        # The whole chain is recalculated: any change upstream shifts every output below it.
+        chain = []
         for coupler_data in couplers_data:
-            coupler_id = coupler_data.get("id")
+            coupler = existing_couplers.pop(coupler_data.get("id"), None)
+            if coupler is None:
+                chain.extend(self.build_couplers(instance, [coupler_data]))
+                continue
+            for attr, value in coupler_data.items():
+                setattr(coupler, attr, value)
+            chain.append(coupler)
+        calculate_couplers(instance.input_power, chain)
+
+        if existing_couplers:
+            CouplerCalculation.objects.filter(pk__in=existing_couplers).delete()
+        CouplerCalculation.objects.bulk_update(
+            [coupler for coupler in chain if coupler.pk],
+            ["coupler_ratio", "tap_km", "throughput_km", "position"] + OUTPUT_FIELDS,
+        )
+        CouplerCalculation.objects.bulk_create([coupler for coupler in chain if not coupler.pk])
 
-            if coupler_id and coupler_id in existing_couplers:
-                coupler = existing_couplers[coupler_id]
-                for attr, value in coupler_data.items():
-                    setattr(coupler, attr, value)
-                coupler.save()
-                sent_ids.append(coupler_id)
-            else:
-                CouplerCalculation.objects.create(
-                    design=instance, **coupler_data
-                )
+        # Drop couplers prefetched by the view so the response shows the saved chain.
+        getattr(instance, "_prefetched_objects_cache", {}).pop("couplers", None)
+        return instance
 
-        instance.couplers.exclude(id__in=sent_ids).delete()
 
-        return instance
+class CascadeTapSerializer(serializers.Serializer):
+    tap_km = serializers.FloatField(min_value=0)
+    throughput_km = serializers.FloatField(min_value=0, required=False, default=0.0)
+
+
+class CouplerOptimizationSerializer(serializers.Serializer):
+    """Input of the coupler cascade optimizer."""
+
+    OBJECTIVE_CHOICES = ("margin", "taps")
 
-    
+    name = serializers.CharField(max_length=100, required=False)
+    input_power = serializers.FloatField()
+    min_receive_dbm = serializers.FloatField()
+    taps = CascadeTapSerializer(many=True)
+    objective = serializers.ChoiceField(choices=OBJECTIVE_CHOICES, default="margin")
+    feeder_km = serializers.FloatField(min_value=0, required=False, default=0.0)
 
+    def validate_taps(self, value):
+        if not value:
+            raise serializers.ValidationError("At least one tap is required.")
+        if len(value) > MAX_CASCADE_TAPS:
+            raise serializers.ValidationError(f"At most {MAX_CASCADE_TAPS} taps per cascade.")
+        return value
 
 
+class DesignEvaluationSerializer(serializers.Serializer):
+    """Candidates for a what-if comparison: saved design ids and/or unsaved design payloads."""
 
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    designs = DesignSerializer(many=True, required=False)
+    min_receive_dbm = serializers.FloatField(required=False)
+    rank_by = serializers.ChoiceField(choices=list(RANKINGS), default="margin")
 
+    def validate(self, attrs):
+        attrs["ids"] = list(dict.fromkeys(attrs["ids"]))
+        total = len(attrs["ids"]) + len(attrs.get("designs", []))
+        if not total:
+            raise serializers.ValidationError("Give at least one design id or design.")
+        if total > MAX_EVALUATION_DESIGNS:
+            raise serializers.ValidationError(f"At most {MAX_EVALUATION_DESIGNS} designs per evaluation.")
+        return attrs
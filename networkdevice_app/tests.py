@@ -1,3 +1,280 @@
-from django.test import TestCase
+import itertools
+import json
+import random
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from opticalfiber_app.models import Company, Staff
+from opticalfiber_app.utils import TokenService
+from .calculator import evaluate_chain, ratio_losses, recalculate_designs
+from .evaluation import evaluate_design, stream_evaluation
+from .models import CouplerCalculation, Design
+from .optimizer import COUPLER_LOSSES, STANDARD_TAP_RATIOS, optimize_cascade, plan_cascade
 
-# Create your tests here.
+# Keep tests off the real Redis, and hash staff passwords cheaply.
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+ATTENUATION = 0.35
+
+
+def make_client(name='Acme'):
+    company = Company.objects.create(
+        name=name, registration_number=f'REG-{name}', email='ops@example.com', phone='1', address='x',
+    )
+    staff = Staff.objects.create(company=company, name='Ops', email=f'ops-{name}@example.com',
+                                 password='secret', role='admin')
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=TokenService.encode(staff))
+    return company, client
+
+
+def tap_outputs(input_power, taps, tap_percents):
+    """Tap outputs of one ratio assignment, walked coupler by coupler."""
+    power, outputs = input_power, []
+    for tap, tap_percent in zip(taps, tap_percents):
+        tap_loss, through_loss = COUPLER_LOSSES[tap_percent]
+        outputs.append(power - tap_loss - tap['tap_km'] * ATTENUATION)
+        power -= through_loss + tap.get('throughput_km', 0.0) * ATTENUATION
+    return outputs
+
+
+def random_taps(rnd, count):
+    return [{'tap_km': rnd.uniform(0, 3), 'throughput_km': rnd.uniform(0, 2)} for _ in range(count)]
+
+
+class CascadeOptimizerTests(SimpleTestCase):
+
+    def test_margin_matches_exhaustive_search(self):
+        rnd = random.Random(13)
+        for _ in range(25):
+            taps = random_taps(rnd, 3)
+            input_power, min_receive = rnd.uniform(0, 10), rnd.uniform(-25, -10)
+            best = max(
+                min(tap_outputs(input_power, taps, assignment))
+                for assignment in itertools.product(STANDARD_TAP_RATIOS, repeat=len(taps))
+            ) - min_receive
+            served, margin, cascade = optimize_cascade(input_power, taps, min_receive, attenuation=ATTENUATION)
+            self.assertEqual((served, len(cascade)), (3, 3))
+            self.assertAlmostEqual(margin, best, delta=0.01)
+
+    def test_taps_objective_serves_longest_prefix(self):
+        rnd = random.Random(17)
+        for _ in range(25):
+            taps = random_taps(rnd, 4)
+            input_power, min_receive = rnd.uniform(0, 5), rnd.uniform(-20, -12)
+            expected = max(
+                count for count in range(len(taps) + 1)
+                if count == 0 or any(
+                    min(tap_outputs(input_power, taps[:count], assignment)) >= min_receive
+                    for assignment in itertools.product(STANDARD_TAP_RATIOS, repeat=count)
+                )
+            )
+            served, margin, cascade = optimize_cascade(input_power, taps, min_receive, objective='taps',
+                                                       attenuation=ATTENUATION)
+            self.assertEqual(served, expected)
+            self.assertEqual(len(cascade), served)
+            if served:
+                self.assertGreaterEqual(margin, -0.01)
+
+    def test_plan_rows_match_the_design_shape(self):
+        cascade = plan_cascade(5.0, [{'tap_km': 1.0, 'throughput_km': 2.0}], -20.0, ATTENUATION)
+        stage, = cascade
+        self.assertEqual(stage['coupler_ratio'], '1/99')
+        self.assertAlmostEqual(stage['through_output_dbm'], 5.0 - COUPLER_LOSSES[1][1] - 2.0 * ATTENUATION)
+        self.assertIsNone(plan_cascade(5.0, [{'tap_km': 1.0}], 10.0, ATTENUATION))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS,
+                   OPTICAL_FIBER_ATTENUATION_DB_PER_KM=ATTENUATION)
+class DesignOptimizeViewTests(TestCase):
+    url = '/api/network-device/designs/optimize/'
+
+    def setUp(self):
+        cache.clear()
+        self.company, self.api = make_client()
+
+    def test_optimize_and_save(self):
+        payload = {
+            'name': 'Trunk A', 'input_power': 6.0, 'min_receive_dbm': -18.0, 'feeder_km': 2.0,
+            'taps': [{'tap_km': 0.5, 'throughput_km': 1.0}, {'tap_km': 1.0, 'throughput_km': 1.0}, {'tap_km': 0.2}],
+        }
+        response = self.api.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['taps_served'], 3)
+        self.assertGreaterEqual(response.data['min_margin_db'], 0)
+        design = Design.objects.get(company=self.company, name='Trunk A')
+        self.assertAlmostEqual(design.input_power, round(6.0 - 2.0 * settings.OPTICAL_FIBER_ATTENUATION_DB_PER_KM, 2))
+        self.assertEqual([coupler.coupler_ratio for coupler in design.couplers.order_by('position')],
+                         [coupler['coupler_ratio'] for coupler in response.data['couplers']])
+
+    def test_validation(self):
+        for payload in ({'input_power': 5, 'min_receive_dbm': -20, 'taps': []},
+                        {'input_power': 5, 'min_receive_dbm': -20, 'taps': [{'tap_km': 1}], 'objective': 'cost'},
+                        {'input_power': 5, 'taps': [{'tap_km': 1}]}):
+            self.assertEqual(self.api.post(self.url, payload, format='json').status_code, 400)
+
+
+def design_payload(name, input_power=5.0, ratios=('10/90', '20/80', '50/50')):
+    return {'name': name, 'input_power': input_power, 'couplers': [
+        {'coupler_ratio': ratio, 'tap_km': 0.5 + position, 'throughput_km': 1.0}
+        for position, ratio in enumerate(ratios)
+    ]}
+
+
+class CouplerCalculatorTests(SimpleTestCase):
+
+    def test_ratio_losses(self):
+        self.assertEqual(ratio_losses('10/90'), ratio_losses('10:90'))
+        tap_loss, through_loss = ratio_losses('10/90')
+        self.assertGreater(tap_loss, through_loss)
+        self.assertIsNone(ratio_losses('1:2:3'))
+        self.assertIsNone(ratio_losses('ten/ninety'))
+        self.assertIsNone(ratio_losses(''))
+
+    def test_chain_matches_coupler_by_coupler(self):
+        rnd = random.Random(14)
+        ratios = [f"{tap}/{100 - tap}" for tap in rnd.choices(STANDARD_TAP_RATIOS, k=30)]
+        tap_km = [rnd.uniform(0, 3) for _ in ratios]
+        throughput_km = [rnd.uniform(0, 2) for _ in ratios]
+        tap_output, through_output = evaluate_chain(4.0, ratios, tap_km, throughput_km, attenuation=ATTENUATION)
+
+        power = 4.0
+        for position, ratio in enumerate(ratios):
+            tap_loss, through_loss = ratio_losses(ratio)
+            self.assertAlmostEqual(tap_output[position], power - tap_loss - tap_km[position] * ATTENUATION, delta=0.005)
+            power -= through_loss + throughput_km[position] * ATTENUATION
+            self.assertAlmostEqual(through_output[position], power, delta=0.005)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class DesignCalculationTests(TestCase):
+    url = '/api/network-device/designs/'
+
+    def setUp(self):
+        cache.clear()
+        self.company, self.api = make_client()
+
+    def stored_outputs(self, design_id):
+        return list(CouplerCalculation.objects.filter(design_id=design_id).order_by('position')
+                    .values_list('coupler_ratio', 'tap_output_dbm', 'through_output_dbm'))
+
+    def expected_outputs(self, input_power, couplers):
+        ratios = [coupler['coupler_ratio'] for coupler in couplers]
+        tap_output, through_output = evaluate_chain(
+            input_power, ratios, [coupler['tap_km'] for coupler in couplers],
+            [coupler['throughput_km'] for coupler in couplers],
+        )
+        return list(zip(ratios, tap_output.tolist(), through_output.tolist()))
+
+    def test_outputs_are_computed_not_taken_from_the_client(self):
+        payload = design_payload('A')
+        for coupler in payload['couplers']:
+            coupler.update(tap_output_dbm=99, through_output_dbm=99)
+        response = self.api.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stored_outputs(response.data['id']), self.expected_outputs(5.0, payload['couplers']))
+
+        bad = design_payload('B', ratios=('10/90', 'tap'))
+        self.assertEqual(self.api.post(self.url, bad, format='json').status_code, 400)
+
+    def test_import_runs_a_fixed_number_of_queries(self):
+        def import_designs(count):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.api.post(self.url, [design_payload(f'D{count}-{n}') for n in range(count)],
+                                         format='json')
+            self.assertEqual(response.status_code, 201)
+            return len(queries)
+
+        self.assertEqual(import_designs(2), import_designs(20))
+        self.assertEqual(CouplerCalculation.objects.filter(design__company=self.company).count(), 66)
+
+    def test_update_recalculates_the_whole_chain(self):
+        design_id = self.api.post(self.url, design_payload('A'), format='json').data['id']
+        couplers = self.api.get(f'{self.url}{design_id}/').data['couplers']
+        # Swap the first ratio, drop the last coupler and append a new one.
+        couplers[0]['coupler_ratio'] = '30/70'
+        couplers = couplers[:2] + [{'coupler_ratio': '5/95', 'tap_km': 0.1, 'throughput_km': 0.0}]
+        response = self.api.put(f'{self.url}{design_id}/', {'name': 'A', 'input_power': 6.0, 'couplers': couplers},
+                                format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stored_outputs(design_id), self.expected_outputs(6.0, couplers))
+
+    def test_recalculate_designs_repairs_stored_outputs(self):
+        payload = design_payload('A')
+        design_id = self.api.post(self.url, payload, format='json').data['id']
+        CouplerCalculation.objects.filter(design_id=design_id).update(tap_output_dbm=0, through_output_dbm=0)
+        self.assertEqual(recalculate_designs(Design.objects.filter(pk=design_id)), 3)
+        self.assertEqual(self.stored_outputs(design_id), self.expected_outputs(5.0, payload['couplers']))
+
+
+class DesignEvaluationTests(SimpleTestCase):
+
+    def test_weakest_tap_and_fiber(self):
+        couplers = [('10/90', 1.0, 2.0), ('50/50', 0.5, 0.0)]
+        result = evaluate_design(5.0, couplers, -10.0, attenuation=ATTENUATION)
+        tap_output, through_output = evaluate_chain(5.0, ['10/90', '50/50'], [1.0, 0.5], [2.0, 0.0],
+                                                    attenuation=ATTENUATION)
+        self.assertEqual(result['tap_output_dbm'], tap_output.tolist())
+        self.assertEqual(result['weakest_tap'], int(tap_output.argmin()))
+        self.assertEqual(result['min_margin_db'], round(float(tap_output.min()) + 10.0, 2))
+        self.assertEqual(result['end_output_dbm'], float(through_output[-1]))
+        self.assertEqual((result['taps'], result['taps_passing'], result['fiber_km']), (2, 2, 3.5))
+
+        empty = evaluate_design(5.0, [], -10.0)
+        self.assertEqual((empty['taps'], empty['min_margin_db'], empty['end_output_dbm']), (0, None, 5.0))
+
+    def test_ranking(self):
+        batch = [
+            (1, None, 'weak', 5.0, [('1/99', 20.0, 0.0)]),
+            (2, None, 'strong', 5.0, [('50/50', 0.1, 0.0)]),
+            (None, 0, 'two taps', 5.0, [('50/50', 0.1, 1.0), ('50/50', 30.0, 0.0)]),
+        ]
+
+        def ranking(rank_by):
+            *rows, last = [json.loads(line) for chunk in stream_evaluation([batch], -15.0, rank_by)
+                           for line in chunk.splitlines()]
+            self.assertEqual([row['name'] for row in rows], ['weak', 'strong', 'two taps'])
+            self.assertEqual(last['type'], 'ranking')
+            self.assertEqual([row['rank'] for row in last['designs']], [1, 2, 3])
+            return [row['name'] for row in last['designs']]
+
+        self.assertEqual(ranking('margin'), ['strong', 'two taps', 'weak'])
+        self.assertEqual(ranking('taps'), ['two taps', 'strong', 'weak'])
+        self.assertEqual(ranking('fiber')[0], 'strong')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class DesignEvaluateViewTests(TestCase):
+    url = '/api/network-device/designs/evaluate/'
+
+    def setUp(self):
+        cache.clear()
+        self.company, self.api = make_client()
+
+    def evaluate(self, payload):
+        response = self.api.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_saved_and_inline_designs(self):
+        saved = [self.api.post('/api/network-device/designs/', design_payload(f'S{n}', input_power=n), format='json')
+                 .data['id'] for n in range(3)]
+        rows = self.evaluate({'ids': saved + saved[:1], 'designs': [design_payload('inline', input_power=9.0)],
+                              'rank_by': 'margin'})
+        *designs, ranking = rows
+        self.assertEqual([(row['id'], row['inline']) for row in designs],
+                         [(pk, None) for pk in saved] + [(None, 0)])
+        self.assertEqual([row['name'] for row in ranking['designs']], ['inline', 'S2', 'S1', 'S0'])
+
+    def test_unknown_ids_and_empty_requests(self):
+        _, other = make_client('Other')
+        foreign = other.post('/api/network-device/designs/', design_payload('theirs'), format='json').data['id']
+        response = self.api.post(self.url, {'ids': [foreign]}, format='json')
+        self.assertEqual((response.status_code, response.data['ids']), (404, [foreign]))
+        self.assertEqual(self.api.post(self.url, {}, format='json').status_code, 400)
+        self.assertEqual(self.api.post(self.url, {'ids': [1], 'rank_by': 'cost'}, format='json').status_code, 400)
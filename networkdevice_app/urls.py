@@ -16,6 +16,8 @@ urlpatterns = [
 
 
     path("designs/", DesignListCreateAPIView.as_view(), name="design-list-create"),
+    path("designs/evaluate/", DesignEvaluateAPIView.as_view(), name="design-evaluate"),
+    path("designs/optimize/", DesignOptimizeAPIView.as_view(), name="design-optimize"),
     path("designs/<int:pk>/", DesignRetrieveUpdateDestroyAPIView.as_view(), name="design-detail"),
 
 
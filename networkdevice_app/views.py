@@ -3,13 +3,18 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from .models import NetworkDevice, DevicePort, Design, CouplerCalculation
-from .serializers import NetworkDeviceSerializer, DevicePortSerializer, DevicePortViewSerializers, DesignSerializer, CouplerCalculationSerializer
+from .serializers import NetworkDeviceSerializer, DevicePortSerializer, DevicePortViewSerializers, DesignSerializer, CouplerCalculationSerializer, CouplerOptimizationSerializer, DesignEvaluationSerializer
+from .optimizer import optimize_cascade
+from .evaluation import saved_designs, inline_designs, stream_evaluation
+from opticalfiber_app.cache import TenantCache
 from opticalfiber_app.views import BaseAPIView
-from opticalfiber_app.models import Staff
 from office.models import Office
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import ValidationError
 from django.db import DatabaseError
+from django.http import StreamingHttpResponse
+from itertools import chain
 from rest_framework.pagination import PageNumberPagination
 
 class CustomPagination(PageNumberPagination):
@@ -21,35 +26,25 @@ class NetworkDeviceListCreateAPIView(BaseAPIView):
     Includes authentication, error handling, and related field optimization.
     """
 
-    def get_authenticated_user(self, request):
-        try:
-            auth_user = self.authentication(request) 
-            user_id = auth_user.get('id')
-            if not user_id:
-                return None, "Unauthorized access"
-
-            staff_member = Staff.objects.select_related('company').get(pk=user_id)
-            return staff_member, None
-
-        except Staff.DoesNotExist:
-            return None, "Staff member not found in the database."
-        except Exception as e:
-            return None, f"An error occurred while fetching staff details: {str(e)}"
-
     def get(self, request, *args, **kwargs):
         auth_user, error = self.get_authenticated_user(request)
         if error:
             return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            devices = NetworkDevice.objects.select_related('staff', 'office')\
-                                        .filter(office__company=auth_user.company)\
-                                        .order_by('id')
+            def build():
+                devices = NetworkDevice.objects.select_related('staff', 'office')\
+                                            .filter(office__company_id=auth_user.company_id)\
+                                            .order_by('id')
+
+                paginator = CustomPagination()
+                paginated_devices = paginator.paginate_queryset(devices, request)
+                serializer = NetworkDeviceSerializer(paginated_devices, many=True)
+                return paginator.get_paginated_response(serializer.data).data
 
-            paginator = CustomPagination()
-            paginated_devices = paginator.paginate_queryset(devices, request)
-            serializer = NetworkDeviceSerializer(paginated_devices, many=True)
-            return paginator.get_paginated_response(serializer.data)
+            # The page links are absolute, so the full URL is part of the key.
+            data = TenantCache.get_or_build(auth_user.company_id, 'devices', build, request.build_absolute_uri())
+            return Response(data)
 
         except Exception as e:
             import traceback
@@ -145,10 +140,14 @@ class DevicePortListCreateAPIView(NetworkDeviceListCreateAPIView):
             return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
 
         try:
-            device = get_object_or_404(NetworkDevice, pk=device_id)
-            ports = DevicePort.objects.filter(device=device.pk)
-            serializer = DevicePortSerializer(ports, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            device = get_object_or_404(NetworkDevice, pk=device_id, office__company_id=user.company_id)
+
+            def build():
+                ports = DevicePort.objects.filter(device=device.pk)
+                return list(DevicePortSerializer(ports, many=True).data)
+
+            data = TenantCache.get_or_build(user.company_id, 'ports', build, device.pk)
+            return Response(data, status=status.HTTP_200_OK)
         except Office.DoesNotExist:
             return Response({"error": "Office not found."}, status=status.HTTP_404_NOT_FOUND)
         except DatabaseError:
@@ -235,7 +234,10 @@ class DesignListCreateAPIView(NetworkDeviceListCreateAPIView):
         if error:
             return Response({"error": error}, status=401)
 
-        serializer = DesignSerializer(data=request.data, context={"company": staff.company})
+        # A list of designs is imported in bulk.
+        serializer = DesignSerializer(
+            data=request.data, many=isinstance(request.data, list), context={"company": staff.company}
+        )
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=201)
@@ -246,9 +248,12 @@ class DesignListCreateAPIView(NetworkDeviceListCreateAPIView):
         if error:
             return Response({"error": error}, status=401)
 
-        designs = Design.objects.filter(company=staff.company)
-        serializer = DesignSerializer(designs, many=True)
-        return Response(serializer.data, status=200)
+        def build():
+            designs = Design.objects.filter(company_id=staff.company_id).prefetch_related("couplers")
+            return list(DesignSerializer(designs, many=True).data)
+
+        data = TenantCache.get_or_build(staff.company_id, "designs", build)
+        return Response(data, status=200)
     
 
 
@@ -258,18 +263,6 @@ class DesignRetrieveUpdateDestroyAPIView(NetworkDeviceListCreateAPIView):
     for the logged-in user's company.
     """
 
-    def get_authenticated_user(self, request):
-        auth_user = self.authentication(request)
-        user_id = auth_user.get("id")
-        if not user_id:
-            return None, "Unauthorized access"
-
-        try:
-            staff = Staff.objects.select_related("company").get(pk=user_id)
-            return staff, None
-        except Staff.DoesNotExist:
-            return None, "Staff not found"
-
     def get_object(self, pk, company):
         try:
             return Design.objects.prefetch_related("couplers").get(
@@ -337,4 +330,84 @@ class DesignRetrieveUpdateDestroyAPIView(NetworkDeviceListCreateAPIView):
             {"message": "Design deleted successfully"},
             status=status.HTTP_204_NO_CONTENT
         )
-    
+
+
+
+class DesignOptimizeAPIView(NetworkDeviceListCreateAPIView):
+    """
+    Pick coupler ratios for a cascade of taps along one trunk. Returns the
+    cascade in the shape of a Design's couplers; when a ``name`` is given the
+    result is also saved as a Design.
+    """
+
+    def post(self, request):
+        staff, error = self.get_authenticated_user(request)
+        if error:
+            return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+
+        serializer = CouplerOptimizationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        served, margin, cascade = optimize_cascade(
+            data["input_power"],
+            data["taps"],
+            data["min_receive_dbm"],
+            objective=data["objective"],
+            feeder_km=data["feeder_km"],
+        )
+        result = {
+            "objective": data["objective"],
+            "input_power": data["input_power"],
+            "min_receive_dbm": data["min_receive_dbm"],
+            "taps_requested": len(data["taps"]),
+            "taps_served": served,
+            "min_margin_db": margin,
+            "couplers": cascade,
+        }
+
+        if data.get("name") and cascade:
+            # The saved design starts at the first coupler, after the feeder.
+            input_power = data["input_power"] - data["feeder_km"] * settings.OPTICAL_FIBER_ATTENUATION_DB_PER_KM
+            design = DesignSerializer(
+                data={"name": data["name"], "input_power": round(input_power, 2), "couplers": cascade},
+                context={"company": staff.company},
+            )
+            if not design.is_valid():
+                return Response(design.errors, status=status.HTTP_400_BAD_REQUEST)
+            design.save()
+            result["design"] = design.data
+            return Response(result, status=status.HTTP_201_CREATED)
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class DesignEvaluateAPIView(NetworkDeviceListCreateAPIView):
+    """
+    What-if comparison of many designs in one request. Takes saved design
+    ``ids`` and/or unsaved ``designs`` payloads and streams NDJSON: one row per
+    design with its tap outputs, weakest-tap margin and fiber used as soon as
+    it is evaluated, then a ranked comparison table as the last line.
+    """
+
+    def post(self, request):
+        staff, error = self.get_authenticated_user(request)
+        if error:
+            return Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+
+        serializer = DesignEvaluationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        ids = data["ids"]
+        found = set(Design.objects.filter(company=staff.company, pk__in=ids).values_list("pk", flat=True))
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            return Response({"error": "Design not found", "ids": missing}, status=status.HTTP_404_NOT_FOUND)
+
+        candidates = chain(saved_designs(staff.company, ids), inline_designs(data.get("designs", [])))
+        return StreamingHttpResponse(
+            stream_evaluation(candidates, data.get("min_receive_dbm"), data["rank_by"]),
+            content_type="application/x-ndjson",
+        )
@@ -3,10 +3,9 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
+from opticalfiber_app.cache import TenantCache
 from opticalfiber_app.views import BaseAPIView
 from .serializers import *
-from opticalfiber_app.models import Company
-from opticalfiber_app.models import Staff
 from .models import Office
 from django.http import Http404
 import logging
@@ -22,8 +21,8 @@ class OfficeView(BaseAPIView):
 
     def _get_authenticated_user_and_company(self, request):
         auth_user = self.authentication(request)
-        if not auth_user:
-            return None, None, Response({"error": "Authentication failed"}, status=status.HTTP_401_UNAUTHORIZED)
+        if isinstance(auth_user, Response):
+            return None, None, auth_user
 
         company_id = auth_user.get("company")
         if not company_id:
@@ -37,12 +36,12 @@ class OfficeView(BaseAPIView):
             if error:
                 return error
 
-            company = get_object_or_404(Company, id=company_id)
-            created_by = get_object_or_404(Staff, id=auth_user.get("id"))
+            # The staff member and company come loaded from the principal cache.
+            created_by = request.user
 
             serializer = OfficeSerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
-            serializer.save(company=company, created_by=created_by)
+            serializer.save(company=created_by.company, created_by=created_by)
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -59,9 +58,12 @@ class OfficeView(BaseAPIView):
             if error:
                 return error
 
-            offices = Office.objects.filter(company__id=company_id)
-            serializer = OfficeSerializer(offices, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            def build():
+                offices = Office.objects.filter(company__id=company_id)
+                return list(OfficeSerializer(offices, many=True).data)
+
+            data = TenantCache.get_or_build(company_id, 'offices', build)
+            return Response(data, status=status.HTTP_200_OK)
 
         except Exception as e:
             return Response({"error": "An unexpected error occurred", "details": str(e)},
@@ -73,8 +75,8 @@ class OfficeManagementView(BaseAPIView):
 
     def _get_authenticated_user_and_company(self, request):
         auth_user = self.authentication(request)
-        if not auth_user:
-            return None, None, Response({"error": "Authentication failed"}, status=status.HTTP_401_UNAUTHORIZED)
+        if isinstance(auth_user, Response):
+            return None, None, auth_user
 
         company_id = auth_user.get('company')
         if not company_id:
@@ -148,8 +150,8 @@ class BranchView(BaseAPIView):
     def _get_authenticated_user(self, request):
         """Encapsulated logic to authenticate the user."""
         auth_user = self.authentication(request)
-        if not auth_user:
-            return None, self.error_response("Authentication failed", status.HTTP_401_UNAUTHORIZED)
+        if isinstance(auth_user, Response):
+            return None, auth_user
         return auth_user, None
 
     def _get_company_id(self, auth_user):
@@ -165,7 +167,7 @@ class BranchView(BaseAPIView):
             if error:
                 return error
 
-            created_by = get_object_or_404(Staff, pk=auth_user.get('id'))
+            created_by = request.user
             serializer = BranchSerializer(data=request.data)
             if serializer.is_valid(raise_exception=True) :
                 serializer.save(created_by=created_by)
@@ -189,12 +191,15 @@ class BranchView(BaseAPIView):
             if error:
                 return error
 
-            branches = Branch.objects.select_related('office').filter(office__company__id=company_id)
-            if not branches.exists():
+            def build():
+                branches = Branch.objects.filter(office__company__id=company_id)
+                return list(BranchSerializer(branches, many=True).data)
+
+            data = TenantCache.get_or_build(company_id, 'branches', build)
+            if not data:
                 return self.error_response("No branches found for this company", status.HTTP_404_NOT_FOUND)
 
-            serializer = BranchSerializer(branches, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(data, status=status.HTTP_200_OK)
 
         except Exception as e:
             return self.error_response("Unexpected error", status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -208,8 +213,8 @@ class BranchView(BaseAPIView):
 class BranchManagementView(BaseAPIView):
     def get_authenticated_user_and_branch(self, request, branch_id):
         auth_user = self.authentication(request)
-        if not auth_user:
-            return None, self.error_response("Authentication failed", status.HTTP_401_UNAUTHORIZED)
+        if isinstance(auth_user, Response):
+            return None, auth_user
 
         company_id = auth_user.get('company')
         if not company_id:
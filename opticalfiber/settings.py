@@ -11,7 +11,6 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-from datetime import timedelta
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -102,18 +101,6 @@ TEMPLATES = [
 ]
 
 
-REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
-}
-
-SIMPLE_JWT = {
-    'ACCESS_TOKEN_LIFETIME': timedelta(days=365),
-    'REFRESH_TOKEN_LIFETIME': timedelta(days=366),
-    'ROTATE_REFRESH_TOKENS': True,
-    'BLACKLIST_AFTER_ROTATION': True,
-}
 # JWT configuration
 JWT_EXPIRATION_MINUTES = 60 * 24 * 7  # 1 week = 7 days = 10,080 minutes
 
@@ -254,6 +241,9 @@ CHANNEL_LAYERS = {
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/0'
 
 REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'opticalfiber_app.authentication.StaffJWTAuthentication',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 50,
 }
@@ -272,3 +262,19 @@ CASHFREE_RETURN_URL = "https://backend.fiberonix.in/api/payment/callback/"
 
 
 
+
+
+# Optical power budget defaults, used where a device or route carries no figure of its own.
+OPTICAL_OLT_OUTPUT_POWER_DBM = 3.0
+OPTICAL_FIBER_ATTENUATION_DB_PER_KM = 0.35
+OPTICAL_CONNECTION_LOSS_DB = 0.5  # connectors and splices per route
+OPTICAL_SPLITTER_EXCESS_LOSS_DB = 0.5
+OPTICAL_RX_SENSITIVITY_DBM = -28.0
+
+# Route planner: cost of a metre of new trench relative to a metre of existing fiber.
+ROUTE_PLANNER_TRENCH_COST_FACTOR = 10.0
+
+# Password hashing runs on a bounded thread pool so a login burst cannot tie up every worker.
+PASSWORD_HASHING_WORKERS = os.cpu_count() or 1
+# Hashes allowed to wait for a free thread before new ones are turned away with 503.
+PASSWORD_HASHING_QUEUE_LIMIT = 32
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+import jwt
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication
+from .models import Company, Staff
+from .revocation import token_revocations
+from .utils import TokenService
+
+logger = logging.getLogger(__name__)
+
+PRINCIPAL_KEY = "auth_principal_{staff_id}"
+PRINCIPAL_TIMEOUT = 60 * 15
+# Entries in a process's own LRU are trusted this long before Redis is asked again;
+# it bounds how long another process may keep serving a deactivated account.
+PRINCIPAL_LOCAL_TTL = 5
+PRINCIPAL_LOCAL_SIZE = 4096
+
+
+def _attnames(model):
+    # The password hash is never cached; it is loaded on demand as a deferred field.
+    return [field.attname for field in model._meta.concrete_fields if field.attname != 'password']
+
+
+class PrincipalCache:
+    """
+    The authenticated staff member and their company, resolved without a
+    database query on a hit. Rows live in a small per-process LRU in front of
+    the shared cache (Redis); saving or deleting a Staff or Company drops the
+    affected rows from both. Every ``get`` builds fresh model instances, so a
+    view that modifies its ``request.user`` never touches the cached row.
+    """
+
+    def __init__(self, size=PRINCIPAL_LOCAL_SIZE, ttl=PRINCIPAL_LOCAL_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, staff_id):
+        staff_fields, company_fields = _attnames(Staff), _attnames(Company)
+        return (
+            Staff.objects.filter(pk=staff_id)
+            .values_list(*staff_fields, *(f"company__{name}" for name in company_fields))
+            .first()
+        )
+
+    def _row(self, staff_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(staff_id)
+            if entry is not None and entry[0] > now:
+                self._local.move_to_end(staff_id)
+                return entry[1]
+
+        key = PRINCIPAL_KEY.format(staff_id=staff_id)
+        row = cache.get(key)
+        if row is None:
+            row = self._load(staff_id)
+            if row is None:
+                return None
+            cache.set(key, row, timeout=PRINCIPAL_TIMEOUT)
+
+        with self._lock:
+            self._local[staff_id] = (now + self.ttl, row)
+            self._local.move_to_end(staff_id)
+            while len(self._local) > self.size:
+                self._local.popitem(last=False)
+        return row
+
+    def get(self, staff_id):
+        """A Staff instance with its company loaded, or None when there is no such staff member."""
+        row = self._row(staff_id)
+        if row is None:
+            return None
+        staff_fields, company_fields = _attnames(Staff), _attnames(Company)
+        staff = Staff.from_db(DEFAULT_DB_ALIAS, staff_fields, row[:len(staff_fields)])
+        staff.company = Company.from_db(DEFAULT_DB_ALIAS, company_fields, row[len(staff_fields):])
+        return staff
+
+    def invalidate(self, staff_ids):
+        staff_ids = list(staff_ids)
+        with self._lock:
+            for staff_id in staff_ids:
+                self._local.pop(staff_id, None)
+        cache.delete_many([PRINCIPAL_KEY.format(staff_id=staff_id) for staff_id in staff_ids])
+
+    def invalidate_company(self, company_id):
+        self.invalidate(Staff.objects.filter(company_id=company_id).values_list('pk', flat=True))
+
+
+principals = PrincipalCache()
+
+
+class StaffJWTAuthentication(BaseAuthentication):
+    """
+    Authenticates the login JWT sent as the raw ``Authorization`` header.
+    ``request.user`` is the Staff member (company loaded) from the principal
+    cache and ``request.auth`` the decoded token. Requests without the header
+    stay anonymous so public views keep working.
+    """
+
+    def authenticate(self, request):
+        token = request.headers.get('Authorization')
+        if not token:
+            return None
+        try:
+            decoded_token = TokenService.decode(token)
+        except jwt.ExpiredSignatureError:
+            raise exceptions.AuthenticationFailed("Token has expired.")
+        except jwt.InvalidTokenError:
+            raise exceptions.AuthenticationFailed("Invalid token.")
+        if 'id' not in decoded_token:
+            raise exceptions.AuthenticationFailed("Token has no id")
+        if token_revocations.is_revoked(decoded_token):
+            raise exceptions.AuthenticationFailed("Token has been revoked.")
+
+        staff = principals.get(decoded_token['id'])
+        if staff is None:
+            raise exceptions.AuthenticationFailed("Staff member not found.")
+        if not staff.is_active:
+            raise exceptions.AuthenticationFailed("Staff account is inactive.")
+        return staff, decoded_token
+
+    def authenticate_header(self, request):
+        # Makes DRF answer authentication failures with 401 rather than 403.
+        return 'Bearer'
@@ -0,0 +1,77 @@
+import hashlib
+import uuid
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+
+# Every row a company's list endpoints render, and the lookup from the row to its company.
+TENANT_MODELS = {
+    'office.Office': 'company_id',
+    'office.Branch': 'office__company_id',
+    'route_app.FiberRoute': 'office__company_id',
+    'junction_app.JunctionBox': 'office__company_id',
+    'junction_app.JunctionBoxDevice': 'junction_box__office__company_id',
+    'networkdevice_app.NetworkDevice': 'office__company_id',
+    'networkdevice_app.DevicePort': 'device__office__company_id',
+    'networkdevice_app.Design': 'company_id',
+    'networkdevice_app.CouplerCalculation': 'design__company_id',
+    'customer_app.Customer': 'office__company_id',
+}
+
+
+def tenant_models():
+    return {apps.get_model(label): lookup for label, lookup in TENANT_MODELS.items()}
+
+
+class TenantCache:
+    """
+    Rendered list responses in the shared Redis cache, keyed per company.
+    Keys carry the company's generation, bumped after every committed change
+    to one of its TENANT_MODELS rows, so a write retires all of the
+    company's cached lists at once and stale entries simply expire.
+    """
+
+    KEY = "tenant_list_{company_id}_{generation}_{name}_{parts}"
+    GENERATION_KEY = "tenant_generation_{company_id}"
+    TIMEOUT = 60 * 60
+
+    @classmethod
+    def generation(cls, company_id):
+        # A random token rather than a counter, so an evicted generation never reissues an old value.
+        return cache.get_or_set(cls.GENERATION_KEY.format(company_id=company_id), uuid.uuid4().hex, timeout=None)
+
+    @classmethod
+    def get_or_build(cls, company_id, name, build, *parts):
+        """
+        The cached value of list ``name`` for ``parts`` (office id, page,
+        query options...), or ``build()`` stored for next time. The
+        generation is read before building, so a list built while a change
+        commits is stored under the retired generation and never served.
+        """
+        digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+        key = cls.KEY.format(company_id=company_id, generation=cls.generation(company_id), name=name, parts=digest)
+        value = cache.get(key)
+        if value is None:
+            value = build()
+            cache.set(key, value, timeout=cls.TIMEOUT)
+        return value
+
+    @classmethod
+    def bump(cls, company_id):
+        cache.set(cls.GENERATION_KEY.format(company_id=company_id), uuid.uuid4().hex, timeout=None)
+
+    @classmethod
+    def invalidate(cls, company_ids):
+        """
+        Retire the cached lists of ``company_ids`` once the current
+        transaction commits. Signals do this for saves and deletes; call it
+        after bulk writes, which send none.
+        """
+        company_ids = {company_id for company_id in company_ids if company_id is not None}
+
+        def bump_all():
+            for company_id in company_ids:
+                cls.bump(company_id)
+
+        if company_ids:
+            transaction.on_commit(bump_all)
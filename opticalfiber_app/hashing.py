@@ -0,0 +1,82 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class HashingBusy(Exception):
+    """Every hashing thread is busy and the queue is full."""
+
+
+class HashingPool:
+    """
+    Runs password hashing on a small thread pool. The PBKDF2 work happens in
+    OpenSSL with the GIL released, so the threads use separate cores while the
+    ASGI event loop keeps serving other requests. At most ``workers +
+    queue_limit`` jobs are accepted at once; beyond that ``submit`` raises
+    HashingBusy instead of letting a burst queue up without bound.
+    """
+
+    def __init__(self, workers, queue_limit):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so a pre-forking server starts the threads in each child.
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="password-hashing")
+        return self._executor
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy("Too many password checks in progress.")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def arun(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+
+hashing_pool = HashingPool(settings.PASSWORD_HASHING_WORKERS, settings.PASSWORD_HASHING_QUEUE_LIMIT)
+
+
+def check_password_hash(raw_password, encoded):
+    """
+    ``(valid, new_encoded)``. When the password is right but was hashed with
+    an older hasher or iteration count, ``new_encoded`` is a fresh hash made
+    with the current settings, otherwise None.
+    """
+    rehashed = []
+
+    def setter(raw):
+        rehashed.append(hashers.make_password(raw))
+
+    valid = hashers.check_password(raw_password, encoded, setter=setter)
+    return valid, (rehashed[0] if rehashed else None)
+
+
+def is_password_hashed(value):
+    """Whether ``value`` is already encoded by one of the configured hashers."""
+    try:
+        hashers.identify_hasher(value)
+    except ValueError:
+        return False
+    return True
+
+
+async def ahash_password(raw_password):
+    return await hashing_pool.arun(hashers.make_password, raw_password)
+
+
+async def averify_password(raw_password, encoded):
+    return await hashing_pool.arun(check_password_hash, raw_password, encoded)
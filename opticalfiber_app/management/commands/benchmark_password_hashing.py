@@ -0,0 +1,44 @@
+import os
+import time
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.core.management.base import BaseCommand
+from opticalfiber_app.hashing import HashingPool, check_password_hash
+
+
+class Command(BaseCommand):
+    help = ("Measure login password checks per second with the configured hasher, on one thread "
+            "and on the hashing pool, to size PASSWORD_HASHING_WORKERS.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5.0, help="Duration of each run.")
+        parser.add_argument('--workers', type=int, default=settings.PASSWORD_HASHING_WORKERS,
+                            help="Pool threads for the concurrent run.")
+
+    def run(self, seconds, check):
+        """Password checks completed per second by ``check`` over ``seconds``."""
+        started = time.perf_counter()
+        done = 0
+        while time.perf_counter() - started < seconds:
+            done += check()
+        return done / (time.perf_counter() - started)
+
+    def handle(self, *args, **options):
+        seconds, workers = options['seconds'], options['workers']
+        encoded = make_password("benchmark-password")
+        hasher = get_hasher()
+        self.stdout.write(f"Hasher: {hasher.algorithm} ({getattr(hasher, 'iterations', 'n/a')} iterations)")
+
+        single = self.run(seconds, lambda: int(check_password_hash("benchmark-password", encoded)[0]))
+        self.stdout.write(f"1 thread: {single:.1f} logins/s")
+
+        # Keep every thread busy: submit a round of checks per worker and wait for all of them.
+        pool = HashingPool(workers, workers)
+        pooled = self.run(seconds, lambda: sum(
+            future.result()[0] for future in [pool.submit(check_password_hash, "benchmark-password", encoded) for _ in range(workers)]
+        ))
+        cores = min(workers, os.cpu_count() or 1)
+        self.stdout.write(f"{workers} threads: {pooled:.1f} logins/s")
+        self.stdout.write(self.style.SUCCESS(
+            f"{pooled / cores:.1f} logins/s per core ({cores} cores used, {pooled / single:.2f}x one thread)."
+        ))
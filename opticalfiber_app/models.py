@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.hashers import make_password, check_password
+from .hashing import is_password_hashed
 from django.utils import timezone
 from datetime import timedelta
 
@@ -37,13 +38,18 @@ class Staff(models.Model):
 
     def save(self, *args, **kwargs):
         # Check if password is already hashed (optional safety)
-        if not self.password.startswith('pbkdf2_'):  
+        if not is_password_hashed(self.password):
             self.password = make_password(self.password)
         super(Staff, self).save(*args, **kwargs)
 
     def check_password(self, raw_password):
         return check_password(raw_password, self.password)
 
+    @property
+    def is_authenticated(self):
+        # Staff is DRF's request.user once StaffJWTAuthentication accepts a token.
+        return True
+
     def __str__(self):
         return f"{self.name} ({self.role})"
     
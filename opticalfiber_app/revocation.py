@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+REVOKED_TOKEN_KEY = "auth_revoked_jti_{jti}"
+REVOKED_STAFF_KEY = "auth_revoked_staff_{staff_id}"
+# Redis sorted set of every live revocation (filter member -> expiry timestamp), used to rebuild filters.
+REVOCATIONS_KEY = "auth_revocations"
+REVOCATION_CHANNEL = "auth_revocations"
+# Rebuilding drops expired revocations, which a Bloom filter cannot forget on its own.
+REVOCATION_REBUILD_INTERVAL = 60 * 5
+REVOCATION_FILTER_CAPACITY = 100_000
+REVOCATION_FILTER_ERROR_RATE = 0.001
+LISTENER_RETRY_SECONDS = 5
+
+
+class BloomFilter:
+    """Set membership with no false negatives and ``error_rate`` false positives at ``capacity`` entries."""
+
+    def __init__(self, capacity=REVOCATION_FILTER_CAPACITY, error_rate=REVOCATION_FILTER_ERROR_RATE):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        for i in range(self.hashes):
+            yield (first + i * step) % size
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        # Most keys were never added and miss on the first unset bit.
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+def _token_member(jti):
+    return f"jti:{jti}"
+
+
+def _staff_member(staff_id):
+    return f"staff:{staff_id}"
+
+
+class TokenRevocations:
+    """
+    Revoked login tokens, by ``jti`` for one token or by staff id for every
+    token issued to that staff member up to a moment. The records live in
+    the shared cache (Redis). Each process keeps a Bloom filter of them, so
+    checking a token that was never revoked costs a few microseconds and no
+    network round trip; only a filter hit is confirmed against the cache.
+
+    Revoking publishes on a Redis channel. A daemon thread per process adds
+    each published revocation to its filter and rebuilds the filter from
+    ``REVOCATIONS_KEY`` after (re)connecting and every
+    REVOCATION_REBUILD_INTERVAL. With a cache backend that is not Redis, the
+    filter is local to the process.
+    """
+
+    def __init__(self):
+        self.filter = BloomFilter()
+        self._lock = threading.Lock()
+        self._listener_pid = None
+        self._redis = False  # not looked up yet
+
+    def redis(self):
+        if self._redis is False:
+            try:
+                from django_redis import get_redis_connection
+                self._redis = get_redis_connection("default")
+            except (ImportError, NotImplementedError):
+                self._redis = None
+        return self._redis
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            # Also runs again in a forked child, which does not inherit the thread.
+            self._listener_pid = os.getpid()
+            if self.redis() is not None:
+                # Load the current list before the first check; the listener rebuilds again once subscribed.
+                try:
+                    self.rebuild()
+                except Exception:
+                    logger.exception("Could not load token revocations")
+                threading.Thread(target=self._listen, name="token-revocations", daemon=True).start()
+
+    def _listen(self):
+        redis = self.redis()
+        while True:
+            pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                # Subscribe before rebuilding so nothing published in between is missed.
+                pubsub.subscribe(REVOCATION_CHANNEL)
+                self.rebuild()
+                rebuilt_at = time.monotonic()
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self.filter.add(_decode(message['data']))
+                    if time.monotonic() - rebuilt_at > REVOCATION_REBUILD_INTERVAL:
+                        self.rebuild()
+                        rebuilt_at = time.monotonic()
+            except Exception:
+                logger.exception("Token revocation listener lost Redis, retrying in %ss", LISTENER_RETRY_SECONDS)
+                time.sleep(LISTENER_RETRY_SECONDS)
+            finally:
+                pubsub.close()
+
+    def rebuild(self):
+        """Replace this process's filter with the live revocations in Redis."""
+        redis = self.redis()
+        redis.zremrangebyscore(REVOCATIONS_KEY, '-inf', time.time())
+        members = redis.zrange(REVOCATIONS_KEY, 0, -1)
+        fresh = BloomFilter(capacity=max(REVOCATION_FILTER_CAPACITY, 2 * len(members)))
+        for member in members:
+            fresh.add(_decode(member))
+        self.filter = fresh
+
+    def _announce(self, member, expires_at):
+        self.filter.add(member)
+        redis = self.redis()
+        if redis is None:
+            return
+        try:
+            pipeline = redis.pipeline()
+            pipeline.zadd(REVOCATIONS_KEY, {member: expires_at})
+            pipeline.publish(REVOCATION_CHANNEL, member)
+            pipeline.execute()
+        except Exception:
+            logger.exception("Could not announce token revocation %s", member)
+            raise
+
+    def revoke_token(self, decoded_token):
+        """Revoke one token by its ``jti`` until it would have expired anyway."""
+        expires_at = decoded_token['exp']
+        timeout = max(1, int(expires_at - time.time()))
+        cache.set(REVOKED_TOKEN_KEY.format(jti=decoded_token['jti']), True, timeout=timeout)
+        self._announce(_token_member(decoded_token['jti']), expires_at)
+
+    def revoke_staff(self, staff_id):
+        """Revoke every token issued to ``staff_id`` up to now."""
+        lifetime = settings.JWT_EXPIRATION_MINUTES * 60
+        now = time.time()
+        cache.set(REVOKED_STAFF_KEY.format(staff_id=staff_id), now, timeout=lifetime)
+        self._announce(_staff_member(staff_id), now + lifetime)
+
+    def is_revoked(self, decoded_token):
+        self._ensure_listener()
+        jti = decoded_token.get('jti')
+        if jti and _token_member(jti) in self.filter:
+            if cache.get(REVOKED_TOKEN_KEY.format(jti=jti)):
+                return True
+        staff_id = decoded_token.get('id')
+        if _staff_member(staff_id) in self.filter:
+            revoked_at = cache.get(REVOKED_STAFF_KEY.format(staff_id=staff_id))
+            if revoked_at is not None and decoded_token.get('iat', 0) <= revoked_at:
+                return True
+        return False
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+token_revocations = TokenRevocations()
@@ -0,0 +1,48 @@
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .authentication import principals
+from .cache import TenantCache, tenant_models
+from .revocation import token_revocations
+from .models import Company, Staff
+from .utils import company_id_for
+
+
+@receiver(post_save, sender=Staff)
+@receiver(post_delete, sender=Staff)
+def staff_changed(sender, instance, signal, **kwargs):
+    staff_id = instance.pk  # cleared on the instance once a delete completes
+    transaction.on_commit(lambda: principals.invalidate([staff_id]))
+    # Tokens issued before a deactivation stay dead even if the account is reactivated later.
+    if signal is post_delete or not instance.is_active:
+        transaction.on_commit(lambda: token_revocations.revoke_staff(staff_id))
+
+
+@receiver(post_save, sender=Company)
+def company_changed(sender, instance, **kwargs):
+    # Deleting a company deletes its staff, whose own signals drop them.
+    company_id = instance.pk
+    transaction.on_commit(lambda: principals.invalidate_company(company_id))
+
+
+TENANT_MODELS = tenant_models()
+
+
+def tenant_row_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        TenantCache.invalidate([company_id_for(instance, TENANT_MODELS[sender])])
+
+
+def tenant_row_deleted(sender, instance, origin=None, **kwargs):
+    # Rows removed along with a tracked parent are covered by the parent's own signal,
+    # and rows removed along with their company have no lists left to serve.
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is not sender and (origin_model is Company or origin_model in TENANT_MODELS):
+        return
+    TenantCache.invalidate([company_id_for(instance, TENANT_MODELS[sender])])
+
+
+for model in TENANT_MODELS:
+    post_save.connect(tenant_row_saved, sender=model, dispatch_uid=f"tenant_saved_{model.__name__}")
+    post_delete.connect(tenant_row_deleted, sender=model, dispatch_uid=f"tenant_deleted_{model.__name__}")
@@ -1,3 +1,423 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from unittest import mock
+from django.core.cache import cache
+from django.contrib.auth import hashers
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from office.models import Office
+from .authentication import PrincipalCache, principals
+from .cache import TenantCache
+from .hashing import HashingBusy, HashingPool, check_password_hash, hashing_pool
+from .models import Company, Staff
+from .revocation import BloomFilter, TokenRevocations
+from .utils import TokenService
 
-# Create your tests here.
+# Keep tests off the real Redis, and hash staff passwords cheaply.
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+PBKDF2_HASHERS = ['opticalfiber_app.tests.FastPBKDF2PasswordHasher']
+
+PROFILE_URL = '/api/opticalfiber/update/user/profile/'
+LOGIN_URL = '/api/opticalfiber/login/'
+
+
+class FastPBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    iterations = 2
+
+
+def outdated_hash(password):
+    """A hash made before the iteration count was raised."""
+    hasher = FastPBKDF2PasswordHasher()
+    return hasher.encode(password, hasher.salt(), iterations=1)
+
+
+def make_company(name='Acme'):
+    return Company.objects.create(
+        name=name, registration_number=f'REG-{name}', email='ops@example.com', phone='1', address='x',
+    )
+
+
+def make_staff(company, email='ops@example.com', password='secret'):
+    return Staff.objects.create(company=company, name='Ops', email=email, password=password, role='admin')
+
+
+def make_client(staff):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=TokenService.encode(staff))
+    return client
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class PrincipalCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # Staff ids are reused between tests, so start every test with an empty process-local LRU.
+        patcher = mock.patch.object(principals, '_local', OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.staff = make_staff(self.company)
+
+    def test_hit_needs_no_query(self):
+        principals.get(self.staff.pk)
+        with self.assertNumQueries(0):
+            staff = principals.get(self.staff.pk)
+            self.assertEqual((staff.pk, staff.company.name), (self.staff.pk, 'Acme'))
+        self.assertIsNone(principals.get(999999))
+
+    def test_every_get_builds_fresh_instances(self):
+        first = principals.get(self.staff.pk)
+        first.name = 'Changed'
+        first.company.name = 'Changed'
+        second = principals.get(self.staff.pk)
+        self.assertEqual((second.name, second.company.name), ('Ops', 'Acme'))
+
+    def test_password_hash_is_never_cached(self):
+        principals.get(self.staff.pk)
+        staff = principals.get(self.staff.pk)
+        self.assertNotIn('password', staff.__dict__)
+        with self.assertNumQueries(1):
+            self.assertTrue(staff.check_password('secret'))
+
+    def test_staff_and_company_changes_drop_the_row(self):
+        principals.get(self.staff.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Staff.objects.filter(pk=self.staff.pk).update(name='Renamed')
+            staff = Staff.objects.get(pk=self.staff.pk)
+            staff.save()
+        self.assertEqual(principals.get(self.staff.pk).name, 'Renamed')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.name = 'Acme Fiber'
+            self.company.save()
+        self.assertEqual(principals.get(self.staff.pk).company.name, 'Acme Fiber')
+
+    def test_local_entries_are_bounded(self):
+        local = PrincipalCache(size=2)
+        others = [make_staff(self.company, email=f'ops{number}@example.com') for number in range(3)]
+        for staff in others:
+            local.get(staff.pk)
+        self.assertEqual(list(local._local), [others[1].pk, others[2].pk])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class StaffJWTAuthenticationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(principals, '_local', OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.staff = make_staff(make_company())
+        self.api = make_client(self.staff)
+
+    def test_request_user_is_the_staff_member(self):
+        response = self.api.get(PROFILE_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['email'], 'ops@example.com')
+
+    def test_rejected_tokens(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.staff.is_active = False
+            self.staff.save()
+        self.assertEqual(self.api.get(PROFILE_URL).status_code, 401)
+        self.staff.delete()
+        self.assertEqual(self.api.get(PROFILE_URL).status_code, 401)
+        garbage = APIClient()
+        garbage.credentials(HTTP_AUTHORIZATION='not a token')
+        self.assertEqual(garbage.get(PROFILE_URL).status_code, 401)
+
+    def test_profile_update_saves_the_current_row(self):
+        # Another request changed the role after this token's principal was cached.
+        self.api.get(PROFILE_URL)
+        Staff.objects.filter(pk=self.staff.pk).update(role='engineer')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api.put(PROFILE_URL, {'name': 'New Name'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        staff = Staff.objects.get(pk=self.staff.pk)
+        self.assertEqual((staff.name, staff.role), ('New Name', 'engineer'))
+
+
+class HashingPoolTests(SimpleTestCase):
+
+    def test_turns_work_away_beyond_the_queue(self):
+        pool = HashingPool(workers=1, queue_limit=1)
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        running = [pool.submit(gate.wait, 5), pool.submit(gate.wait, 5)]
+        with self.assertRaises(HashingBusy):
+            pool.submit(gate.wait, 5)
+
+        gate.set()
+        for future in running:
+            self.assertTrue(future.result(timeout=5))
+        # Slots come back as jobs finish.
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                self.assertEqual(pool.submit(lambda: 'done').result(timeout=5), 'done')
+                break
+            except HashingBusy:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    def test_arun_awaits_the_result(self):
+        pool = HashingPool(workers=2, queue_limit=0)
+        self.assertEqual(asyncio.run(pool.arun(sum, [1, 2, 3])), 6)
+
+
+@override_settings(PASSWORD_HASHERS=PBKDF2_HASHERS)
+class CheckPasswordHashTests(SimpleTestCase):
+
+    def test_outdated_hashes_are_upgraded(self):
+        current = hashers.make_password('secret')
+        self.assertEqual(check_password_hash('secret', current), (True, None))
+        self.assertEqual(check_password_hash('wrong', current), (False, None))
+
+        valid, rehashed = check_password_hash('secret', outdated_hash('secret'))
+        self.assertTrue(valid)
+        self.assertEqual(rehashed.split('$')[1], '2')
+        self.assertTrue(hashers.check_password('secret', rehashed))
+        self.assertEqual(check_password_hash('wrong', outdated_hash('secret')), (False, None))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class PasswordEndpointTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(principals, '_local', OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.staff = make_staff(make_company())
+        self.api = APIClient()
+
+    def login(self, password):
+        return self.api.post(LOGIN_URL, {'email': 'ops@example.com', 'password': password}, format='json')
+
+    def test_login(self):
+        response = self.login('secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TokenService.decode(response.data['token'])['id'], self.staff.pk)
+        self.assertEqual(self.login('wrong').status_code, 401)
+        self.assertEqual(self.api.post(LOGIN_URL, {'email': 'nobody@example.com', 'password': 'x'},
+                                       format='json').status_code, 401)
+        self.assertEqual(self.api.post(LOGIN_URL, {'email': 'ops'}, format='json').status_code, 400)
+
+    @override_settings(PASSWORD_HASHERS=PBKDF2_HASHERS)
+    def test_login_upgrades_an_outdated_hash(self):
+        Staff.objects.filter(pk=self.staff.pk).update(password=outdated_hash('secret'))
+        self.assertEqual(self.login('secret').status_code, 200)
+        self.assertEqual(Staff.objects.get(pk=self.staff.pk).password.split('$')[1], '2')
+
+    def test_busy_pool_answers_503(self):
+        with mock.patch.object(hashing_pool, 'submit', side_effect=HashingBusy):
+            response = self.login('secret')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_register_change_and_reset(self):
+        response = self.api.post('/api/opticalfiber/register/', {
+            'name': 'Beta', 'registration_number': 'REG-Beta', 'email': 'hq@beta.example.com', 'phone': '2',
+            'address': 'x', 'admin_name': 'Admin', 'admin_email': 'admin@beta.example.com', 'admin_password': 'one',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        admin = Staff.objects.get(email='admin@beta.example.com')
+        self.assertTrue(admin.check_password('one'))
+
+        api = make_client(admin)
+        change = '/api/opticalfiber/change/password/'
+        self.assertEqual(api.post(change, {'old_password': 'wrong', 'new_password': 'two'},
+                                  format='json').status_code, 400)
+        self.assertEqual(api.post(change, {'old_password': 'one', 'new_password': 'two'},
+                                  format='json').status_code, 200)
+        self.assertTrue(Staff.objects.get(pk=admin.pk).check_password('two'))
+
+        reset = '/api/opticalfiber/reset/password/'
+        self.assertEqual(self.api.post(reset, {'email': 'admin@beta.example.com', 'new_password': 'three'},
+                                       format='json').status_code, 200)
+        self.assertTrue(Staff.objects.get(pk=admin.pk).check_password('three'))
+        self.assertEqual(self.api.post(reset, {'email': 'nobody@example.com', 'new_password': 'x'},
+                                       format='json').status_code, 404)
+
+
+class BloomFilterTests(SimpleTestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=2000, error_rate=0.01)
+        keys = [f"jti:{uuid.uuid4().hex}" for _ in range(2000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_false_positive_rate_near_target(self):
+        bloom = BloomFilter(capacity=2000, error_rate=0.01)
+        for _ in range(2000):
+            bloom.add(f"jti:{uuid.uuid4().hex}")
+        hits = sum(f"jti:{uuid.uuid4().hex}" in bloom for _ in range(20000))
+        self.assertLess(hits / 20000, 0.03)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TokenRevocationTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.revocations = TokenRevocations()
+        # Without Redis the filter is local to this instance.
+        self.revocations._redis = None
+
+    def token(self, staff_id=1, issued=None, **claims):
+        issued = time.time() if issued is None else issued
+        return {'id': staff_id, 'jti': uuid.uuid4().hex, 'iat': issued, 'exp': issued + 600, **claims}
+
+    def test_revoke_one_token(self):
+        revoked, other = self.token(), self.token()
+        self.revocations.revoke_token(revoked)
+        self.assertTrue(self.revocations.is_revoked(revoked))
+        self.assertFalse(self.revocations.is_revoked(other))
+
+    def test_revoke_staff_covers_earlier_tokens_only(self):
+        earlier = self.token(staff_id=7, issued=time.time() - 60)
+        legacy = {'id': 7, 'iat': int(time.time()) - 60}
+        other_staff = self.token(staff_id=8, issued=time.time() - 60)
+        self.revocations.revoke_staff(7)
+        later = self.token(staff_id=7, issued=time.time() + 1)
+        self.assertTrue(self.revocations.is_revoked(earlier))
+        self.assertTrue(self.revocations.is_revoked(legacy))
+        self.assertFalse(self.revocations.is_revoked(later))
+        self.assertFalse(self.revocations.is_revoked(other_staff))
+
+    def test_filter_hit_is_confirmed_against_cache(self):
+        token = self.token()
+        self.revocations.filter.add(f"jti:{token['jti']}")
+        self.assertFalse(self.revocations.is_revoked(token))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class LogoutTests(TestCase):
+    url = '/api/opticalfiber/logout/'
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(principals, '_local', OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.staff = make_staff(make_company())
+
+    def test_logout_revokes_only_this_token(self):
+        api, other = make_client(self.staff), make_client(self.staff)
+        response = api.post(self.url, {}, format='json')
+        self.assertEqual((response.status_code, response.data['data']), (200, {'all_sessions': False}))
+        self.assertEqual(api.get(PROFILE_URL).status_code, 401)
+        self.assertEqual(other.get(PROFILE_URL).status_code, 200)
+
+    def test_logout_everywhere(self):
+        api, other = make_client(self.staff), make_client(self.staff)
+        self.assertEqual(api.post(self.url, {'all_sessions': True}, format='json').status_code, 200)
+        self.assertEqual(api.get(PROFILE_URL).status_code, 401)
+        self.assertEqual(other.get(PROFILE_URL).status_code, 401)
+        # Logging in again issues a token after the revocation.
+        time.sleep(0.01)
+        self.assertEqual(make_client(self.staff).get(PROFILE_URL).status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TenantCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.company = Company.objects.create(
+            name='Acme', registration_number='R1', email='ops@example.com', phone='1', address='x',
+        )
+        self.other = Company.objects.create(
+            name='Other', registration_number='R2', email='ops@example.com', phone='1', address='x',
+        )
+        self.builds = []
+
+    def get(self, company, *parts):
+        def build():
+            self.builds.append(company.pk)
+            return f"built {len(self.builds)}"
+
+        return TenantCache.get_or_build(company.pk, 'offices', build, *parts)
+
+    def test_built_once_per_generation(self):
+        self.assertEqual(self.get(self.company), "built 1")
+        self.assertEqual(self.get(self.company), "built 1")
+        self.assertEqual(self.get(self.company, 'page', 2), "built 2")
+
+    def test_invalidate_waits_for_commit(self):
+        self.get(self.company)
+        self.get(self.other)
+        with self.captureOnCommitCallbacks(execute=True):
+            TenantCache.invalidate([self.company.pk, None])
+            self.assertEqual(self.get(self.company), "built 1")
+        self.assertEqual(self.get(self.company), "built 3")
+        self.assertEqual(self.get(self.other), "built 2")
+
+    def test_row_changes_bump_their_company(self):
+        self.get(self.company)
+        generation, other_generation = TenantCache.generation(self.company.pk), TenantCache.generation(self.other.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            office = Office.objects.create(company=self.company, name='HQ', latitude=0, longitude=0, address='x')
+        created = TenantCache.generation(self.company.pk)
+        self.assertNotEqual(created, generation)
+        with self.captureOnCommitCallbacks(execute=True):
+            office.delete()
+        self.assertNotIn(TenantCache.generation(self.company.pk), (generation, created))
+        self.assertEqual(TenantCache.generation(self.other.pk), other_generation)
+
+    def test_list_built_during_a_change_is_not_served(self):
+        def build():
+            # A change commits while this list is being rendered.
+            TenantCache.bump(self.company.pk)
+            return "stale"
+
+        self.assertEqual(TenantCache.get_or_build(self.company.pk, 'offices', build), "stale")
+        self.assertEqual(self.get(self.company), "built 1")
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class CachedListViewTests(TestCase):
+    url = '/api/office/add/'
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(principals, '_local', OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.company = make_company()
+        self.api = make_client(make_staff(self.company))
+        self.other = make_company('Other')
+        self.other_api = make_client(make_staff(self.other, email='other@example.com'))
+
+    def add_office(self, company, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            Office.objects.create(company=company, name=name, latitude=0, longitude=0, address='x')
+
+    def names(self, api):
+        response = api.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [office['name'] for office in response.data]
+
+    def test_served_from_cache_until_a_change_commits(self):
+        self.add_office(self.company, 'HQ')
+        self.assertEqual(self.names(self.api), ['HQ'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(self.api), ['HQ'])
+
+        self.add_office(self.other, 'Elsewhere')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(self.api), ['HQ'])
+        self.add_office(self.company, 'Depot')
+        self.assertEqual(sorted(self.names(self.api)), ['Depot', 'HQ'])
+        self.assertEqual(self.names(self.other_api), ['Elsewhere'])
+
+    def test_anonymous_requests_are_refused(self):
+        self.assertEqual(APIClient().get(self.url).status_code, 401)
@@ -4,6 +4,7 @@ from .views import *
 urlpatterns = [
     path('register/', RegisterCompanyView.as_view(), name='register'),
     path('login/',CompanyStaffAuthenticationView.as_view(), name="login"),
+    path('logout/', LogoutView.as_view(), name="logout"),
     path('company/staffs/', ListAllStaffByCompany.as_view(),name="staffs"),
     path('update/user/profile/',EditStaffProfile.as_view(),name="edit_profile"),
 
@@ -1,10 +1,30 @@
 import random
+import time
+import uuid
+import jwt
 from datetime import timedelta
 from django.utils import timezone
 from django.conf import settings
 from django.core.mail import send_mail
 from .models import OTP
 
+
+def company_id_for(instance, company_lookup):
+    """
+    The company owning ``instance``, given the ORM lookup from its model to
+    the company id (``'office__company_id'``...). Resolved through the
+    instance's parent foreign key, so it still works from ``post_delete``
+    once the row itself is gone.
+    """
+    if company_lookup == 'company_id':
+        return instance.company_id
+    parent, remainder = company_lookup.split('__', 1)
+    parent_id = getattr(instance, f'{parent}_id')
+    if parent_id is None:
+        return None
+    parent_model = type(instance)._meta.get_field(parent).related_model
+    return parent_model.objects.filter(pk=parent_id).values_list(remainder, flat=True).first()
+
 class OTPService:
     @staticmethod
     def generate_otp(length=6):
@@ -51,3 +71,29 @@ class OTPService:
 
         except OTP.DoesNotExist:
             return False, "Invalid OTP."
+
+
+
+class TokenService:
+    @staticmethod
+    def encode(staff):
+        """Issues the login JWT of a staff member."""
+        # Sub-second iat, so a token issued right after a staff-wide revocation is not caught by it.
+        now = time.time()
+        user_token = {
+            'id': staff.pk,
+            'company': staff.company_id,
+            'name': staff.name,
+            'exp': int(now) + settings.JWT_EXPIRATION_MINUTES * 60,
+            'iat': now,
+            'jti': uuid.uuid4().hex,
+        }
+        return jwt.encode(user_token, settings.SECRET_KEY, algorithm='HS256')
+
+    @staticmethod
+    def decode(token):
+        """
+        Decodes a staff JWT issued at login.
+        Raises jwt.InvalidTokenError (or its ExpiredSignatureError subclass) if invalid.
+        """
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
@@ -3,19 +3,21 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
-from django.contrib.auth.hashers import make_password
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.conf import settings
-import jwt
 from .serializers import *
 from .models import Company, Staff, OTP
-from datetime import timedelta, datetime
 from django.shortcuts import get_object_or_404
-from .utils import OTPService
+from .utils import OTPService, TokenService
+from .revocation import token_revocations
+from .hashing import HashingBusy, ahash_password, averify_password
 from django.db import DatabaseError
 from django.core.exceptions import ObjectDoesNotExist
 import logging
 from django.http import Http404
+from django.utils.functional import classproperty
+import inspect
+from asgiref.sync import sync_to_async
 logger = logging.getLogger(__name__)
 
 from django.db import transaction
@@ -40,40 +42,81 @@ class BaseAPIView(APIView):
 
     def authentication(self, request):
         """
-        Validates the JWT token passed in the Authorization header.
-        Returns the decoded token or raises an error if invalid.
+        The decoded JWT of the request. Tokens are checked by
+        StaffJWTAuthentication before the view runs; returns a 401
+        Response when the Authorization header is missing.
         """
-        try:
-            auth_user = request.headers.get('Authorization')
-            if auth_user is None:
-                return Response({"detail": "Authorization token is missing."}, status=401)
-            
-            try:
-                decoded_token = jwt.decode(auth_user, settings.SECRET_KEY, algorithms=['HS256'])
-                if 'id' not in decoded_token:
-                    return Response({"detail": "Token has no id"}, status=status.HTTP_401_UNAUTHORIZED)
-                return decoded_token
-            except jwt.ExpiredSignatureError:
-                return Response({"Token has expired."}, status=status.HTTP_401_UNAUTHORIZED)
-            except jwt.InvalidTokenError:
-                return Response({"Invalid token."}, status=status.HTTP_401_UNAUTHORIZED)
-            
-        except Exception as e:
-            return Response({f"Authentication failed: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if request.auth is None:
+            return Response({"detail": "Authorization token is missing."}, status=status.HTTP_401_UNAUTHORIZED)
+        return request.auth
 
+    def get_authenticated_user(self, request):
+        """``(staff, error)``: the authenticated Staff with its company, served from the principal cache."""
+        if not isinstance(request.user, Staff):
+            return None, "Unauthorized access"
+        return request.user, None
 
 
-class RegisterCompanyView(BaseAPIView):
+
+class AsyncAPIView(BaseAPIView):
+    """
+    BaseAPIView for handlers that wait on the password hashing pool. DRF's
+    dispatch is sync, and under ASGI every sync view shares one thread, so a
+    hash run from one would stall the rest. Here the handlers are coroutines:
+    authentication, permissions and throttling still run through DRF, in a
+    worker thread, and the handler is awaited on the event loop.
+    """
+
+    @classproperty
+    def view_is_async(cls):
+        return True
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    def hashing_busy_response(self):
+        """503 for a request turned away because the password hashing pool is full."""
+        response = self.error_response(
+            "Too many password operations in progress, please retry.",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+        response['Retry-After'] = '1'
+        return response
+
+
+class RegisterCompanyView(AsyncAPIView):
     """
     API view to handle the registration of a new company and its admin staff.
     """
     permission_classes = [AllowAny]
+    authentication_classes = []
+
+    async def post(self, request):
+        data = request.data
 
-    def post(self, request):
         # Validate Admin Staff Inputs First
-        admin_name = request.data.get('admin_name')
-        admin_email = request.data.get('admin_email')
-        admin_password = request.data.get('admin_password')
+        admin_name = data.get('admin_name')
+        admin_email = data.get('admin_email')
+        admin_password = data.get('admin_password')
 
         if not (admin_name and admin_email and admin_password):
             return self.error_response(
@@ -87,8 +130,8 @@ class RegisterCompanyView(BaseAPIView):
             )
 
         # Validate Company Inputs
-        serializer = CompanySerializer(data=request.data)
-        if not serializer.is_valid():
+        serializer = CompanySerializer(data=data)
+        if not await sync_to_async(serializer.is_valid)():
             return self.error_response(
                 "Invalid company input.",
                 details=serializer.errors,
@@ -96,26 +139,18 @@ class RegisterCompanyView(BaseAPIView):
             )
 
         try:
-            # Using a transaction to ensure everything is saved together
-            with transaction.atomic():
-                # Save company data
-                company = serializer.save()
-
-                # Save admin staff after validating the company
-                Staff.objects.create(
-                    company=company,
-                    name=admin_name,
-                    email=admin_email,
-                    password=make_password(admin_password),
-                    role='admin',
-                )
+            # Hash before the transaction so no database transaction waits on the hashing pool.
+            admin_password_hash = await ahash_password(admin_password)
+            company_data = await sync_to_async(self.register)(serializer, admin_name, admin_email, admin_password_hash)
 
             return self.success_response(
                 "Company and Admin Staff registered successfully!",
-                data=serializer.data,
+                data=company_data,
                 status_code=status.HTTP_201_CREATED
             )
 
+        except HashingBusy:
+            return self.hashing_busy_response()
         except Exception as error:
             # In case of any exception, the transaction is rolled back, nothing is saved.
             return self.error_response(
@@ -124,14 +159,39 @@ class RegisterCompanyView(BaseAPIView):
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @staticmethod
+    def register(serializer, admin_name, admin_email, admin_password_hash):
+        # Using a transaction to ensure everything is saved together
+        with transaction.atomic():
+            # Save company data
+            company = serializer.save()
+
+            # Save admin staff after validating the company
+            Staff.objects.create(
+                company=company,
+                name=admin_name,
+                email=admin_email,
+                password=admin_password_hash,
+                role='admin',
+            )
+        return serializer.data
+
 
-class CompanyStaffAuthenticationView(APIView):
+class CompanyStaffAuthenticationView(AsyncAPIView):
+    """
+    Staff login. The password check runs on the bounded hashing pool while
+    the event loop keeps serving other requests, and a burst beyond the
+    pool's queue is answered with 503. A password stored with outdated
+    hasher settings is rehashed on a successful login.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
 
     class StaffLoginSerializer(serializers.Serializer):
         email = serializers.EmailField()
         password = serializers.CharField()
 
-    def post(self, request):
+    async def post(self, request):
         serializer = self.StaffLoginSerializer(data=request.data)
         if not serializer.is_valid():
             return Response({"status": "error", "message": "Invalid input.", "errors": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
@@ -139,52 +199,50 @@ class CompanyStaffAuthenticationView(APIView):
         email = serializer.validated_data['email']
         password = serializer.validated_data['password']
 
+        staff = await Staff.objects.filter(email=email).afirst()
+        if staff is None:
+            return Response({"status": "error", "message": "Invalid credentials."}, status=status.HTTP_401_UNAUTHORIZED)
         try:
-            staff = Staff.objects.get(email=email)
-            if not staff.check_password(password):
-                raise ValueError("Invalid credentials.")
-        except (Staff.DoesNotExist, ValueError):
+            valid, rehashed = await averify_password(password, staff.password)
+        except HashingBusy:
+            return self.hashing_busy_response()
+        if not valid:
             return Response({"status": "error", "message": "Invalid credentials."}, status=status.HTTP_401_UNAUTHORIZED)
-
-        expiration_time = datetime.utcnow() + timedelta(minutes=settings.JWT_EXPIRATION_MINUTES)
-        user_token = {
-            'id': staff.pk,
-            'company': staff.company.pk,
-            'name': staff.name,
-            'exp': expiration_time,
-            'iat': datetime.utcnow(),
-        }
-        token = jwt.encode(user_token, settings.SECRET_KEY, algorithm='HS256')
+        if rehashed:
+            await Staff.objects.filter(pk=staff.pk).aupdate(password=rehashed)
 
         return Response({
             "status": "success",
-            "token": token,
+            "token": TokenService.encode(staff),
             "name": staff.name,
         }, status=status.HTTP_200_OK)
 
 
+class LogoutView(BaseAPIView):
+    """
+    Revokes the token of the request, or with ``{"all_sessions": true}``
+    every token issued to the staff member so far.
+    """
 
+    def post(self, request):
+        staff, error = self.get_authenticated_user(request)
+        if error:
+            return self.error_response(error, status_code=status.HTTP_401_UNAUTHORIZED)
 
-class ListAllStaffByCompany(BaseAPIView):
+        # Tokens issued before jti was added can only be revoked with the rest of the staff member's.
+        all_sessions = bool(request.data.get('all_sessions')) or 'jti' not in request.auth
+        if all_sessions:
+            token_revocations.revoke_staff(staff.pk)
+        else:
+            token_revocations.revoke_token(request.auth)
+        return self.success_response("Logged out.", data={"all_sessions": all_sessions})
 
-    def authenticate_and_get_staff(self, request):
-        """Helper method to authenticate and fetch staff member."""
-        try:
-            auth_user = self.authentication(request)
-            user_id = auth_user.get('id')
-            if not user_id:
-                return None, "Unauthorized access"
 
-            staff_member = Staff.objects.select_related('company').get(pk=user_id)
-            return staff_member, None
-        except Staff.DoesNotExist:
-            return None, "Staff member not found in the database."
-        except Exception as e:
-            return None, f"An error occurred while fetching staff details: {str(e)}"
+class ListAllStaffByCompany(BaseAPIView):
 
     def post(self, request):
         """Handles post request for creating staff under a company."""
-        staff_member, error = self.authenticate_and_get_staff(request)
+        staff_member, error = self.get_authenticated_user(request)
         if not staff_member:
             return Response({"status": "error", "message": error}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -208,7 +266,7 @@ class ListAllStaffByCompany(BaseAPIView):
 
     def get(self, request):
         """Handles get request for fetching staff data under a company."""
-        staff_member, error = self.authenticate_and_get_staff(request)
+        staff_member, error = self.get_authenticated_user(request)
         if not staff_member:
             return Response({"status": "error", "message": error}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -232,15 +290,10 @@ class EditStaffProfile(BaseAPIView):
         """
         Encapsulate the logic to authenticate and fetch staff instance.
         """
-        decoded_token = self.authentication(request)
-        user_id = decoded_token.get('id')
-        if not user_id:
-            raise Exception("User ID not found in token.")
-
-        try:
-            return Staff.objects.get(id=user_id)
-        except Staff.DoesNotExist:
-            raise Http404("Staff not found")
+        staff, error = self.get_authenticated_user(request)
+        if error:
+            raise Exception(error)
+        return staff
 
     def get(self, request):
         try:
@@ -254,7 +307,8 @@ class EditStaffProfile(BaseAPIView):
 
     def put(self, request):
         try:
-            staff_instance = self.get_authenticated_staff(request)
+            # Save the current row, not the principal cache's snapshot of it.
+            staff_instance = Staff.objects.get(pk=self.get_authenticated_staff(request).pk)
             serializer = StaffProfileSerializer(staff_instance, data=request.data, partial=True)
 
             if serializer.is_valid():
@@ -272,31 +326,36 @@ class EditStaffProfile(BaseAPIView):
 
     
 
-class ChangePasswordView(EditStaffProfile):
-    def post(self, request):
-        staff_instance = self.get_authenticated_staff(request)
-        user_id = staff_instance.id
-        
-        try:
-            staff = Staff.objects.get(id=user_id)
-        except Staff.DoesNotExist:
-            return self.error_response("Staff not found.", status.HTTP_404_NOT_FOUND)
+class ChangePasswordView(AsyncAPIView):
+    async def post(self, request):
+        staff, error = self.get_authenticated_user(request)
+        if error:
+            return self.error_response(error, status_code=status.HTTP_401_UNAUTHORIZED)
 
         old_password = request.data.get('old_password')
         new_password = request.data.get('new_password')
 
         if not old_password or not new_password:
-            return self.error_response("Old and new passwords are required.", status.HTTP_400_BAD_REQUEST)
-
-        if not staff.check_password(old_password):
-            return self.error_response("Old password is incorrect.", status.HTTP_400_BAD_REQUEST)
+            return self.error_response("Old and new passwords are required.")
 
-        staff.password = make_password(new_password)
-        staff.save()
+        try:
+            # The cached principal carries no password hash; read the current one.
+            encoded = await Staff.objects.filter(pk=staff.pk).values_list('password', flat=True).afirst()
+            valid, _ = await averify_password(old_password, encoded)
+            if not valid:
+                return self.error_response("Old password is incorrect.")
+            staff.password = await ahash_password(new_password)
+        except HashingBusy:
+            return self.hashing_busy_response()
+        # request.user comes from the principal cache and may be stale, so only the
+        # password is written; the Staff post_save signal then drops the cached principal.
+        await staff.asave(update_fields=['password'])
 
         return self.success_response("Password changed successfully.", status_code=status.HTTP_200_OK)
 
 class ForgotPasswordView(BaseAPIView):
+    authentication_classes = []
+
     def post(self, request):
         email = request.data.get('email')
 
@@ -334,6 +393,8 @@ class ForgotPasswordView(BaseAPIView):
 
 
 class VerifyOTPView(BaseAPIView):
+    authentication_classes = []
+
     def post(self, request):
         email = request.data.get('email')
         otp_code = request.data.get('otp')
@@ -356,18 +417,20 @@ class VerifyOTPView(BaseAPIView):
             return self.error_response(f"An error occurred: {str(e)}", status.HTTP_500_INTERNAL_SERVER_ERROR)
         
 
-class ResetPasswordView(BaseAPIView):
-    def post(self, request):
+class ResetPasswordView(AsyncAPIView):
+    authentication_classes = []
+
+    async def post(self, request):
         email = request.data.get('email')
         new_password = request.data.get('new_password')
 
         if not email or not new_password:
-            return self.error_response("Email and new password are required.", status.HTTP_400_BAD_REQUEST)
+            return self.error_response("Email and new password are required.")
 
         try:
-            staff = Staff.objects.get(email=email, is_active=True)
-            staff.password = make_password(new_password)
-            staff.save()
+            staff = await Staff.objects.aget(email=email, is_active=True)
+            staff.password = await ahash_password(new_password)
+            await staff.asave(update_fields=['password'])
 
             return Response({
                 "status": "success",
@@ -375,9 +438,8 @@ class ResetPasswordView(BaseAPIView):
             }, status=status.HTTP_200_OK)
 
         except Staff.DoesNotExist:
-            return self.error_response("Email not found.", status.HTTP_404_NOT_FOUND)
+            return self.error_response("Email not found.", status_code=status.HTTP_404_NOT_FOUND)
+        except HashingBusy:
+            return self.hashing_busy_response()
         except Exception as e:
-            return self.error_response(f"An error occurred: {str(e)}", status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-
-
+            return self.error_response(f"An error occurred: {str(e)}", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
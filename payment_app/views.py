@@ -14,7 +14,6 @@ from .cashfree_async import (
 )
 from django.conf import settings
 from opticalfiber_app.views import BaseAPIView
-from opticalfiber_app.models import Staff
 
 
 class InitiatePaymentAPI(BaseAPIView):
@@ -67,28 +66,10 @@ class InitiatePaymentAPI(BaseAPIView):
             payment.mark_failed()
             return Response({"error": str(e)}, status=500)
 
-    def get_authenticated_user(self, request):
-        auth = self.authentication(request)
-
-        # ❌ If authentication() returned a Response (error)
-        if isinstance(auth, Response):
-            return None, "Unauthorized"
-
-        user_id = auth.get("id")
-        if not user_id:
-            return None, "Invalid authentication payload"
-
-        try:
-            staff = Staff.objects.select_related("company").get(pk=user_id)
-            return staff, None
-        except Staff.DoesNotExist:
-            return None, "Staff not found"
-
-
-
-
 
 class PaymentCallbackAPI(APIView):
+    authentication_classes = []
+
     def get(self, request):
         transaction_id = request.GET.get("transaction_id")
         payment = Payment.objects.filter(transaction_id=transaction_id).first()
@@ -166,24 +147,3 @@ class PaymentListAPI(BaseAPIView):
         ]
 
         return Response({"payments": payment_list}, status=200)
-    
-    def get_authenticated_user(self, request):
-        auth = self.authentication(request)
-
-        if isinstance(auth, Response):
-            return None, "Unauthorized"
-
-        user_id = auth.get("id")
-        if not user_id:
-            return None, "Invalid authentication payload"
-
-        try:
-            staff = Staff.objects.select_related("company").get(pk=user_id)
-            return staff, None
-        except Staff.DoesNotExist:
-            return None, "Staff not found"
-
-
-
-
-
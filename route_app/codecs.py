@@ -0,0 +1,56 @@
+import struct
+import zlib
+import numpy as np
+from .geometry import path_array
+
+# Header: magic, vertex format, vertex count.
+HEADER = struct.Struct('<2sBI')
+MAGIC = b'FP'
+
+# The vertex form the path was saved with, handed back by ``decode_path``.
+FORMAT_PAIRS = 1    # [[lat, lng], ...]
+FORMAT_OBJECTS = 2  # [{"lat": .., "lng": ..}, ...]
+FORMATS = (FORMAT_PAIRS, FORMAT_OBJECTS)
+
+# Coordinates are stored as fixed-point integer microdegrees (~0.11 m).
+SCALE = 1_000_000
+
+# Little-endian int32, independent of the host byte order.
+DELTA_DTYPE = np.dtype('<i4')
+
+
+def encode_path(path):
+    """
+    Pack a route path into bytes: fixed-point int32 microdegrees, delta encoded
+    vertex to vertex and deflated. Consecutive GPS vertices differ by a few
+    hundred microdegrees, so the deltas compress to a couple of bytes each.
+    """
+    coords = path_array(path)
+    vertex_format = FORMAT_OBJECTS if len(path or ()) and isinstance(path[0], dict) else FORMAT_PAIRS
+    fixed = np.rint(coords * SCALE).astype(np.int64)
+    deltas = np.diff(fixed, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return HEADER.pack(MAGIC, vertex_format, len(coords)) + zlib.compress(deltas.astype(DELTA_DTYPE).tobytes())
+
+
+def _unpack(data):
+    data = bytes(data)
+    magic, vertex_format, count = HEADER.unpack_from(data)
+    if magic != MAGIC or vertex_format not in FORMATS:
+        raise ValueError("Not an encoded route path.")
+    deltas = np.frombuffer(zlib.decompress(data[HEADER.size:]), dtype=DELTA_DTYPE)
+    if len(deltas) != count * 2:
+        raise ValueError("Encoded route path is truncated.")
+    return vertex_format, np.cumsum(deltas.reshape(-1, 2), axis=0, dtype=np.int64) / SCALE
+
+
+def decode_array(data):
+    """Unpack bytes produced by ``encode_path`` into an ``(n, 2)`` float array of degrees."""
+    return _unpack(data)[1]
+
+
+def decode_path(data):
+    """Unpack bytes produced by ``encode_path`` into the vertex form they were saved with."""
+    vertex_format, coords = _unpack(data)
+    if vertex_format == FORMAT_OBJECTS:
+        return [{'lat': lat, 'lng': lng} for lat, lng in coords.tolist()]
+    return coords.tolist()
@@ -0,0 +1,58 @@
+from base64 import b64encode
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import models
+from .codecs import encode_path, decode_path
+from .geometry import path_error
+
+
+class CompactPathField(models.BinaryField):
+    """
+    Stores a route path in a bytea column using ``route_app.codecs`` and exposes
+    it in Python as the list it was saved as, ``[[lat, lng], ...]`` or
+    ``[{"lat": .., "lng": ..}, ...]``.
+    """
+
+    description = "Route path stored as delta-encoded fixed-point coordinates"
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if kwargs.get('editable') is True:
+            del kwargs['editable']
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return decode_path(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, list):
+            return value
+        if isinstance(value, str):
+            value = super().to_python(value)
+        return decode_path(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, (list, tuple)):
+            value = encode_path(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        value = self.value_from_object(obj)
+        if value is None:
+            return None
+        return b64encode(encode_path(value)).decode('ascii')
+
+    def validate(self, value, model_instance):
+        super().validate(value, model_instance)
+        error = path_error(value)
+        if error:
+            raise ValidationError(error, code='invalid')
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{'form_class': forms.JSONField, **kwargs})
@@ -0,0 +1,258 @@
+import math
+import numpy as np
+
+
+def path_points(path):
+    """
+    Normalise a stored ``FiberRoute.path`` into a list of ``(lat, lng)`` floats.
+    Accepts ``[lat, lng]`` pairs as well as ``{"lat": .., "lng": ..}`` objects and
+    skips vertices that cannot be read.
+    """
+    points = []
+    for vertex in path or ():
+        try:
+            if isinstance(vertex, dict):
+                lat, lng = vertex['lat'], vertex['lng']
+            else:
+                lat, lng = vertex[0], vertex[1]
+            points.append((float(lat), float(lng)))
+        except (KeyError, IndexError, TypeError, ValueError):
+            continue
+    return points
+
+
+def path_error(path):
+    """
+    Why ``path`` cannot be stored as a route path, or None if it can. Vertices
+    are all ``[lat, lng]`` pairs or all ``{"lat": .., "lng": ..}`` objects, so
+    the stored form can be handed back unchanged.
+    """
+    if not isinstance(path, (list, tuple)):
+        return "Path must be a list of vertices."
+    if any(isinstance(vertex, dict) for vertex in path):
+        if not all(isinstance(vertex, dict) and vertex.keys() == {'lat', 'lng'} for vertex in path):
+            return "Path vertices must all be {\"lat\": .., \"lng\": ..} objects when any is."
+    elif not all(isinstance(vertex, (list, tuple)) and len(vertex) == 2 for vertex in path):
+        return "Path must be a list of [lat, lng] pairs."
+    if len(path_points(path)) != len(path):
+        return "Path coordinates must be numbers."
+    return None
+
+
+def path_array(path):
+    """
+    The vertices of ``path`` as an ``(n, 2)`` float array of ``(lat, lng)``.
+    Plain ``[lat, lng]`` lists convert in one step; other vertex forms go
+    through ``path_points``.
+    """
+    if path is None or len(path) == 0:
+        return np.empty((0, 2))
+    try:
+        coords = np.asarray(path, dtype=float)
+        if coords.ndim == 2 and coords.shape[1] == 2:
+            return coords
+    except (TypeError, ValueError):
+        pass
+    return np.array(path_points(path), dtype=float).reshape(-1, 2)
+
+
+def path_bounds(points):
+    """Return ``(south, west, north, east)`` for a list of points, or None if empty."""
+    if not points:
+        return None
+    lats = [lat for lat, _ in points]
+    lngs = [lng for _, lng in points]
+    return min(lats), min(lngs), max(lats), max(lngs)
+
+
+# Zoom levels that get a precomputed simplified copy of every route.
+SIMPLIFY_ZOOMS = (4, 6, 8, 10, 12, 14)
+
+EARTH_CIRCUMFERENCE_M = 40075016.686
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres between two points."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _segment_lengths_m(coords):
+    lat, lng = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def path_length_km(coords):
+    """Geodesic length in kilometres of an ``(n, 2)`` array of vertices, summed haversine over all segments."""
+    if len(coords) < 2:
+        return 0.0
+    return float(_segment_lengths_m(coords).sum() / 1000)
+
+
+def snap_to_path(coords, lat, lng):
+    """
+    Closest point to ``(lat, lng)`` on the polyline ``coords`` (an ``(n, 2)``
+    array). Segments are measured in a local flat projection around the query
+    point, which is accurate at the few-hundred-metre scale snapping works at.
+    Returns ``(distance_m, along_m, (lat, lng))`` where ``along_m`` is the
+    distance from the first vertex along the path, or None for an empty path.
+    """
+    if len(coords) == 0:
+        return None
+    if len(coords) == 1:
+        point = (float(coords[0, 0]), float(coords[0, 1]))
+        return haversine_m(lat, lng, *point), 0.0, point
+
+    metres_per_degree = math.radians(EARTH_RADIUS_M)
+    y = (coords[:, 0] - lat) * metres_per_degree
+    x = (coords[:, 1] - lng) * metres_per_degree * math.cos(math.radians(lat))
+    dx, dy = np.diff(x), np.diff(y)
+    squared = dx * dx + dy * dy
+    t = np.clip(-(x[:-1] * dx + y[:-1] * dy) / np.where(squared > 0, squared, 1.0), 0.0, 1.0)
+    distances = np.hypot(x[:-1] + t * dx, y[:-1] + t * dy)
+    segment = int(np.argmin(distances))
+
+    fraction = float(t[segment])
+    start, stop = coords[segment], coords[segment + 1]
+    point = (float(start[0] + fraction * (stop[0] - start[0])), float(start[1] + fraction * (stop[1] - start[1])))
+    lengths = _segment_lengths_m(coords)
+    along = float(lengths[:segment].sum() + fraction * lengths[segment])
+    return float(distances[segment]), along, point
+
+
+def point_along_path(coords, along_m):
+    """
+    The point ``along_m`` metres from the first vertex of ``coords``, clamped
+    to the path. Returns ``(along_m, (lat, lng))`` or None for an empty path.
+    """
+    if len(coords) == 0:
+        return None
+    if len(coords) == 1:
+        return 0.0, (float(coords[0, 0]), float(coords[0, 1]))
+
+    cumulative = np.concatenate(([0.0], np.cumsum(_segment_lengths_m(coords))))
+    along_m = min(max(float(along_m), 0.0), float(cumulative[-1]))
+    segment = min(int(np.searchsorted(cumulative, along_m, side='right')) - 1, len(coords) - 2)
+    length = cumulative[segment + 1] - cumulative[segment]
+    fraction = (along_m - cumulative[segment]) / length if length > 0 else 0.0
+    start, stop = coords[segment], coords[segment + 1]
+    return along_m, (float(start[0] + fraction * (stop[0] - start[0])), float(start[1] + fraction * (stop[1] - start[1])))
+
+
+def zoom_tolerance(zoom):
+    """Ground size in metres of one 256px tile pixel at the equator for a zoom level."""
+    return EARTH_CIRCUMFERENCE_M / (256 * 2 ** zoom)
+
+
+def _indexed_points(path):
+    indexed = []
+    for position, vertex in enumerate(path or ()):
+        point = path_points([vertex])
+        if point:
+            indexed.append((position, point[0][0], point[0][1]))
+    return indexed
+
+
+def simplify_path(path, tolerance):
+    """
+    Douglas-Peucker simplification with ``tolerance`` in metres. Returns the kept
+    vertices in their original stored form so the API shape is unchanged.
+    """
+    indexed = _indexed_points(path)
+    if len(indexed) < 3:
+        return [path[position] for position, _, _ in indexed]
+
+    # Local equirectangular projection to metres around the route's first vertex.
+    lat0 = math.radians(indexed[0][1])
+    kx = math.cos(lat0) * EARTH_CIRCUMFERENCE_M / 360
+    ky = EARTH_CIRCUMFERENCE_M / 360
+    xy = [(lng * kx, lat * ky) for _, lat, lng in indexed]
+
+    keep = [False] * len(xy)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(xy) - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xy[first]
+        bx, by = xy[last]
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+
+        farthest, max_dist = None, tolerance
+        for i in range(first + 1, last):
+            px, py = xy[i]
+            if length_sq:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length_sq))
+                ex, ey = px - (ax + t * dx), py - (ay + t * dy)
+            else:
+                ex, ey = px - ax, py - ay
+            dist = math.hypot(ex, ey)
+            if dist > max_dist:
+                farthest, max_dist = i, dist
+
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return [path[indexed[i][0]] for i, kept in enumerate(keep) if kept]
+
+
+def build_simplified_paths(path):
+    """
+    Precompute one simplified copy of ``path`` per zoom in SIMPLIFY_ZOOMS.
+    Each coarser level is simplified from the next finer one, so only the finest
+    pass walks every vertex. Levels that would keep every vertex are left out;
+    the full path serves them.
+    """
+    levels = {}
+    total = len(path or ())
+    source = path
+    for zoom in sorted(SIMPLIFY_ZOOMS, reverse=True):
+        source = simplify_path(source, zoom_tolerance(zoom))
+        if len(source) < total:
+            levels[str(zoom)] = source
+    return levels
+
+
+def select_path(path, simplified_paths, zoom=None, tolerance=None):
+    """
+    Pick the coarsest precomputed level that is still accurate enough for the
+    requested zoom level or tolerance (metres). Falls back to the full path.
+    """
+    if zoom is None and tolerance is None:
+        return path
+    if tolerance is None:
+        tolerance = zoom_tolerance(zoom)
+
+    best_zoom = None
+    for level in simplified_paths or {}:
+        if zoom_tolerance(int(level)) <= tolerance and (best_zoom is None or int(level) < best_zoom):
+            best_zoom = int(level)
+    if best_zoom is None:
+        return path
+    return simplified_paths[str(best_zoom)]
+
+
+def parse_path_resolution(params):
+    """
+    Read the optional ``zoom`` / ``tolerance`` (metres) query parameters accepted
+    by route listing endpoints. Raises ValueError on bad input.
+    """
+    resolution = {}
+    zoom = params.get('zoom')
+    tolerance = params.get('tolerance')
+    if zoom not in (None, ''):
+        resolution['zoom'] = int(zoom)
+        if not 0 <= resolution['zoom'] <= 22:
+            raise ValueError("zoom must be between 0 and 22.")
+    if tolerance not in (None, ''):
+        resolution['tolerance'] = float(tolerance)
+        if resolution['tolerance'] < 0:
+            raise ValueError("tolerance must be a positive number of metres.")
+    return resolution
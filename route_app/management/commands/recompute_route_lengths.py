@@ -0,0 +1,64 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models.functions import Cast
+from opticalfiber_app.cache import TenantCache
+from route_app.models import FiberRoute
+from route_app.codecs import decode_array
+from route_app.geometry import path_length_km
+from route_app.totals import recount_fiber_totals
+
+
+class Command(BaseCommand):
+    help = "Recompute FiberRoute lengths from their paths and report rows whose stored length disagrees."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Routes checked per query.")
+        parser.add_argument('--tolerance', type=Decimal, default=Decimal('0.01'),
+                            help="Allowed difference in km before a row is flagged.")
+        parser.add_argument('--fix', action='store_true', help="Write the computed length to flagged rows.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        tolerance = options['tolerance']
+        fix = options['fix']
+
+        checked = flagged = 0
+        last_id = 0
+        while True:
+            # Read the encoded bytes directly so the path is never materialised as Python lists.
+            batch = list(
+                FiberRoute.objects.filter(pk__gt=last_id)
+                .annotate(raw_path=Cast('path', output_field=models.BinaryField()))
+                .values('id', 'name', 'length_km', 'raw_path')
+                .order_by('id')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1]['id']
+
+            mismatched = []
+            for row in batch:
+                coords = decode_array(row['raw_path'])
+                computed = Decimal(str(round(path_length_km(coords), 2)))
+                if abs(computed - row['length_km']) > tolerance:
+                    mismatched.append(FiberRoute(pk=row['id'], length_km=computed))
+                    self.stdout.write(self.style.WARNING(
+                        f"Route {row['id']} ({row['name']}): stored {row['length_km']} km, "
+                        f"path measures {computed} km"
+                    ))
+            checked += len(batch)
+            flagged += len(mismatched)
+
+            if fix and mismatched:
+                with transaction.atomic():
+                    FiberRoute.objects.bulk_update(mismatched, ['length_km'])
+                    company_ids = set(
+                        FiberRoute.objects.filter(pk__in=[route.pk for route in mismatched])
+                        .values_list('office__company_id', flat=True)
+                    )
+                    recount_fiber_totals(company_ids)
+                    TenantCache.invalidate(company_ids)
+
+        verb = "Fixed" if fix else "Flagged"
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} routes. {verb} {flagged} with a length mismatch."))
@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 06:54
+
+from django.db import migrations, models
+
+from route_app.geometry import build_simplified_paths
+
+
+def populate_simplified_paths(apps, schema_editor):
+    FiberRoute = apps.get_model('route_app', 'FiberRoute')
+    batch = []
+    for route in FiberRoute.objects.only('id', 'path').iterator(chunk_size=500):
+        route.simplified_paths = build_simplified_paths(route.path)
+        batch.append(route)
+        if len(batch) >= 500:
+            FiberRoute.objects.bulk_update(batch, ['simplified_paths'])
+            batch = []
+    if batch:
+        FiberRoute.objects.bulk_update(batch, ['simplified_paths'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('route_app', '0005_alter_fiberroute_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fiberroute',
+            name='simplified_paths',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(populate_simplified_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+import route_app.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('route_app', '0006_fiberroute_simplified_paths'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='fiberroute',
+            old_name='path',
+            new_name='legacy_path',
+        ),
+        migrations.AlterField(
+            model_name='fiberroute',
+            name='legacy_path',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='fiberroute',
+            name='path',
+            field=route_app.fields.CompactPathField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-18 08:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def sum_company_routes(apps, schema_editor):
+    FiberRoute = apps.get_model('route_app', 'FiberRoute')
+    CompanyFiberTotal = apps.get_model('route_app', 'CompanyFiberTotal')
+    sums = (FiberRoute.objects.filter(is_deleted=False).values('office__company_id')
+            .annotate(total=Sum('length_km')))
+    CompanyFiberTotal.objects.bulk_create([
+        CompanyFiberTotal(company_id=row['office__company_id'], total_km=row['total'] or 0)
+        for row in sums
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opticalfiber_app', '0005_staff_profile_picture'),
+        ('route_app', '0007_fiberroute_compact_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyFiberTotal',
+            fields=[
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='fiber_total', serialize=False, to='opticalfiber_app.company')),
+                ('total_km', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.RunPython(sum_company_routes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-18 12:10
+
+from django.db import migrations
+
+import route_app.fields
+
+
+def encode_legacy_paths(apps, schema_editor):
+    FiberRoute = apps.get_model('route_app', 'FiberRoute')
+    last_id = 0
+    while True:
+        batch = list(
+            FiberRoute.objects.filter(pk__gt=last_id, path__isnull=True)
+            .only('id', 'legacy_path').order_by('id')[:500]
+        )
+        if not batch:
+            break
+        last_id = batch[-1].pk
+        for route in batch:
+            route.path = route.legacy_path or []
+        FiberRoute.objects.bulk_update(batch, ['path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('route_app', '0008_companyfibertotal'),
+    ]
+
+    operations = [
+        migrations.RunPython(encode_legacy_paths, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='fiberroute',
+            name='legacy_path',
+        ),
+        migrations.AlterField(
+            model_name='fiberroute',
+            name='path',
+            field=route_app.fields.CompactPathField(),
+        ),
+    ]
@@ -1,14 +1,18 @@
 from office.models import Office
-from django.db import models
+from django.db import models, transaction
 from opticalfiber_app.models import *
 from django.core.exceptions import ValidationError
 from django.utils import timezone
+from decimal import Decimal
+from .geometry import build_simplified_paths, select_path, path_array, path_length_km
+from .fields import CompactPathField
 
 class FiberRoute(models.Model):
     office = models.ForeignKey(Office, on_delete=models.CASCADE, related_name='fiber_routes', db_index=True)
     created_by = models.ForeignKey(Staff, on_delete=models.CASCADE, null=True, blank=True, related_name='fiber_routes_created')
     name = models.CharField(max_length=255, db_index=True)
-    path = models.JSONField()
+    path = CompactPathField()
+    simplified_paths = models.JSONField(default=dict, blank=True, editable=False)
     length_km = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
     is_deleted = models.BooleanField(default=False)
@@ -16,23 +20,38 @@ class FiberRoute(models.Model):
     def __str__(self):
         return f"{self.name} ({self.length_km} km)"
 
-    def clean(self):
-        from payment_app.models import Payment
-        from decimal import Decimal
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_path = instance.__dict__.get('path')
+        return instance
 
-        company = self.office.company.pk
+    @staticmethod
+    def length_from_path(path):
+        """Geodesic length of a path in km, rounded like ``length_km``."""
+        return Decimal(str(round(path_length_km(path_array(path)), 2)))
 
-        total_km = FiberRoute.objects.filter(
-            office__company=company,
-            is_deleted=False
-        ).exclude(pk=self.pk).aggregate(
-            total=models.Sum('length_km')
-        )['total'] or 0
+    def path_for(self, zoom=None, tolerance=None):
+        """Return the path simplified for a map zoom level or a tolerance in metres."""
+        return select_path(self.path, self.simplified_paths, zoom=zoom, tolerance=tolerance)
 
+    def clean(self):
+        from .quota import FREE_FIBER_KM, PAID_CHUNK_KM, paid_chunks
+        from .totals import fiber_total, stored_counted_km
+
+        company = self.office.company_id
+
+        # The company's maintained total, with this route's stored length swapped for its new one.
+        stored = getattr(self, '_stored_counted_km', None)
+        if stored is None and not self._state.adding:
+            stored = stored_counted_km(self.pk)
+        total_km = fiber_total(company)
+        if stored is not None and stored[0] == company:
+            total_km -= stored[1]
         total_km = Decimal(total_km) + Decimal(self.length_km)
 
         # Calculate how much km is beyond the first free 50 km
-        free_limit = Decimal('50')
+        free_limit = FREE_FIBER_KM
         paid_km = total_km - free_limit
 
         if paid_km <= 0:
@@ -46,15 +65,9 @@ class FiberRoute(models.Model):
             return
 
         # Now check if enough payments are made
-        required_chunks = int(paid_km // 50) + (1 if paid_km % 50 else 0)
-
-        paid_chunks = Payment.objects.filter(
-            company=company,
-            status='success',
-            valid_until__gte=timezone.now()
-        ).count()
+        required_chunks = int(paid_km // PAID_CHUNK_KM) + (1 if paid_km % PAID_CHUNK_KM else 0)
 
-        if required_chunks > paid_chunks:
+        if required_chunks > paid_chunks(company):
             raise ValidationError(
                 f"Fiber length limit exceeded. "
                 # f"Free limit: 50 km. Payment required for {required_chunks} chunk(s) "
@@ -62,9 +75,48 @@ class FiberRoute(models.Model):
             )
 
 
+    def counted_km(self):
+        """``(company_id, km)`` this route adds to its company's fiber total."""
+        return self.office.company_id, Decimal('0') if self.is_deleted else Decimal(self.length_km)
+
     def save(self, *args, **kwargs):
-        self.clean()
-        super().save(*args, **kwargs)
+        from .quota import lock_company_quota
+        from .totals import move_fiber_km, stored_counted_km
+
+        update_fields = kwargs.get('update_fields')
+        # The length is derived from the geometry, never taken from the client.
+        self.length_km = self.length_from_path(self.path)
+        if self._state.adding or self.path != getattr(self, '_loaded_path', None):
+            self.simplified_paths = build_simplified_paths(self.path)
+            if update_fields is not None and 'path' in update_fields:
+                kwargs['update_fields'] = update_fields = set(update_fields) | {'simplified_paths', 'length_km'}
+        with transaction.atomic():
+            # Quota checks and total updates of one company run one at a time, so parallel
+            # writers cannot all pass the check against the same total.
+            lock_company_quota(self.office.company_id)
+            previous = None if self._state.adding else stored_counted_km(self.pk, lock=True)
+            self._stored_counted_km = previous
+            try:
+                self.clean()
+            finally:
+                del self._stored_counted_km
+            super().save(*args, **kwargs)
+            # With update_fields, columns left out keep their stored values.
+            current = stored_counted_km(self.pk) if update_fields is not None else self.counted_km()
+            move_fiber_km(previous, current)
+        self._loaded_path = self.path
+
+
+class CompanyFiberTotal(models.Model):
+    """
+    Kilometres of live (not soft-deleted) fiber route a company has, kept up
+    to date as routes are saved and deleted so nothing re-sums the routes.
+    """
+    company = models.OneToOneField(Company, on_delete=models.CASCADE, primary_key=True, related_name='fiber_total')
+    total_km = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.company_id}: {self.total_km} km"
 
 
 
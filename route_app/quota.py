@@ -0,0 +1,60 @@
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Min
+from django.utils import timezone
+from .models import CompanyFiberTotal
+
+FREE_FIBER_KM = Decimal('50')
+# Every successful, unexpired payment unlocks this much fiber beyond the free allowance.
+PAID_CHUNK_KM = Decimal('50')
+
+ENTITLEMENT_KEY = "fiber_entitlement_{company_id}"
+ENTITLEMENT_TIMEOUT = 60 * 60
+# Namespaces the advisory locks taken here (high 32 bits of the key) from any others.
+QUOTA_LOCK_NAMESPACE = 0x46494252
+
+
+def lock_company_quota(company_id):
+    """
+    Serialize fiber quota checks and total updates for one company until the
+    current transaction ends. Must be called inside ``transaction.atomic``.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [(QUOTA_LOCK_NAMESPACE << 32) | company_id])
+        return
+    # Elsewhere the company's total row serves as the lock (SQLite serializes writers by itself).
+    CompanyFiberTotal.objects.get_or_create(company_id=company_id)
+    list(CompanyFiberTotal.objects.select_for_update().filter(company_id=company_id).values_list('pk'))
+
+
+def paid_chunks(company_id):
+    """
+    Number of successful, unexpired payments of the company. Cached until
+    the earliest of them expires, and dropped whenever a payment changes.
+    """
+    from payment_app.models import Payment
+
+    now = timezone.now()
+    key = ENTITLEMENT_KEY.format(company_id=company_id)
+    entry = cache.get(key)
+    if entry is not None and (entry[1] is None or entry[1] >= now):
+        return entry[0]
+
+    ledger = Payment.objects.filter(company_id=company_id, status='success', valid_until__gte=now).aggregate(
+        chunks=Count('id'), expires_at=Min('valid_until')
+    )
+    timeout = ENTITLEMENT_TIMEOUT
+    if ledger['expires_at'] is not None:
+        timeout = min(timeout, max(1, int((ledger['expires_at'] - now).total_seconds())))
+    cache.set(key, (ledger['chunks'], ledger['expires_at']), timeout=timeout)
+    return ledger['chunks']
+
+
+def entitled_km(company_id):
+    return FREE_FIBER_KM + PAID_CHUNK_KM * paid_chunks(company_id)
+
+
+def invalidate_entitlement(company_id):
+    cache.delete(ENTITLEMENT_KEY.format(company_id=company_id))
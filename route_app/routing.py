@@ -0,0 +1,303 @@
+import heapq
+import math
+import threading
+import numpy as np
+from map_app.changelog import change_version, latest_seq
+from map_app.models import ChangeLogEntry
+from .models import FiberRoute
+from .geometry import EARTH_RADIUS_M, haversine_m, path_points
+
+# Vertices of different routes closer than this are treated as one splice point.
+JOIN_DISTANCE_M = 5.0
+
+_JOIN_CELL_DEG = math.degrees(JOIN_DISTANCE_M / EARTH_RADIUS_M)
+
+
+def _distances_m(lat, lng, coords):
+    """Haversine distance in metres from one point to each row of an ``(n, 2)`` array."""
+    phi1, phi2 = math.radians(lat), np.radians(coords[:, 0])
+    d_phi = phi2 - phi1
+    d_lambda = np.radians(coords[:, 1] - lng)
+    a = np.sin(d_phi / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class RoutingGraph:
+    """
+    Routable graph over a company's fiber routes. Every path vertex is a node,
+    consecutive vertices are joined by an edge as long as the segment, and
+    vertices of different routes within JOIN_DISTANCE_M are merged so routes
+    that share an endpoint connect. Routes are added and removed one at a time,
+    so a saved or deleted route patches the graph instead of rebuilding it.
+    """
+
+    def __init__(self, seq=0):
+        self.seq = seq
+        self.coords = []
+        self.refs = []
+        # Ids of released nodes, reused so coords and refs stay as long as the live vertex count.
+        self.free = []
+        self.cells = {}
+        # node -> {neighbour: {route_id: length_m}}
+        self.adjacency = {}
+        self.route_nodes = {}
+        self.routes = {}
+        self.lock = threading.RLock()
+        self._array = None
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / _JOIN_CELL_DEG)), int(math.floor(lng / _JOIN_CELL_DEG))
+
+    def _vertex(self, lat, lng):
+        """The node at ``(lat, lng)``, reusing one within JOIN_DISTANCE_M."""
+        row, col = self._cell(lat, lng)
+        span = int(math.ceil(1 / max(math.cos(math.radians(lat)), 0.01)))
+        for d_row in (-1, 0, 1):
+            for d_col in range(-span, span + 1):
+                for node in self.cells.get((row + d_row, col + d_col), ()):
+                    if haversine_m(lat, lng, *self.coords[node]) <= JOIN_DISTANCE_M:
+                        self.refs[node] += 1
+                        return node
+        if self.free:
+            node = self.free.pop()
+            self.coords[node] = (lat, lng)
+            self.refs[node] = 1
+        else:
+            node = len(self.coords)
+            self.coords.append((lat, lng))
+            self.refs.append(1)
+        self.cells.setdefault((row, col), []).append(node)
+        self.adjacency[node] = {}
+        self._array = None
+        return node
+
+    def _release(self, node):
+        self.refs[node] -= 1
+        if self.refs[node] == 0:
+            self.cells[self._cell(*self.coords[node])].remove(node)
+            del self.adjacency[node]
+            self.free.append(node)
+            self._array = None
+
+    def add_route(self, row):
+        """Insert (or replace) a route from a ``route_rows`` row."""
+        with self.lock:
+            self.remove_route(row['id'])
+            points = path_points(row['path'])
+            if len(points) < 2:
+                return
+            nodes = [self._vertex(lat, lng) for lat, lng in points]
+            for a, b in zip(nodes, nodes[1:]):
+                if a == b:
+                    continue
+                length = haversine_m(*self.coords[a], *self.coords[b])
+                self.adjacency[a].setdefault(b, {})[row['id']] = length
+                self.adjacency[b].setdefault(a, {})[row['id']] = length
+            self.route_nodes[row['id']] = nodes
+            self.routes[row['id']] = {'id': row['id'], 'name': row['name'], 'office_id': row['office_id']}
+
+    def remove_route(self, route_id):
+        with self.lock:
+            nodes = self.route_nodes.pop(route_id, None)
+            self.routes.pop(route_id, None)
+            if nodes is None:
+                return
+            for a, b in zip(nodes, nodes[1:]):
+                for x, y in ((a, b), (b, a)):
+                    edge = self.adjacency.get(x, {}).get(y)
+                    if edge is not None:
+                        edge.pop(route_id, None)
+                        if not edge:
+                            del self.adjacency[x][y]
+            for node in nodes:
+                self._release(node)
+
+    def load_routes(self, company_id, ids):
+        """Re-read ``ids`` from the database, dropping the ones that are gone or soft-deleted."""
+        found = set()
+        for row in route_rows(company_id, ids):
+            self.add_route(row)
+            found.add(row['id'])
+        for route_id in set(ids) - found:
+            self.remove_route(route_id)
+
+    def _vertex_array(self):
+        """``(nodes, coords, rows)`` of the live vertices; ``rows[node]`` is the node's row in ``coords``."""
+        if self._array is None:
+            nodes = np.array(list(self.adjacency), dtype=np.int64)
+            coords = np.array([self.coords[node] for node in nodes], dtype=float).reshape(-1, 2)
+            rows = np.full(len(self.coords), -1, dtype=np.int64)
+            rows[nodes] = np.arange(len(nodes))
+            self._array = (nodes, coords, rows)
+        return self._array
+
+    def _edge(self, routes, office_id):
+        """Cheapest ``(length_m, route_id)`` among parallel routes, honouring an office filter."""
+        best = None
+        for route_id, length in routes.items():
+            if office_id is not None and self.routes[route_id]['office_id'] != office_id:
+                continue
+            if best is None or length < best[0]:
+                best = (length, route_id)
+        return best
+
+    def plan(self, start, end, trench_factor, office_id=None):
+        """
+        Cheapest way from ``start`` to ``end`` (``(lat, lng)`` pairs): trench to
+        an existing route vertex, follow fiber, and trench on to the end, or
+        trench straight across. A metre of fiber costs 1 and a metre of new
+        trench ``trench_factor`` (at least 1), so the straight-line distance to
+        ``end`` is an admissible A* heuristic. Only vertices nearer to ``start``
+        than ``end`` is can start a path cheaper than the direct trench.
+
+        Returns ``{"cost", "existing_m", "trench_m", "segments"}``.
+        """
+        with self.lock:
+            direct = haversine_m(*start, *end)
+            best_cost, best_exit = trench_factor * direct, None
+            nodes, coords, rows = self._vertex_array()
+            if not len(nodes):
+                return self._describe(start, end, best_cost, None, {})
+            entry = trench_factor * _distances_m(start[0], start[1], coords)
+            # Straight-line distance to the end: the A* heuristic and the trench out.
+            remaining = _distances_m(end[0], end[1], coords).tolist()
+            candidates = np.flatnonzero(entry < best_cost)
+
+            cost = dict(zip(nodes[candidates].tolist(), entry[candidates].tolist()))
+            heap = list(zip((entry[candidates] + np.asarray(remaining)[candidates]).tolist(),
+                            entry[candidates].tolist(), nodes[candidates].tolist()))
+            heapq.heapify(heap)
+            previous = {}
+            rows = rows.tolist()
+
+            while heap:
+                estimate, reached, node = heapq.heappop(heap)
+                if estimate >= best_cost:
+                    break
+                if reached > cost[node]:
+                    continue
+                leave = reached + trench_factor * remaining[rows[node]]
+                if leave < best_cost:
+                    best_cost, best_exit = leave, node
+                for neighbour, routes in self.adjacency[node].items():
+                    edge = self._edge(routes, office_id)
+                    if edge is None:
+                        continue
+                    total = reached + edge[0]
+                    if total < cost.get(neighbour, math.inf):
+                        cost[neighbour] = total
+                        previous[neighbour] = (node, edge[1], edge[0])
+                        heapq.heappush(heap, (total + remaining[rows[neighbour]], total, neighbour))
+
+            return self._describe(start, end, best_cost, best_exit, previous)
+
+    def _describe(self, start, end, cost, exit_node, previous):
+        if exit_node is None:
+            direct = haversine_m(*start, *end)
+            return {
+                'cost': round(cost, 1), 'existing_m': 0.0, 'trench_m': round(direct, 1),
+                'segments': [_trench(start, end)],
+            }
+
+        hops = []
+        node = exit_node
+        while node in previous:
+            parent, route_id, length = previous[node]
+            hops.append((parent, node, route_id, length))
+            node = parent
+        hops.reverse()
+        entry = self.coords[node]
+
+        segments = [_trench(start, entry)]
+        for parent, child, route_id, length in hops:
+            last = segments[-1]
+            if last['type'] == 'fiber' and last['route']['id'] == route_id:
+                last['path'].append(list(self.coords[child]))
+                last['length_m'] += length
+            else:
+                route = self.routes[route_id]
+                segments.append({
+                    'type': 'fiber',
+                    'route': {'id': route['id'], 'name': route['name']},
+                    'length_m': length,
+                    'path': [list(self.coords[parent]), list(self.coords[child])],
+                })
+        segments.append(_trench(self.coords[exit_node], end))
+
+        segments = [segment for segment in segments if segment['type'] == 'fiber' or segment['length_m'] > 0]
+        for segment in segments:
+            segment['length_m'] = round(segment['length_m'], 1)
+        existing = sum(segment['length_m'] for segment in segments if segment['type'] == 'fiber')
+        trench = sum(segment['length_m'] for segment in segments if segment['type'] == 'trench')
+        return {'cost': round(cost, 1), 'existing_m': round(existing, 1), 'trench_m': round(trench, 1),
+                'segments': segments}
+
+
+def _trench(a, b):
+    return {'type': 'trench', 'length_m': haversine_m(*a, *b), 'path': [list(a), list(b)]}
+
+
+def route_rows(company_id, ids=None):
+    routes = FiberRoute.objects.filter(office__company_id=company_id, is_deleted=False)
+    if ids is not None:
+        routes = routes.filter(pk__in=ids)
+    return routes.values('id', 'name', 'office_id', 'path').iterator(chunk_size=500)
+
+
+class RoutingGraphCache:
+    """
+    Per-process RoutingGraph per company. The route signals patch this
+    process's graph as soon as a change commits; other processes notice the
+    company's change log version moving and replay the route entries they
+    have not seen, rebuilding only when they fell too far behind.
+    """
+
+    MAX_CATCH_UP_CHANGES = 5000
+
+    def __init__(self):
+        self._graphs = {}
+        self._lock = threading.Lock()
+
+    def build(self, company_id):
+        graph = RoutingGraph(seq=latest_seq(company_id))
+        for row in route_rows(company_id):
+            graph.add_route(row)
+        return graph
+
+    def catch_up(self, company_id, graph):
+        entries = list(
+            ChangeLogEntry.objects.filter(company_id=company_id, seq__gt=graph.seq)
+            .order_by('seq').values('seq', 'entity', 'object_id')[:self.MAX_CATCH_UP_CHANGES + 1]
+        )
+        if len(entries) > self.MAX_CATCH_UP_CHANGES:
+            return False
+        graph.load_routes(company_id, {entry['object_id'] for entry in entries if entry['entity'] == 'route'})
+        if entries:
+            graph.seq = entries[-1]['seq']
+        return True
+
+    def get(self, company_id):
+        version = change_version(company_id)
+        cached = self._graphs.get(company_id)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            cached = self._graphs.get(company_id)
+            if cached and cached[0] == version:
+                return cached[1]
+            if cached and self.catch_up(company_id, cached[1]):
+                graph = cached[1]
+            else:
+                graph = self.build(company_id)
+            self._graphs[company_id] = (version, graph)
+            return graph
+
+    def route_changed(self, company_id, route_id):
+        """Patch this process's graph for one committed route change, if it has one."""
+        cached = self._graphs.get(company_id)
+        if cached:
+            cached[1].load_routes(company_id, [route_id])
+
+
+company_route_graphs = RoutingGraphCache()
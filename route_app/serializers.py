@@ -1,26 +1,46 @@
 from rest_framework import serializers
 from .models import FiberRoute
 from django.core.exceptions import ValidationError
-from django.db.models import Sum
 from office.models import Office
+from .geometry import path_error
+from .totals import fiber_total
 
 class FiberRouteSerializer(serializers.ModelSerializer):
+    path = serializers.JSONField()
+
     class Meta:
         model = FiberRoute
-        fields = '__all__'
+        exclude = ['simplified_paths']
+        read_only_fields = ['length_km']
+
+    def validate_path(self, value):
+        error = path_error(value)
+        if error:
+            raise serializers.ValidationError(error)
+        return value
 
 
 class FiberRouteWithTotalSerializer(serializers.ModelSerializer):
     total_km = serializers.SerializerMethodField()
+    path = serializers.SerializerMethodField()
 
     class Meta:
         model = FiberRoute
-        fields = '__all__'  # or list all fields explicitly + 'total_km'
+        exclude = ['simplified_paths']  # all fields + 'total_km'
+
+    def get_path(self, obj):
+        """Full path, or a precomputed simplified one when the view passes a zoom/tolerance."""
+        return obj.path_for(zoom=self.context.get('zoom'), tolerance=self.context.get('tolerance'))
 
     def get_total_km(self, obj):
-        company_id = obj.office.company_id
-        total = FiberRoute.objects.filter(
-            office__company_id=company_id,
-            is_deleted=False
-        ).aggregate(Sum('length_km'))['length_km__sum']
-        return total or 0
\ No newline at end of file
+        """
+        The company's maintained fiber total. Views pass it in the context so
+        it is read once per response; otherwise it is looked up once per office.
+        """
+        if 'total_km' in self.context:
+            return self.context['total_km']
+        totals = self.context.setdefault('office_total_km', {})
+        if obj.office_id not in totals:
+            company_id = Office.objects.filter(pk=obj.office_id).values_list('company_id', flat=True).first()
+            totals[obj.office_id] = fiber_total(company_id)
+        return totals[obj.office_id]
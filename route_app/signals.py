@@ -1,16 +1,36 @@
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from office.models import Office
+from opticalfiber_app.models import Company
+from payment_app.models import Payment
 from .models import FiberRoute
-from django.core.cache import cache
+from .quota import invalidate_entitlement
+from .routing import company_route_graphs
+from .totals import add_fiber_km
 
-def clear_fiber_routes_cache(office_id):
-    cache_key = f"fiber_routes_office_{office_id}"
-    cache.delete(cache_key)
+def patch_routing_graph(instance):
+    company_id = Office.objects.filter(pk=instance.office_id).values_list('company_id', flat=True).first()
+    route_id = instance.pk  # cleared on the instance once a delete completes
+    if company_id is not None:
+        transaction.on_commit(lambda: company_route_graphs.route_changed(company_id, route_id))
 
 @receiver(post_save, sender=FiberRoute)
 def fiber_route_saved(sender, instance, **kwargs):
-    clear_fiber_routes_cache(instance.office_id)
+    patch_routing_graph(instance)
 
 @receiver(post_delete, sender=FiberRoute)
-def fiber_route_deleted(sender, instance, **kwargs):
-    clear_fiber_routes_cache(instance.office_id)
+def fiber_route_deleted(sender, instance, origin=None, **kwargs):
+    patch_routing_graph(instance)
+    # A company's total goes away with the company.
+    if isinstance(origin, Company) or getattr(origin, 'model', None) is Company:
+        return
+    if not instance.is_deleted:
+        company_id = Office.objects.filter(pk=instance.office_id).values_list('company_id', flat=True).first()
+        add_fiber_km(company_id, -instance.length_km)
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def payment_changed(sender, instance, **kwargs):
+    company_id = instance.company_id
+    transaction.on_commit(lambda: invalidate_entitlement(company_id))
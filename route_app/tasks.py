@@ -1,4 +1,3 @@
-from django.core.cache import cache
 from celery import shared_task
 from django.shortcuts import get_object_or_404
 from opticalfiber_app.models import Staff
@@ -22,12 +21,8 @@ def save_fiber_route_task(self, data, user_id):
         fiber_route = serializer.save(created_by_id=user.pk)
         logger.info(f"Saved FiberRoute with ID: {fiber_route.id}")
 
-        # Invalidate Redis cache
-        company_id = fiber_route.office.company.id
-        cache_key = f"fiber_routes_company_{company_id}"
-        cache.delete(cache_key)
-
-        logger.info(f"Fiber route saved by user {user.id} and cache invalidated for company {company_id}.")
+        # The route's save signal retires the company's cached lists.
+        logger.info(f"Fiber route saved by user {user.id} for company {fiber_route.office.company_id}.")
 
     except Exception as e:
         logger.error(f"Error in save_fiber_route_task: {str(e)}")
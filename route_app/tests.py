@@ -1,3 +1,518 @@
-from django.test import TestCase
+import heapq
+import io
+import math
+import random
+import threading
+import unittest
+from decimal import Decimal
+from unittest import mock
+import numpy as np
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from junction_app.models import JunctionBox
+from office.models import Office
+from opticalfiber_app.models import Company, Staff
+from opticalfiber_app.utils import TokenService
+from payment_app.models import Payment
+from . import views
+from .codecs import decode_array, decode_path, encode_path
+from .fields import CompactPathField
+from .geometry import (
+    SIMPLIFY_ZOOMS, build_simplified_paths, haversine_m, parse_path_resolution, path_array, path_length_km,
+    select_path, simplify_path, snap_to_path, zoom_tolerance,
+)
+from .models import CompanyFiberTotal, FiberRoute
+from .routing import RoutingGraph, RoutingGraphCache
+from .totals import fiber_total
 
-# Create your tests here.
+# Keep tests off the real Redis, and hash staff passwords cheaply.
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+# About 44.5 km along the equator.
+LONG_PATH = [[0.0, 0.0], [0.0, 0.4]]
+
+
+def make_office(name='Acme'):
+    company = Company.objects.create(
+        name=name, registration_number=f'REG-{name}', email='ops@example.com', phone='1', address='x',
+    )
+    return Office.objects.create(company=company, name='HQ', latitude=0, longitude=0, address='x')
+
+
+def wiggly_path(rnd, count=400):
+    """A route heading east with a few metres of GPS noise and the odd real bend."""
+    path, lat, lng = [], 12.97, 77.59
+    for step in range(count):
+        lat += rnd.uniform(-0.00002, 0.00002) + (0.0005 if step % 97 == 0 else 0)
+        lng += 0.0001
+        path.append([lat, lng])
+    return path
+
+
+class SimplifyPathTests(SimpleTestCase):
+
+    def test_straight_line_keeps_its_ends(self):
+        path = [[0.0, 0.001 * step] for step in range(50)]
+        self.assertEqual(simplify_path(path, 1.0), [path[0], path[-1]])
+
+    def test_dropped_vertices_stay_within_tolerance(self):
+        path = wiggly_path(random.Random(3))
+        for tolerance in (2.0, 20.0, 200.0):
+            simplified = simplify_path(path, tolerance)
+            self.assertLess(len(simplified), len(path))
+            self.assertEqual((simplified[0], simplified[-1]), (path[0], path[-1]))
+            coords = np.array(simplified)
+            for lat, lng in path:
+                # The local projections differ slightly; allow a centimetre.
+                self.assertLessEqual(snap_to_path(coords, lat, lng)[0], tolerance + 0.01)
+
+    def test_keeps_stored_vertex_form(self):
+        path = [{'lat': 0.0, 'lng': 0.0}, {'lat': 0.00001, 'lng': 0.001}, {'lat': 0.0, 'lng': 0.002}]
+        self.assertEqual(simplify_path(path, 5.0), [path[0], path[2]])
+        self.assertEqual(simplify_path(path[:2], 5.0), path[:2])
+        self.assertEqual(simplify_path([], 5.0), [])
+
+    def test_levels_coarsen_with_zoom_out(self):
+        path = wiggly_path(random.Random(5))
+        levels = build_simplified_paths(path)
+        self.assertTrue(set(levels) <= {str(zoom) for zoom in SIMPLIFY_ZOOMS})
+        sizes = [len(levels[str(zoom)]) for zoom in sorted(SIMPLIFY_ZOOMS) if str(zoom) in levels]
+        self.assertEqual(sizes, sorted(sizes))
+        self.assertTrue(all(size < len(path) for size in sizes))
+
+    def test_levels_left_out_when_nothing_is_dropped(self):
+        self.assertEqual(build_simplified_paths([[0.0, 0.0], [1.0, 1.0]]), {})
+        self.assertEqual(build_simplified_paths(None), {})
+
+
+class SelectPathTests(SimpleTestCase):
+
+    def setUp(self):
+        self.path = 'full'
+        self.levels = {'8': 'zoom 8', '12': 'zoom 12'}
+
+    def test_full_path_without_resolution(self):
+        self.assertEqual(select_path(self.path, self.levels), 'full')
+
+    def test_coarsest_level_that_is_accurate_enough(self):
+        self.assertEqual(select_path(self.path, self.levels, zoom=6), 'zoom 8')
+        self.assertEqual(select_path(self.path, self.levels, zoom=8), 'zoom 8')
+        self.assertEqual(select_path(self.path, self.levels, zoom=10), 'zoom 12')
+        self.assertEqual(select_path(self.path, self.levels, zoom=13), 'full')
+        self.assertEqual(select_path(self.path, {}, zoom=4), 'full')
+
+    def test_tolerance_in_metres(self):
+        self.assertEqual(select_path(self.path, self.levels, tolerance=zoom_tolerance(12)), 'zoom 12')
+        self.assertEqual(select_path(self.path, self.levels, tolerance=math.inf), 'zoom 8')
+        self.assertEqual(select_path(self.path, self.levels, tolerance=1.0), 'full')
+
+    def test_parse_path_resolution(self):
+        self.assertEqual(parse_path_resolution({}), {})
+        self.assertEqual(parse_path_resolution({'zoom': '10', 'tolerance': ''}), {'zoom': 10})
+        self.assertEqual(parse_path_resolution({'tolerance': '2.5'}), {'tolerance': 2.5})
+        for params in ({'zoom': '23'}, {'zoom': 'x'}, {'tolerance': '-1'}):
+            with self.assertRaises(ValueError):
+                parse_path_resolution(params)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SimplifiedPathStorageTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.office = make_office()
+
+    def test_save_precomputes_levels(self):
+        path = wiggly_path(random.Random(7), count=100)
+        route = FiberRoute.objects.create(office=self.office, name='R', length_km=0, path=path)
+        route.refresh_from_db()
+        self.assertEqual(route.simplified_paths, build_simplified_paths(path))
+        self.assertEqual(route.path_for(zoom=4), route.simplified_paths['4'])
+
+        route.path = path[:2]
+        route.save(update_fields=['path'])
+        route.refresh_from_db()
+        self.assertEqual(route.simplified_paths, {})
+
+
+class PathCodecTests(SimpleTestCase):
+
+    def test_pairs_round_trip(self):
+        path = [[12.971599, 77.594566], [12.972001, 77.595002], [-33.868820, 151.209296]]
+        decoded = decode_path(encode_path(path))
+        self.assertEqual(len(decoded), len(path))
+        for (lat, lng), (expected_lat, expected_lng) in zip(decoded, path):
+            self.assertAlmostEqual(lat, expected_lat, places=6)
+            self.assertAlmostEqual(lng, expected_lng, places=6)
+
+    def test_dict_vertices_come_back_as_dicts(self):
+        path = [{'lat': 12.97, 'lng': 77.59}, {'lat': 12.98, 'lng': 77.6}]
+        self.assertEqual(decode_path(encode_path(path)), path)
+
+    def test_empty_and_missing_paths(self):
+        self.assertEqual(decode_path(encode_path([])), [])
+        self.assertEqual(decode_path(encode_path(None)), [])
+        self.assertEqual(decode_array(encode_path([])).shape, (0, 2))
+
+    def test_rejects_foreign_bytes(self):
+        with self.assertRaises(ValueError):
+            decode_path(b'{"not": "a path"}')
+
+    def test_field_passes_none_through(self):
+        field = CompactPathField()
+        self.assertIsNone(field.from_db_value(None, None, connection))
+        self.assertIsNone(field.to_python(None))
+
+    def test_field_rejects_mixed_vertex_forms(self):
+        field = CompactPathField()
+        with self.assertRaises(ValidationError):
+            field.validate([{'lat': 1, 'lng': 2}, [1, 2]], None)
+        with self.assertRaises(ValidationError):
+            field.validate([{'lat': 1, 'lng': 2, 'alt': 3}], None)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CompactPathStorageTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.office = make_office()
+
+    def test_path_round_trips_through_the_column(self):
+        pairs = FiberRoute.objects.create(office=self.office, name='R', length_km=0, path=[[1.5, 2.25], [1.5, 2.26]])
+        objects = FiberRoute.objects.create(office=self.office, name='R', length_km=0,
+                                            path=[{'lat': 1.5, 'lng': 2.25}, {'lat': 1.5, 'lng': 2.26}])
+        self.assertEqual(FiberRoute.objects.get(pk=pairs.pk).path, [[1.5, 2.25], [1.5, 2.26]])
+        self.assertEqual(FiberRoute.objects.get(pk=objects.pk).path,
+                         [{'lat': 1.5, 'lng': 2.25}, {'lat': 1.5, 'lng': 2.26}])
+        self.assertIsInstance(FiberRoute.objects.values_list('path', flat=True).get(pk=pairs.pk), list)
+
+
+class PathLengthTests(SimpleTestCase):
+
+    def test_matches_segment_by_segment_haversine(self):
+        path = wiggly_path(random.Random(11), count=200)
+        expected = sum(haversine_m(*a, *b) for a, b in zip(path, path[1:])) / 1000
+        self.assertAlmostEqual(path_length_km(path_array(path)), expected, places=9)
+
+    def test_short_paths(self):
+        self.assertEqual(path_length_km(path_array([])), 0.0)
+        self.assertEqual(path_length_km(path_array([[1.0, 2.0]])), 0.0)
+        self.assertEqual(FiberRoute.length_from_path([{'lat': 0, 'lng': 0}, {'lat': 0, 'lng': 0.01}]),
+                         Decimal('1.11'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RouteLengthTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.office = make_office()
+
+    def test_length_comes_from_the_path(self):
+        route = FiberRoute.objects.create(office=self.office, name='R', length_km=Decimal('0.01'),
+                                          path=[[0, 0], [0, 0.01]])
+        self.assertEqual(FiberRoute.objects.get(pk=route.pk).length_km, Decimal('1.11'))
+        route.path = [[0, 0], [0, 0.02]]
+        route.save(update_fields=['path'])
+        self.assertEqual(FiberRoute.objects.get(pk=route.pk).length_km, Decimal('2.22'))
+
+    def test_recompute_command_flags_and_fixes(self):
+        good = FiberRoute.objects.create(office=self.office, name='good', length_km=0, path=[[0, 0], [0, 0.01]])
+        bad = FiberRoute.objects.create(office=self.office, name='bad', length_km=0, path=[[0, 0], [0, 0.01]])
+        FiberRoute.objects.filter(pk=bad.pk).update(length_km=Decimal('9.00'))
+
+        out = io.StringIO()
+        call_command('recompute_route_lengths', batch_size=1, stdout=out)
+        self.assertIn(f"Route {bad.pk} (bad)", out.getvalue())
+        self.assertNotIn(f"Route {good.pk} ", out.getvalue())
+        self.assertEqual(FiberRoute.objects.get(pk=bad.pk).length_km, Decimal('9.00'))
+
+        call_command('recompute_route_lengths', fix=True, stdout=io.StringIO())
+        self.assertEqual(FiberRoute.objects.get(pk=bad.pk).length_km, Decimal('1.11'))
+
+
+def random_network(rnd, count=8):
+    """Routes wandering around a small area, about half of them starting where another one ends."""
+    rows, ends = [], []
+    for route_id in range(1, count + 1):
+        lat, lng = rnd.choice(ends) if ends and rnd.random() < 0.5 else (rnd.uniform(0, 0.02), rnd.uniform(0, 0.02))
+        path = [[lat, lng]]
+        for _ in range(rnd.randint(3, 12)):
+            lat, lng = lat + rnd.uniform(-0.002, 0.002), lng + rnd.uniform(-0.002, 0.002)
+            path.append([lat, lng])
+        ends.append((lat, lng))
+        rows.append({'id': route_id, 'name': f'R{route_id}', 'office_id': route_id % 2, 'path': path})
+    return rows
+
+
+def brute_force_cost(graph, start, end, trench_factor, office_id=None):
+    """Dijkstra from every vertex at once, each seeded with the cost of trenching to it."""
+    cost = {node: trench_factor * haversine_m(*start, *graph.coords[node]) for node in graph.adjacency}
+    heap = [(reached, node) for node, reached in cost.items()]
+    heapq.heapify(heap)
+    while heap:
+        reached, node = heapq.heappop(heap)
+        if reached > cost[node]:
+            continue
+        for neighbour, routes in graph.adjacency[node].items():
+            lengths = [length for route_id, length in routes.items()
+                       if office_id is None or graph.routes[route_id]['office_id'] == office_id]
+            if lengths and reached + min(lengths) < cost[neighbour]:
+                cost[neighbour] = reached + min(lengths)
+                heapq.heappush(heap, (cost[neighbour], neighbour))
+    return min([trench_factor * haversine_m(*start, *end)] +
+               [reached + trench_factor * haversine_m(*graph.coords[node], *end) for node, reached in cost.items()])
+
+
+class RoutingGraphTests(SimpleTestCase):
+
+    def test_plan_matches_brute_force(self):
+        rnd = random.Random(17)
+        for _ in range(20):
+            graph = RoutingGraph()
+            for row in random_network(rnd):
+                graph.add_route(row)
+            for trench_factor in (1.0, 3.0, 20.0):
+                start = (rnd.uniform(0, 0.02), rnd.uniform(0, 0.02))
+                end = (rnd.uniform(0, 0.02), rnd.uniform(0, 0.02))
+                office_id = rnd.choice((None, 0, 1))
+                plan = graph.plan(start, end, trench_factor, office_id=office_id)
+                self.assertAlmostEqual(plan['cost'], brute_force_cost(graph, start, end, trench_factor, office_id),
+                                       delta=0.1)
+                # Segment lengths are rounded to 0.1 m before the trench factor applies.
+                self.assertAlmostEqual(plan['cost'], plan['existing_m'] + trench_factor * plan['trench_m'],
+                                       delta=0.05 * (trench_factor + 1) * len(plan['segments']) + 0.1)
+
+    def test_routes_sharing_an_end_are_joined(self):
+        graph = RoutingGraph()
+        graph.add_route({'id': 1, 'name': 'A', 'office_id': 1, 'path': [[0, 0], [0, 0.01]]})
+        # Ends two metres apart count as one splice point.
+        graph.add_route({'id': 2, 'name': 'B', 'office_id': 1, 'path': [[0.000018, 0.01], [0, 0.02]]})
+        self.assertEqual(len(graph.adjacency), 3)
+        plan = graph.plan((0, 0), (0, 0.02), trench_factor=10)
+        self.assertEqual([segment['route']['id'] for segment in plan['segments'] if segment['type'] == 'fiber'],
+                         [1, 2])
+        self.assertEqual(plan['trench_m'], 0.0)
+
+    def test_patching_matches_a_fresh_graph(self):
+        rnd = random.Random(23)
+        rows = {row['id']: row for row in random_network(rnd, count=12)}
+        graph = RoutingGraph()
+        for row in rows.values():
+            graph.add_route(row)
+        for _ in range(200):
+            route_id = rnd.choice(list(rows))
+            if rnd.random() < 0.3:
+                graph.remove_route(route_id)
+                rows[route_id]['removed'] = True
+            else:
+                rows[route_id] = random_network(rnd, count=1)[0] | {'id': route_id}
+                graph.add_route(rows[route_id])
+
+        fresh = RoutingGraph()
+        for row in rows.values():
+            if not row.get('removed'):
+                fresh.add_route(row)
+        self.assertEqual(set(graph.routes), set(fresh.routes))
+        self.assertEqual(len(graph.adjacency), len(fresh.adjacency))
+        # Released vertex ids are reused, so storage follows the live graph.
+        self.assertEqual(len(graph.coords), len(graph.adjacency) + len(graph.free))
+        self.assertLessEqual(len(graph.coords), 2 * len(fresh.coords))
+        for _ in range(20):
+            start = (rnd.uniform(0, 0.02), rnd.uniform(0, 0.02))
+            end = (rnd.uniform(0, 0.02), rnd.uniform(0, 0.02))
+            self.assertAlmostEqual(graph.plan(start, end, 5.0)['cost'], fresh.plan(start, end, 5.0)['cost'], delta=0.1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RoutingGraphCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.office = make_office()
+        self.company_id = self.office.company_id
+
+    def test_other_processes_catch_up_from_the_change_log(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = FiberRoute.objects.create(office=self.office, name='A', length_km=0, path=[[0, 0], [0, 0.01]])
+        graphs = RoutingGraphCache()
+        graph = graphs.get(self.company_id)
+        self.assertEqual(set(graph.routes), {first.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second = FiberRoute.objects.create(office=self.office, name='B', length_km=0, path=[[0, 0.01], [0, 0.02]])
+            first.is_deleted = True
+            first.save()
+        self.assertIs(graphs.get(self.company_id), graph)
+        self.assertEqual(set(graph.routes), {second.pk})
+
+        with mock.patch.object(RoutingGraphCache, 'MAX_CATCH_UP_CHANGES', 0), \
+                self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        with mock.patch.object(RoutingGraphCache, 'MAX_CATCH_UP_CHANGES', 0):
+            rebuilt = graphs.get(self.company_id)
+        self.assertIsNot(rebuilt, graph)
+        self.assertEqual(rebuilt.routes, {})
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class FiberRoutePlanViewTests(TestCase):
+    url = '/api/route/plan/'
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(views, 'company_route_graphs', RoutingGraphCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.office = make_office()
+        staff = Staff.objects.create(company=self.office.company, name='Ops', email='ops@example.com',
+                                     password='secret', role='admin')
+        self.junction = JunctionBox.objects.create(office=self.office, name='J', latitude=0, longitude=0,
+                                                   post_code='1', staff=staff)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=TokenService.encode(staff))
+
+    def test_follows_existing_fiber(self):
+        route = FiberRoute.objects.create(office=self.office, name='A', length_km=0, path=[[0, 0], [0, 0.01]])
+        response = self.api.get(self.url, {'junction': self.junction.pk, 'lat': 0.0001, 'lng': 0.01})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([segment['type'] for segment in response.data['segments']], ['fiber', 'trench'])
+        self.assertEqual(response.data['segments'][0]['route']['id'], route.pk)
+        self.assertAlmostEqual(response.data['total_m'], response.data['existing_m'] + response.data['trench_m'],
+                               delta=0.1)
+
+    def test_validation(self):
+        self.assertEqual(self.api.get(self.url, {'junction': 999999, 'lat': 0, 'lng': 0}).status_code, 404)
+        for params in ({'lat': 0, 'lng': 0}, {'junction': self.junction.pk, 'lat': 91, 'lng': 0},
+                       {'junction': self.junction.pk, 'lat': 0, 'lng': 0, 'trench_factor': 0.5}):
+            self.assertEqual(self.api.get(self.url, params).status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CompanyFiberTotalTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.office = make_office()
+        self.company_id = self.office.company_id
+
+    def add_route(self, path=LONG_PATH, **kwargs):
+        return FiberRoute.objects.create(office=self.office, name='R', length_km=0, path=path, **kwargs)
+
+    def test_save_adds_length(self):
+        first = self.add_route([[0.0, 0.0], [0.0, 0.1]])
+        second = self.add_route([[0.0, 0.0], [0.0, 0.2]])
+        self.assertEqual(fiber_total(self.company_id), first.length_km + second.length_km)
+
+    def test_path_change_moves_total(self):
+        route = self.add_route([[0.0, 0.0], [0.0, 0.1]])
+        route.path = [[0.0, 0.0], [0.0, 0.3]]
+        route.save()
+        self.assertEqual(fiber_total(self.company_id), route.length_km)
+
+    def test_soft_delete_and_restore(self):
+        kept = self.add_route([[0.0, 0.0], [0.0, 0.1]])
+        removed = self.add_route([[0.0, 0.0], [0.0, 0.2]])
+        removed.is_deleted = True
+        removed.save()
+        self.assertEqual(fiber_total(self.company_id), kept.length_km)
+        removed.is_deleted = False
+        removed.save()
+        self.assertEqual(fiber_total(self.company_id), kept.length_km + removed.length_km)
+
+    def test_delete_subtracts(self):
+        kept = self.add_route([[0.0, 0.0], [0.0, 0.1]])
+        self.add_route([[0.0, 0.0], [0.0, 0.2]]).delete()
+        self.assertEqual(fiber_total(self.company_id), kept.length_km)
+        FiberRoute.objects.filter(pk=kept.pk).delete()
+        self.assertEqual(fiber_total(self.company_id), 0)
+
+    def test_deleting_a_soft_deleted_route_leaves_total(self):
+        kept = self.add_route([[0.0, 0.0], [0.0, 0.1]])
+        self.add_route([[0.0, 0.0], [0.0, 0.2]], is_deleted=True).delete()
+        self.assertEqual(fiber_total(self.company_id), kept.length_km)
+
+    def test_moving_to_another_company(self):
+        other = make_office('Other')
+        route = self.add_route([[0.0, 0.0], [0.0, 0.1]])
+        route.office = other
+        route.save()
+        self.assertEqual(fiber_total(self.company_id), 0)
+        self.assertEqual(fiber_total(other.company_id), route.length_km)
+
+    def test_office_delete_subtracts_its_routes(self):
+        self.add_route([[0.0, 0.0], [0.0, 0.1]])
+        self.office.delete()
+        self.assertEqual(CompanyFiberTotal.objects.get(company_id=self.company_id).total_km, 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FiberQuotaTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.office = make_office()
+
+    def add_route(self):
+        return FiberRoute.objects.create(office=self.office, name='R', length_km=0, path=LONG_PATH)
+
+    def test_free_allowance(self):
+        self.add_route()
+        with self.assertRaises(ValidationError):
+            self.add_route()
+        self.assertEqual(FiberRoute.objects.count(), 1)
+        self.assertEqual(fiber_total(self.office.company_id), FiberRoute.objects.get().length_km)
+
+    def test_payment_extends_allowance(self):
+        self.add_route()
+        with self.assertRaises(ValidationError):
+            self.add_route()
+        with self.captureOnCommitCallbacks(execute=True):
+            Payment.objects.create(
+                company=self.office.company, amount=Decimal('100'), transaction_id='T1', status='success',
+            )
+        self.add_route()
+        self.assertEqual(FiberRoute.objects.count(), 2)
+
+    def test_soft_deleted_routes_free_quota(self):
+        route = self.add_route()
+        route.is_deleted = True
+        route.save()
+        self.add_route()
+        self.assertEqual(FiberRoute.objects.filter(is_deleted=False).count(), 1)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "The quota lock is a PostgreSQL advisory lock.")
+@override_settings(CACHES=LOCMEM_CACHES)
+class FiberQuotaLockTests(TransactionTestCase):
+
+    def test_parallel_saves_cannot_overrun_quota(self):
+        cache.clear()
+        office = make_office()
+        barrier = threading.Barrier(4)
+        outcomes = []
+
+        def add_route():
+            try:
+                barrier.wait()
+                FiberRoute.objects.create(office_id=office.pk, name='R', length_km=0, path=LONG_PATH)
+                outcomes.append('saved')
+            except ValidationError:
+                outcomes.append('rejected')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add_route) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(outcomes), ['rejected', 'rejected', 'rejected', 'saved'])
+        self.assertEqual(fiber_total(office.company_id), FiberRoute.objects.get().length_km)
@@ -0,0 +1,58 @@
+from decimal import Decimal
+from django.db.models import F, Sum
+from .models import CompanyFiberTotal, FiberRoute
+
+
+def fiber_total(company_id):
+    """Kilometres of live fiber route the company has."""
+    total = CompanyFiberTotal.objects.filter(company_id=company_id).values_list('total_km', flat=True).first()
+    return total or Decimal('0')
+
+
+def stored_counted_km(route_id, lock=False):
+    """
+    ``(company_id, km)`` the stored route row counts towards its company's
+    total, or None when there is no such row. ``lock`` holds the row until
+    the transaction ends.
+    """
+    routes = FiberRoute.objects.select_for_update(of=('self',)) if lock else FiberRoute.objects
+    row = routes.filter(pk=route_id).values_list('office__company_id', 'length_km', 'is_deleted').first()
+    if row is None:
+        return None
+    company_id, length_km, is_deleted = row
+    return company_id, Decimal('0') if is_deleted else length_km
+
+
+def add_fiber_km(company_id, km):
+    if not km or company_id is None:
+        return
+    totals = CompanyFiberTotal.objects.filter(company_id=company_id)
+    if not totals.update(total_km=F('total_km') + km):
+        # A company gets its row with its first route; the migration counted every earlier one.
+        CompanyFiberTotal.objects.get_or_create(company_id=company_id)
+        totals.update(total_km=F('total_km') + km)
+
+
+def move_fiber_km(previous, current):
+    """Apply a route's change from ``previous`` to ``current``, both ``(company_id, km)`` or None."""
+    if previous is not None and current is not None and previous[0] == current[0]:
+        add_fiber_km(current[0], current[1] - previous[1])
+        return
+    if previous is not None:
+        add_fiber_km(previous[0], -previous[1])
+    if current is not None:
+        add_fiber_km(*current)
+
+
+def recount_fiber_totals(company_ids):
+    """Set the totals of ``company_ids`` from their routes, after writes that bypass ``FiberRoute.save``."""
+    company_ids = {company_id for company_id in company_ids if company_id is not None}
+    sums = dict(
+        FiberRoute.objects.filter(office__company_id__in=company_ids, is_deleted=False)
+        .values('office__company_id').annotate(total=Sum('length_km'))
+        .values_list('office__company_id', 'total')
+    )
+    for company_id in company_ids:
+        CompanyFiberTotal.objects.update_or_create(
+            company_id=company_id, defaults={'total_km': sums.get(company_id) or 0}
+        )
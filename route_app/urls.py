@@ -4,6 +4,7 @@ from .views import *
 
 urlpatterns = [
     path('add/', FiberRouteCreateView.as_view(), name='route-add'),
+    path('plan/', FiberRoutePlanView.as_view(), name='route-plan'),
     path('list/<int:pk>/', FiberRouteListView.as_view(), name='route-list'),
     path('management/<int:fiber_route_id>/', FiberRouteManagementView.as_view(), name='route-management'),
     path('management/<int:fiber_route_id>/delete/', FiberRouteManagementView.as_view(), name='route-management-delete'),
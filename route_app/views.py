@@ -5,9 +5,15 @@ from rest_framework.exceptions import ValidationError as DRFValidationError
 from django.core.exceptions import ObjectDoesNotExist
 from rest_framework.response import Response
 from rest_framework import status
+from opticalfiber_app.cache import TenantCache
 from opticalfiber_app.views import BaseAPIView
 from .serializers import FiberRouteSerializer,FiberRouteWithTotalSerializer
 from .models import FiberRoute
+from .geometry import parse_path_resolution
+from .routing import company_route_graphs
+from .totals import fiber_total
+from django.conf import settings
+from junction_app.models import JunctionBox
 from .tasks import * 
 from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
@@ -27,11 +33,10 @@ class FiberRouteCreateView(generics.CreateAPIView, BaseAPIView):
 
     def create(self, request, *args, **kwargs):
         try:
-            auth_user = self.authentication(request)
-            if not auth_user:
-                return self.error_response("Authentication failed", status.HTTP_401_UNAUTHORIZED)
+            staff, error = self.get_authenticated_user(request)
+            if error:
+                return self.error_response("Authentication failed", status_code=status.HTTP_401_UNAUTHORIZED)
 
-            staff = get_object_or_404(Staff, pk=auth_user.get("id"))
             mutable_data = request.data.copy()
             mutable_data["created_by"] = staff.pk
 
@@ -68,26 +73,36 @@ class FiberRouteCreateView(generics.CreateAPIView, BaseAPIView):
 
 class FiberRouteListView(BaseAPIView):
     """
-    Retrieves a list of Fiber Routes for the authenticated user's company, using Redis cache.
+    Retrieves the Fiber Routes of one of the authenticated user's offices, served from the tenant cache.
+    Optional ``?zoom=`` or ``?tolerance=`` (metres) return precomputed simplified paths.
     """
     def get(self, request, pk):
         try:
             # Authenticate user
             auth_user = self.authentication(request)
-            if not auth_user:
-                return self.error_response("Authentication failed", status.HTTP_401_UNAUTHORIZED)
+            if isinstance(auth_user, Response):
+                return auth_user
+
+            try:
+                resolution = parse_path_resolution(request.query_params)
+            except ValueError as e:
+                return self.error_response("Invalid path resolution", details=str(e))
 
-            office = get_object_or_404(Office, pk=pk)
+            company_id = auth_user.get("company")
+            office = Office.objects.filter(pk=pk, company_id=company_id).first()
             if not office:
-                return self.error_response("office information missing", status.HTTP_400_BAD_REQUEST)
+                return self.error_response("Office not found", status_code=status.HTTP_404_NOT_FOUND)
 
-            # Fetch from DB if not cached
-            fiber_routes = FiberRoute.objects.filter(office=office)
-            if not fiber_routes.exists():
-                return self.error_response("No fiber routes found for this company", status.HTTP_404_NOT_FOUND)
+            def build():
+                fiber_routes = FiberRoute.objects.filter(office=office)
+                context = dict(resolution, total_km=fiber_total(company_id))
+                return list(FiberRouteWithTotalSerializer(fiber_routes, many=True, context=context).data)
 
-            serializer = FiberRouteWithTotalSerializer(fiber_routes, many=True)
-            serialized_data = serializer.data
+            serialized_data = TenantCache.get_or_build(
+                company_id, 'routes', build, office.pk, resolution.get('zoom'), resolution.get('tolerance')
+            )
+            if not serialized_data:
+                return self.error_response("No fiber routes found for this company", status.HTTP_404_NOT_FOUND)
 
             return Response(serialized_data, status=status.HTTP_200_OK)
 
@@ -174,4 +189,71 @@ class FiberRouteManagementView(BaseAPIView):
 
         except Exception as e:
             logger.exception("Unexpected error updating fiber route %s: %s", fiber_route_id, e)
-            return self.error_response("An unexpected error occurred", status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return self.error_response("An unexpected error occurred", status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class FiberRoutePlanView(BaseAPIView):
+    """
+    Cheapest fiber path for a new connection from junction box ``?junction=``
+    to the point ``?lat=&lng=``, reusing existing routes where that beats
+    trenching. ``?office=`` limits reuse to that office's routes and
+    ``?trench_factor=`` overrides what a metre of new trench costs relative
+    to a metre of existing fiber.
+    """
+
+    MAX_TRENCH_FACTOR = 1000
+
+    def _get_authenticated_company(self, request):
+        """Authenticate user and return company ID or error response"""
+        user = self.authentication(request)
+        if isinstance(user, Response):
+            return None, user
+
+        company_id = user.get("company")
+        if not company_id:
+            logger.warning("Company ID missing in authentication data for user: %s", user.get("id"))
+            return None, self.error_response("Company information missing", status_code=status.HTTP_400_BAD_REQUEST)
+
+        return company_id, None
+
+    def get(self, request):
+        company_id, error_response = self._get_authenticated_company(request)
+        if error_response:
+            return error_response
+
+        params = request.query_params
+        try:
+            junction_id = int(params["junction"])
+            lat, lng = float(params["lat"]), float(params["lng"])
+            office_id = int(params["office"]) if params.get("office") else None
+            trench_factor = float(params.get("trench_factor", settings.ROUTE_PLANNER_TRENCH_COST_FACTOR))
+            if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                raise ValueError("lat/lng are outside valid coordinate ranges.")
+            if not 1 <= trench_factor <= self.MAX_TRENCH_FACTOR:
+                raise ValueError(f"trench_factor must be between 1 and {self.MAX_TRENCH_FACTOR}.")
+        except KeyError as e:
+            return self.error_response("Missing parameter.", details=f"{e.args[0]} is required.")
+        except ValueError as e:
+            return self.error_response("Invalid route plan query.", details=str(e))
+
+        junction = (JunctionBox.objects.filter(pk=junction_id, office__company_id=company_id)
+                    .values("id", "name", "latitude", "longitude").first())
+        if junction is None:
+            return self.error_response("Junction box not found.", status_code=status.HTTP_404_NOT_FOUND)
+
+        try:
+            graph = company_route_graphs.get(company_id)
+            plan = graph.plan((junction["latitude"], junction["longitude"]), (lat, lng), trench_factor,
+                              office_id=office_id)
+            return Response({
+                "start": junction,
+                "end": [lat, lng],
+                "trench_factor": trench_factor,
+                "total_m": round(plan["existing_m"] + plan["trench_m"], 1),
+                **plan,
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unexpected error in FiberRoutePlanView")
+            return self.error_response("An unexpected error occurred", details=str(e),
+                                       status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)